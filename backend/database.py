@@ -1,31 +1,51 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 from typing import Optional
 import os
+import logging
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 _client: Optional[AsyncIOMotorClient] = None
 _db = None
 
 
-async def get_database():
-    """Отримання підключення до бази даних"""
-    global _db
+def _client_options() -> dict:
+    """Налаштування пулу з'єднань MongoDB зі змінних оточення"""
+    return {
+        "maxPoolSize": int(os.getenv("MONGODB_MAX_POOL_SIZE", "100")),
+        "minPoolSize": int(os.getenv("MONGODB_MIN_POOL_SIZE", "0")),
+        "maxIdleTimeMS": int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "60000")),
+        "serverSelectionTimeoutMS": int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+    }
+
+
+async def init_database():
+    """Створення клієнта MongoDB з налаштованим пулом з'єднань"""
+    global _client, _db
     if _db is None:
         mongodb_url = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
         db_name = os.getenv("MONGODB_DB_NAME", "blockmate")
         
-        client = AsyncIOMotorClient(mongodb_url)
-        _db = client[db_name]
+        _client = AsyncIOMotorClient(mongodb_url, **_client_options())
+        _db = _client[db_name]
     
     return _db
 
 
+async def get_database():
+    """Отримання підключення до бази даних"""
+    if _db is None:
+        return await init_database()
+    return _db
+
+
 async def close_database():
     """Закриття підключення до бази даних"""
-    global _client
+    global _client, _db
     if _client:
         _client.close()
-
-
+    _client = None
+    _db = None
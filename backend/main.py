@@ -1,20 +1,82 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List, Optional
+from bson.errors import InvalidId
+from contextlib import asynccontextmanager
+from datetime import datetime
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional
+import json
 import os
 from dotenv import load_dotenv
 
-from backend.database import get_database
-from backend.services.openai_service import OpenAIValidationService
-from backend.models.user import UserModel, GoalModel, ValidationHistory
+from backend.database import get_database, init_database, close_database
+from backend.services.openai_service import (
+    init_validation_service,
+    close_validation_service,
+    get_validation_service,
+)
+from backend.services.admission import AdmissionRejected, admission_controller
+from backend.services.circuit_breaker import llm_circuit_breaker
+from backend.services.metrics import ERRORS, MetricsMiddleware, register_stats, render_metrics
+from backend.services.prompt import render_profile_prefix
+from backend.services.decision_cache import decision_cache
+from backend.services.history_writer import history_writer
+from backend.services.idempotency import (
+    IDEMPOTENCY_KEY_MAX_LENGTH,
+    IdempotencyInProgress,
+    IdempotencyKeyReused,
+    idempotency_store,
+    request_fingerprint,
+)
+from backend.services.model_router import model_router
+from backend.services.rule_classifier import rule_classifier
+from backend.services.validation import (
+    resolve_decision,
+    make_history_item,
+    reminder_time,
+    user_context_from_profile,
+    validate_and_record,
+    stream_and_record,
+    validation_flight,
+    latency_deadline,
+)
+from backend.models.user import UserModel, GoalModel, ValidationHistory, index_status, profile_cache
 
 import uvicorn
 
 load_dotenv()
 
-app = FastAPI(title="BlockMate API", version="1.0.0")
+logger = logging.getLogger(__name__)
+
+# Обмеження для POST /validate/batch
+VALIDATE_BATCH_MAX_ITEMS = int(os.getenv("VALIDATE_BATCH_MAX_ITEMS", "500"))
+VALIDATE_BATCH_CONCURRENCY = int(os.getenv("VALIDATE_BATCH_CONCURRENCY", "8"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Ініціалізація та закриття спільних ресурсів застосунку"""
+    db = await init_database()
+    user_model = UserModel(db)
+    await user_model.ensure_indexes()
+    await idempotency_store.ensure_indexes(db)
+    init_validation_service()
+    history_writer.start(user_model)
+    try:
+        yield
+    finally:
+        # Буфер історії дописується до закриття з'єднання з базою
+        await history_writer.stop()
+        await close_validation_service()
+        await close_database()
 
+
+app = FastAPI(title="BlockMate API", version="1.0.0", lifespan=lifespan)
+
+app.add_middleware(MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -24,12 +86,42 @@ app.add_middleware(
 )
 
 
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request, exc: AdmissionRejected):
+    """Перевантаження або ліміт користувача: просимо повторити пізніше"""
+    status_code = 429 if exc.reason == "user_rate" else 503
+    return JSONResponse(
+        status_code=status_code,
+        content={"detail": "Too many validation requests, please retry later", "reason": exc.reason},
+        headers={"Retry-After": str(max(1, round(exc.retry_after)))},
+    )
+
+
+@app.exception_handler(IdempotencyKeyReused)
+async def idempotency_key_reused_handler(request, exc: IdempotencyKeyReused):
+    return JSONResponse(status_code=422, content={"detail": str(exc)})
+
+
+@app.exception_handler(IdempotencyInProgress)
+async def idempotency_in_progress_handler(request, exc: IdempotencyInProgress):
+    """Дублікат не дочекався першого запиту з тим самим ключем"""
+    return JSONResponse(
+        status_code=409,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(max(1, round(exc.retry_after)))},
+    )
+
+
 # Pydantic models for API
 class RegisterUserRequest(BaseModel):
     telegram_id: int
     username: Optional[str] = None
 
 
+class BulkRegisterRequest(BaseModel):
+    users: List[RegisterUserRequest]
+
+
 class SetGoalsRequest(BaseModel):
     telegram_id: int
     goals: List[str]
@@ -41,6 +133,8 @@ class ValidateRequest(BaseModel):
     telegram_id: int
     request_text: str
     duration_minutes: Optional[int] = None
+    # Бюджет затримки клієнта; не більше VALIDATE_LATENCY_BUDGET_SECONDS
+    latency_budget_ms: Optional[int] = None
 
 
 class ValidateResponse(BaseModel):
@@ -50,6 +144,26 @@ class ValidateResponse(BaseModel):
     reminder_time: Optional[int] = None  # minutes from now
 
 
+class ValidateBatchRequest(BaseModel):
+    items: List[ValidateRequest]
+
+
+class ValidateBatchItemResult(BaseModel):
+    decision: Optional[str] = None
+    message: Optional[str] = None
+    alternative: Optional[str] = None
+    reminder_time: Optional[int] = None
+    error: Optional[str] = None
+
+
+class ValidateBatchResponse(BaseModel):
+    results: List[ValidateBatchItemResult]
+
+
+def has_goals(profile: Dict[str, Any]) -> bool:
+    return any(profile.get(field) for field in ("goals", "allowed_usecases", "forbidden_usecases"))
+
+
 @app.get("/")
 async def root():
     return {"message": "BlockMate API", "status": "running"}
@@ -61,21 +175,35 @@ async def register_user(request: RegisterUserRequest):
     db = await get_database()
     user_model = UserModel(db)
     
-    user = await user_model.get_user(request.telegram_id)
-    if user:
-        return {"message": "User already exists", "user_id": request.telegram_id}
-    
-    new_user = {
-        "telegram_id": request.telegram_id,
-        "username": request.username,
-        "goals": [],
-        "allowed_usecases": [],
-        "forbidden_usecases": [],
-        "history": []
+    created = await user_model.register_user(request.telegram_id, request.username)
+    if not created:
+        # Стан профілю дозволяє боту не робити зайвих запитів до налаштування цілей
+        profile = await user_model.get_profile(request.telegram_id) or {}
+        return {
+            "message": "User already exists",
+            "user_id": request.telegram_id,
+            "created": False,
+            "has_goals": has_goals(profile),
+            "profile_version": profile.get("profile_version", 0)
+        }
+    
+    return {
+        "message": "User registered successfully",
+        "user_id": request.telegram_id,
+        "created": True,
+        "has_goals": False,
+        "profile_version": 0
     }
+
+
+@app.post("/register_users/bulk")
+async def register_users_bulk(request: BulkRegisterRequest):
+    """Масова реєстрація користувачів (міграції, імпорт)"""
+    db = await get_database()
+    user_model = UserModel(db)
     
-    result = await user_model.create_user(new_user)
-    return {"message": "User registered successfully", "user_id": request.telegram_id}
+    result = await user_model.bulk_register([user.model_dump() for user in request.users])
+    return {"message": "Users registered", **result}
 
 
 @app.post("/set_goals")
@@ -84,78 +212,335 @@ async def set_goals(request: SetGoalsRequest):
     db = await get_database()
     user_model = UserModel(db)
     
-    user = await user_model.get_user(request.telegram_id)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
     update_data = {
         "goals": request.goals,
         "allowed_usecases": request.allowed_usecases,
         "forbidden_usecases": request.forbidden_usecases
     }
+    # Блок профілю для промпту рендеримо один раз, а не на кожен /validate
+    update_data["prompt_prefix"] = render_profile_prefix(update_data)
     
-    await user_model.update_user(request.telegram_id, update_data)
-    return {"message": "Goals updated successfully"}
+    profile_version = await user_model.update_profile(request.telegram_id, update_data)
+    if profile_version is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    rule_classifier.invalidate(request.telegram_id)
+    return {"message": "Goals updated successfully", "profile_version": profile_version}
+
+
+def check_idempotency_key(idempotency_key: Optional[str]):
+    if idempotency_key is not None and not 0 < len(idempotency_key) <= IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Idempotency-Key must be 1-{IDEMPOTENCY_KEY_MAX_LENGTH} characters long"
+        )
 
 
 @app.post("/validate", response_model=ValidateResponse)
-async def validate_request(request: ValidateRequest):
-    """Валідація запиту користувача через OpenAI"""
+async def validate_request(
+    request: ValidateRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None),
+):
+    """
+    Валідація запиту користувача через OpenAI
+
+    З заголовком Idempotency-Key повтор запиту повертає збережену
+    відповідь (із заголовком Idempotent-Replayed) без виклику моделі
+    та без нового запису в історії.
+    """
+    deadline = latency_deadline(request.latency_budget_ms)
+    check_idempotency_key(idempotency_key)
     db = await get_database()
     user_model = UserModel(db)
     
-    user = await user_model.get_user(request.telegram_id)
-    if not user:
+    # Профіль без історії; на теплому кеші запиту до БД немає
+    user = await user_model.get_profile(request.telegram_id)
+    if user is None:
         raise HTTPException(status_code=404, detail="User not found. Please register first.")
     
-    # Отримуємо контекст користувача
-    user_context = {
-        "goals": user.get("goals", []),
-        "allowed_usecases": user.get("allowed_usecases", []),
-        "forbidden_usecases": user.get("forbidden_usecases", []),
-    }
-    
-    # Викликаємо OpenAI для валідації
-    openai_service = OpenAIValidationService()
-    validation_result = await openai_service.validate_request(
-        request_text=request.request_text,
-        user_context=user_context,
-        duration_minutes=request.duration_minutes
-    )
-    
-    # Зберігаємо в історію
-    history_item = {
-        "timestamp": validation_result.get("timestamp"),
-        "request": request.request_text,
-        "decision": validation_result["decision"],
-        "alternative": validation_result.get("alternative"),
-        "duration_minutes": request.duration_minutes
-    }
+    if idempotency_key is not None:
+        fingerprint = request_fingerprint(request.telegram_id, request.request_text, request.duration_minutes)
+        stored = await idempotency_store.begin(db, request.telegram_id, idempotency_key, fingerprint)
+        if stored is not None:
+            response.headers["Idempotent-Replayed"] = "true"
+            return ValidateResponse(**stored)
     
-    await user_model.add_to_history(request.telegram_id, history_item)
+    try:
+        # Рішення та запис в історію; однакові паралельні запити об'єднуються
+        validation_result = await validate_and_record(
+            telegram_id=request.telegram_id,
+            request_text=request.request_text,
+            profile=user,
+            duration_minutes=request.duration_minutes,
+            deadline=deadline
+        )
+    except BaseException:
+        if idempotency_key is not None:
+            await idempotency_store.release(db, request.telegram_id, idempotency_key)
+        raise
     
-    return ValidateResponse(
+    result = ValidateResponse(
         decision=validation_result["decision"],
         message=validation_result["message"],
         alternative=validation_result.get("alternative"),
-        reminder_time=request.duration_minutes if validation_result["decision"] == "allow" and request.duration_minutes else None
+        reminder_time=reminder_time(validation_result, request.duration_minutes)
     )
+    if idempotency_key is not None:
+        await idempotency_store.complete(
+            db, request.telegram_id, idempotency_key, fingerprint, result.model_dump()
+        )
+    return result
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/validate/stream")
+async def validate_stream(request: ValidateRequest, idempotency_key: Optional[str] = Header(None)):
+    """
+    Потокова валідація запиту (Server-Sent Events)
+
+    Події: decision (рішення, щойно модель його видала), message (фрагменти
+    тексту), done (повна відповідь як у /validate) або error.
+    Однаковий паралельний запит (подвійний тап) не викликає модель
+    вдруге, а отримує підсумок першого; історія записується один раз.
+    Повтор з тим самим Idempotency-Key одразу віддає збережену відповідь.
+    """
+    deadline = latency_deadline(request.latency_budget_ms)
+    check_idempotency_key(idempotency_key)
+    db = await get_database()
+    user_model = UserModel(db)
+    
+    user = await user_model.get_profile(request.telegram_id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found. Please register first.")
+    
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    if idempotency_key is not None:
+        fingerprint = request_fingerprint(request.telegram_id, request.request_text, request.duration_minutes)
+        stored = await idempotency_store.begin(db, request.telegram_id, idempotency_key, fingerprint)
+        if stored is not None:
+            async def replay() -> AsyncIterator[str]:
+                yield sse_event("decision", {"decision": stored["decision"], "reminder_time": stored["reminder_time"]})
+                yield sse_event("message", {"delta": stored["message"]})
+                yield sse_event("done", stored)
+            
+            return StreamingResponse(
+                replay(), media_type="text/event-stream", headers={**headers, "Idempotent-Replayed": "true"}
+            )
+    
+    completed: Dict[str, Any] = {}
+    
+    async def events() -> AsyncIterator[str]:
+        try:
+            async for event, data in stream_and_record(
+                telegram_id=request.telegram_id,
+                request_text=request.request_text,
+                profile=user,
+                duration_minutes=request.duration_minutes,
+                deadline=deadline
+            ):
+                if event == "decision":
+                    data = {**data, "reminder_time": reminder_time(data, request.duration_minutes)}
+                elif event == "done":
+                    completed.update(data)
+                    data = ValidateResponse(
+                        decision=data["decision"],
+                        message=data["message"],
+                        alternative=data.get("alternative"),
+                        reminder_time=reminder_time(data, request.duration_minutes)
+                    ).model_dump()
+                    if idempotency_key is not None:
+                        await idempotency_store.complete(
+                            db, request.telegram_id, idempotency_key, fingerprint, data
+                        )
+                yield sse_event(event, data)
+        except AdmissionRejected as e:
+            yield sse_event("error", {
+                "detail": "Too many validation requests, please retry later",
+                "retry_after": max(1, round(e.retry_after)),
+            })
+        finally:
+            if idempotency_key is not None and not completed:
+                # Потік обірвався до відповіді — повтор має виконатися заново
+                await idempotency_store.release(db, request.telegram_id, idempotency_key)
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
+
+@app.post("/validate/batch", response_model=ValidateBatchResponse)
+async def validate_batch(request: ValidateBatchRequest):
+    """Пакетна валідація запитів з обмеженою конкурентністю"""
+    if len(request.items) > VALIDATE_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many items: at most {VALIDATE_BATCH_MAX_ITEMS} per batch"
+        )
+    
+    db = await get_database()
+    user_model = UserModel(db)
+    
+    profiles = await user_model.get_profiles([item.telegram_id for item in request.items])
+    semaphore = asyncio.Semaphore(VALIDATE_BATCH_CONCURRENCY)
+    history_entries = []
+    
+    async def validate_item(item: ValidateRequest) -> ValidateBatchItemResult:
+        profile = profiles.get(item.telegram_id)
+        if profile is None:
+            return ValidateBatchItemResult(error="User not found. Please register first.")
+        
+        try:
+            async with semaphore:
+                validation_result = await resolve_decision(
+                    telegram_id=item.telegram_id,
+                    request_text=item.request_text,
+                    user_context=user_context_from_profile(profile),
+                    duration_minutes=item.duration_minutes,
+                    deadline=latency_deadline(item.latency_budget_ms),
+                    # Пакет обмежує VALIDATE_BATCH_CONCURRENCY, а не ліміт частоти користувача
+                    user_rate_limit=False
+                )
+        except AdmissionRejected:
+            return ValidateBatchItemResult(error="Validation service is busy, please retry later")
+        except Exception as e:
+            logger.error(f"Error validating batch item: {e}", exc_info=True)
+            ERRORS.labels("validate_batch", e.__class__.__name__).inc()
+            return ValidateBatchItemResult(error="Validation failed")
+        
+        history_entries.append(
+            (item.telegram_id, make_history_item(item.request_text, item.duration_minutes, validation_result))
+        )
+        return ValidateBatchItemResult(
+            decision=validation_result["decision"],
+            message=validation_result["message"],
+            alternative=validation_result.get("alternative"),
+            reminder_time=reminder_time(validation_result, item.duration_minutes)
+        )
+    
+    results = await asyncio.gather(*(validate_item(item) for item in request.items))
+    
+    # Історія пакета йде через буфер відкладеного запису; рішення вже прийняті,
+    # тож збій запису не має перетворювати відповідь на 500
+    for telegram_id, history_item in history_entries:
+        try:
+            await history_writer.add(telegram_id, history_item)
+        except Exception as e:
+            logger.error(f"Error recording batch history: {e}", exc_info=True)
+            ERRORS.labels("validate_batch_history", e.__class__.__name__).inc()
+    
+    return ValidateBatchResponse(results=list(results))
+
+
+# Джерела лічильників для /internal/stats та /metrics
+STATS_SOURCES = {
+    "decision_cache": decision_cache.stats,
+    "rule_classifier": rule_classifier.stats,
+    "profile_cache": profile_cache.stats,
+    "single_flight": validation_flight.stats,
+    "llm_admission": admission_controller.stats,
+    "llm_calls": lambda: get_validation_service().stats(),
+    "llm_circuit_breaker": llm_circuit_breaker.stats,
+    "model_router": model_router.stats,
+    "history_writer": history_writer.stats,
+    "idempotency": idempotency_store.stats,
+    "indexes": lambda: dict(index_status),
+}
+register_stats(STATS_SOURCES)
+
+
+@app.get("/internal/stats")
+async def internal_stats():
+    """Лічильники кешів та швидких шляхів валідації"""
+    return {name: source() for name, source in STATS_SOURCES.items()}
+
+
+@app.get("/metrics")
+async def metrics():
+    """Метрики у форматі Prometheus"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
 
 
 @app.get("/user/{telegram_id}")
-async def get_user(telegram_id: int):
-    """Отримання інформації про користувача"""
+async def get_user(telegram_id: int, include_history: bool = False):
+    """Отримання профілю користувача (останні записи історії — за запитом)"""
     db = await get_database()
     user_model = UserModel(db)
     
-    user = await user_model.get_user(telegram_id)
+    user = await user_model.get_user(telegram_id, include_history=include_history)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     return user
 
 
-if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+def serialize_history_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        **item,
+        "_id": str(item["_id"]),
+        "timestamp": item["timestamp"].isoformat(),
+    }
 
 
+async def ensure_user_exists(user_model: UserModel, telegram_id: int):
+    if await user_model.get_profile(telegram_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+
+@app.get("/user/{telegram_id}/stats")
+async def get_user_stats(telegram_id: int):
+    """Статистика за поточні день і тиждень (UTC) з готових лічильників"""
+    db = await get_database()
+    user_model = UserModel(db)
+    await ensure_user_exists(user_model, telegram_id)
+    
+    return {"telegram_id": telegram_id, **await user_model.usage.get_current(telegram_id)}
+
+
+@app.get("/user/{telegram_id}/history")
+async def get_user_history(
+    telegram_id: int,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+):
+    """Історія валідацій з курсорною пагінацією (від найновіших)"""
+    db = await get_database()
+    user_model = UserModel(db)
+    await ensure_user_exists(user_model, telegram_id)
+    
+    try:
+        items, next_cursor = await user_model.history.get_page(
+            telegram_id, limit, start=start, end=end, cursor=cursor
+        )
+    except (ValueError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    return {
+        "items": [serialize_history_item(item) for item in items],
+        "next_cursor": next_cursor,
+    }
+
+
+@app.get("/user/{telegram_id}/history/stream")
+async def stream_user_history(
+    telegram_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+):
+    """Вся історія валідацій у форматі NDJSON без завантаження в пам'ять"""
+    db = await get_database()
+    user_model = UserModel(db)
+    await ensure_user_exists(user_model, telegram_id)
+    
+    async def lines() -> AsyncIterator[str]:
+        async for item in user_model.history.iter_items(telegram_id, start=start, end=end):
+            yield json.dumps(serialize_history_item(item), ensure_ascii=False, default=str) + "\n"
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="0.0.0.0", port=8000)
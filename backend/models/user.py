@@ -1,11 +1,162 @@
-from typing import Dict, List, Any, Optional
-from datetime import datetime
+from contextlib import aclosing
+from typing import AsyncIterator, Dict, List, Any, Optional, Set, Tuple
+from datetime import datetime, timedelta, timezone
+import os
+import logging
 from bson import ObjectId
+from pymongo import ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+from backend.services.cache import TTLCache
+from backend.services.metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# Скільки останніх записів історії зберігати прямо в документі користувача
+HISTORY_RECENT_LIMIT = int(os.getenv("HISTORY_RECENT_LIMIT", "20"))
+# Максимальна кількість записів в одному денному бакеті історії
+HISTORY_BUCKET_SIZE = int(os.getenv("HISTORY_BUCKET_SIZE", "200"))
+
+# Кількість бакетів історії, що читаються за один round trip курсора
+HISTORY_CURSOR_BATCH_SIZE = int(os.getenv("HISTORY_CURSOR_BATCH_SIZE", "20"))
+
+# Розмір пачки операцій для масової реєстрації
+BULK_WRITE_BATCH_SIZE = int(os.getenv("BULK_WRITE_BATCH_SIZE", "1000"))
+
+# Скільки останніх пачок пам'ятає лічильник використання, щоб повтор запису не врахувався двічі
+USAGE_APPLIED_MARKERS = 20
+
+# Дозволити старт без унікального індексу users.telegram_id (за наявних дублікатів)
+USERS_ALLOW_DUPLICATE_IDS = os.getenv("USERS_ALLOW_DUPLICATE_IDS", "false").lower() == "true"
+# Коди помилок MongoDB: індекс з тим самим ключем/назвою, але іншими опціями; індексу немає
+INDEX_CONFLICT_CODES = (85, 86)
+INDEX_NOT_FOUND_CODE = 27
+
+PROFILE_CACHE_MAX_ENTRIES = int(os.getenv("PROFILE_CACHE_MAX_ENTRIES", "50000"))
+PROFILE_CACHE_TTL_SECONDS = float(os.getenv("PROFILE_CACHE_TTL_SECONDS", "300"))
+
+# Поля профілю, потрібні для валідації запитів
+PROFILE_FIELDS = ("goals", "allowed_usecases", "forbidden_usecases", "prompt_prefix", "profile_version")
+
+# Стан індексів для /internal/stats
+index_status: Dict[str, bool] = {"users_telegram_id_unique": False}
+
+# Спільний для процесу read-through кеш профілів за telegram_id
+profile_cache = TTLCache(max_entries=PROFILE_CACHE_MAX_ENTRIES, ttl_seconds=PROFILE_CACHE_TTL_SECONDS)
+
+
+def as_datetime(value: Any) -> datetime:
+    """Приведення timestamp (datetime або ISO-рядок) до naive datetime в UTC"""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return datetime.utcnow()
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+    return datetime.utcnow()
+
+
+def encode_history_cursor(item: Dict[str, Any]) -> str:
+    """Курсор пагінації історії: timestamp та _id останнього запису"""
+    return f"{item['timestamp'].isoformat()}_{item['_id']}"
+
+
+def decode_history_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    timestamp, _, item_id = cursor.rpartition("_")
+    return datetime.fromisoformat(timestamp), ObjectId(item_id)
+
+
+def day_start(timestamp: datetime) -> datetime:
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def week_start(timestamp: datetime) -> datetime:
+    """Початок тижня (понеділок, UTC)"""
+    return day_start(timestamp) - timedelta(days=timestamp.weekday())
+
+
+# Період лічильників використання -> початок періоду для моменту часу
+USAGE_PERIODS = {"day": day_start, "week": week_start}
+USAGE_FIELDS = ("allow", "deny", "requested_minutes", "allowed_minutes")
 
 
 class UserModel:
     def __init__(self, db):
         self.collection = db.users
+        self.history = ValidationHistory(db)
+        self.usage = UsageStats(db)
+    
+    async def ensure_indexes(self):
+        """
+        Створення індексів користувачів та історії
+
+        Без унікального індексу users.telegram_id реєстрація upsert'ом
+        може створити дублікати, тож за наявних дублікатів старт падає.
+        USERS_ALLOW_DUPLICATE_IDS=true дозволяє працювати зі звичайним
+        індексом до запуску scripts.dedup_users.
+        """
+        unique = await self.ensure_unique_telegram_id_index()
+        index_status["users_telegram_id_unique"] = unique
+        if not unique:
+            if not USERS_ALLOW_DUPLICATE_IDS:
+                raise RuntimeError(
+                    "Duplicate users.telegram_id values prevent the unique index; "
+                    "run `python -m scripts.dedup_users` or set USERS_ALLOW_DUPLICATE_IDS=true"
+                )
+            logger.error(
+                "Cannot create unique index on users.telegram_id, registration is NOT race-free "
+                "until duplicates are removed with scripts.dedup_users"
+            )
+            await self.collection.create_index("telegram_id")
+        await self.history.ensure_indexes()
+        await self.usage.ensure_indexes()
+    
+    async def ensure_unique_telegram_id_index(self) -> bool:
+        """
+        Унікальний індекс telegram_id; False, якщо заважають дублікати
+
+        Звичайний індекс telegram_id_1, що лишився від старту з
+        USERS_ALLOW_DUPLICATE_IDS, замінюється унікальним, щойно дублікатів
+        не стало.
+        """
+        try:
+            await self.collection.create_index("telegram_id", unique=True)
+            return True
+        except OperationFailure as e:
+            if e.code == 11000:
+                return False
+            if e.code not in INDEX_CONFLICT_CODES:
+                raise
+        
+        if await self.has_duplicate_telegram_ids():
+            return False
+        logger.warning("Replacing non-unique users.telegram_id index with a unique one")
+        try:
+            await self.collection.drop_index("telegram_id_1")
+        except OperationFailure as e:
+            # Інша репліка вже замінила індекс
+            if e.code != INDEX_NOT_FOUND_CODE:
+                raise
+        try:
+            await self.collection.create_index("telegram_id", unique=True)
+        except OperationFailure as e:
+            if e.code == 11000:
+                return False
+            raise
+        return True
+    
+    async def has_duplicate_telegram_ids(self) -> bool:
+        cursor = self.collection.aggregate([
+            {"$group": {"_id": "$telegram_id", "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}},
+            {"$limit": 1},
+        ])
+        async for _ in cursor:
+            return True
+        return False
     
     async def create_user(self, user_data: Dict[str, Any]) -> str:
         """Створення нового користувача"""
@@ -13,13 +164,117 @@ class UserModel:
         result = await self.collection.insert_one(user_data)
         return str(result.inserted_id)
     
-    async def get_user(self, telegram_id: int) -> Optional[Dict[str, Any]]:
+    @staticmethod
+    def _registration_upsert(telegram_id: int, username: Optional[str]) -> Dict[str, Any]:
+        return {
+            "$setOnInsert": {
+                "telegram_id": telegram_id,
+                "username": username,
+                "goals": [],
+                "allowed_usecases": [],
+                "forbidden_usecases": [],
+                "history": [],
+                "created_at": datetime.utcnow(),
+            }
+        }
+    
+    async def register_user(self, telegram_id: int, username: Optional[str] = None) -> bool:
+        """
+        Атомарна реєстрація користувача одним upsert
+
+        Повертає True, якщо користувача створено, і False, якщо він уже існував.
+        """
+        try:
+            result = await self.collection.update_one(
+                {"telegram_id": telegram_id},
+                self._registration_upsert(telegram_id, username),
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Паралельний upsert встиг вставити документ першим
+            return False
+        return result.upserted_id is not None
+    
+    async def bulk_register(self, users: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Масова реєстрація користувачів через bulk_write"""
+        # Дублікати telegram_id у межах одного запиту реєструємо один раз
+        users = list({user["telegram_id"]: user for user in users}.values())
+        created = 0
+        existing = 0
+        for offset in range(0, len(users), BULK_WRITE_BATCH_SIZE):
+            batch = users[offset:offset + BULK_WRITE_BATCH_SIZE]
+            operations = [
+                UpdateOne(
+                    {"telegram_id": user["telegram_id"]},
+                    self._registration_upsert(user["telegram_id"], user.get("username")),
+                    upsert=True
+                )
+                for user in batch
+            ]
+            try:
+                result = await self.collection.bulk_write(operations, ordered=False)
+                upserted = result.upserted_count
+            except BulkWriteError as e:
+                # Конфлікти з паралельною реєстрацією означають, що користувач уже існує
+                if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                    raise
+                upserted = e.details.get("nUpserted", 0)
+            created += upserted
+            existing += len(batch) - upserted
+        return {"created": created, "existing": existing}
+    
+    async def get_user(self, telegram_id: int, include_history: bool = True) -> Optional[Dict[str, Any]]:
         """Отримання користувача за telegram_id"""
-        user = await self.collection.find_one({"telegram_id": telegram_id})
+        projection = None if include_history else {"history": 0}
+        with stage("mongo_read"):
+            user = await self.collection.find_one({"telegram_id": telegram_id}, projection)
         if user and "_id" in user:
             user["_id"] = str(user["_id"])
+        for item in (user or {}).get("history", []):
+            if "_id" in item:
+                item["_id"] = str(item["_id"])
         return user
     
+    async def get_profile(self, telegram_id: int) -> Optional[Dict[str, Any]]:
+        """Отримання лише полів профілю (з кешу або проєкцією з БД)"""
+        profile = profile_cache.get(telegram_id)
+        if profile is None:
+            projection = {field: 1 for field in PROFILE_FIELDS}
+            projection["_id"] = 0
+            with stage("mongo_read"):
+                profile = await self.collection.find_one({"telegram_id": telegram_id}, projection)
+            if profile is None:
+                return None
+            profile_cache.set(telegram_id, profile)
+        return dict(profile)
+    
+    async def get_profiles(self, telegram_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """Профілі кількох користувачів: з кешу, решта — одним запитом $in"""
+        profiles: Dict[int, Dict[str, Any]] = {}
+        missing = []
+        for telegram_id in set(telegram_ids):
+            profile = profile_cache.get(telegram_id)
+            if profile is None:
+                missing.append(telegram_id)
+            else:
+                profiles[telegram_id] = dict(profile)
+        
+        if missing:
+            projection = {field: 1 for field in PROFILE_FIELDS}
+            projection.update({"telegram_id": 1, "_id": 0})
+            with stage("mongo_read"):
+                users = await self.collection.find({"telegram_id": {"$in": missing}}, projection).to_list(length=None)
+            for user in users:
+                telegram_id = user.pop("telegram_id")
+                profile_cache.set(telegram_id, user)
+                profiles[telegram_id] = dict(user)
+        
+        return profiles
+    
+    def invalidate_profile(self, telegram_id: int):
+        """Скидання кешованого профілю"""
+        profile_cache.invalidate(telegram_id)
+    
     async def update_user(self, telegram_id: int, update_data: Dict[str, Any]) -> bool:
         """Оновлення даних користувача"""
         update_data["updated_at"] = datetime.utcnow()
@@ -27,18 +282,70 @@ class UserModel:
             {"telegram_id": telegram_id},
             {"$set": update_data}
         )
+        self.invalidate_profile(telegram_id)
         return result.modified_count > 0
     
-    async def add_to_history(self, telegram_id: int, history_item: Dict[str, Any]) -> bool:
-        """Додавання запису в історію"""
-        if "timestamp" not in history_item:
-            history_item["timestamp"] = datetime.utcnow()
-        
-        result = await self.collection.update_one(
+    async def update_profile(self, telegram_id: int, update_data: Dict[str, Any]) -> Optional[int]:
+        """
+        Оновлення полів профілю зі збільшенням profile_version
+
+        Повертає нову версію профілю або None, якщо користувача немає.
+        """
+        update_data["updated_at"] = datetime.utcnow()
+        user = await self.collection.find_one_and_update(
             {"telegram_id": telegram_id},
-            {"$push": {"history": history_item}}
+            {"$set": update_data, "$inc": {"profile_version": 1}},
+            projection={"profile_version": 1},
+            return_document=ReturnDocument.AFTER
         )
-        return result.modified_count > 0
+        self.invalidate_profile(telegram_id)
+        return user["profile_version"] if user else None
+    
+    async def add_many_to_history(self, entries: List[Tuple[int, Dict[str, Any]]], retry: bool = False):
+        """
+        Пакетне додавання записів історії кількох користувачів
+
+        retry=True — повтор після збою: записи, що вже потрапили в бакети
+        чи в документ користувача, повторно не додаються, а лічильники
+        використання ідемпотентні самі по собі.
+        """
+        by_user: Dict[int, List[Dict[str, Any]]] = {}
+        for telegram_id, history_item in entries:
+            history_item["timestamp"] = as_datetime(history_item.get("timestamp"))
+            history_item.setdefault("_id", ObjectId())
+            by_user.setdefault(telegram_id, []).append(history_item)
+        
+        if not by_user:
+            return
+        
+        with stage("history_write"):
+            if retry:
+                written = await self.history.existing_item_ids(entries)
+                await self.history.add_entries([entry for entry in entries if entry[1]["_id"] not in written])
+            else:
+                await self.history.add_entries(entries)
+            await self.collection.bulk_write(
+                [
+                    UpdateOne(
+                        self._recent_history_filter(telegram_id, items, retry),
+                        {"$push": {"history": {
+                            "$each": items,
+                            "$sort": {"timestamp": 1},
+                            "$slice": -HISTORY_RECENT_LIMIT,
+                        }}}
+                    )
+                    for telegram_id, items in by_user.items()
+                ],
+                ordered=False
+            )
+            await self.usage.record(entries)
+    
+    @staticmethod
+    def _recent_history_filter(telegram_id: int, items: List[Dict[str, Any]], retry: bool) -> Dict[str, Any]:
+        if not retry:
+            return {"telegram_id": telegram_id}
+        # $push усіх записів користувача атомарний: якщо хоч один уже є, є й решта
+        return {"telegram_id": telegram_id, "history._id": {"$nin": [item["_id"] for item in items]}}
 
 
 class GoalModel:
@@ -53,13 +360,311 @@ class GoalModel:
 
 
 class ValidationHistory:
+    """
+    Історія валідацій, згрупована в бакети по користувачу та дню
+
+    Документ бакета:
+    {
+        "telegram_id": 123456,
+        "timestamp": <початок дня, UTC>,
+        "count": 2,
+        "items": [{"_id": ..., "timestamp": ..., "request": ..., "decision": ...}, ...]
+    }
+    Якщо за день набирається більше HISTORY_BUCKET_SIZE записів,
+    створюється наступний бакет з тим самим timestamp.
+    """
+
     def __init__(self, db):
         self.collection = db.validation_history
     
+    async def ensure_indexes(self):
+        """Створення індексів колекції історії"""
+        await self.collection.create_index([("telegram_id", 1), ("timestamp", 1)])
+    
     async def create_history_entry(self, entry_data: Dict[str, Any]) -> str:
         """Створення запису в історії валідацій"""
         entry_data["created_at"] = datetime.utcnow()
         result = await self.collection.insert_one(entry_data)
         return str(result.inserted_id)
+    
+    @staticmethod
+    def _bucket_upsert(
+        telegram_id: int, day: datetime, items: List[Dict[str, Any]]
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Фільтр та оновлення для додавання записів у денний бакет"""
+        now = datetime.utcnow()
+        return (
+            {
+                "telegram_id": telegram_id,
+                "timestamp": day,
+                "count": {"$lte": HISTORY_BUCKET_SIZE - len(items)},
+            },
+            {
+                "$push": {"items": {"$each": items}},
+                "$inc": {"count": len(items)},
+                "$set": {"updated_at": now},
+                "$setOnInsert": {"created_at": now},
+            },
+        )
+    
+    async def add_entries(self, entries: List[Tuple[int, Dict[str, Any]]]):
+        """Додавання багатьох записів одним bulk_write (по операції на бакет)"""
+        by_bucket: Dict[Tuple[int, datetime], List[Dict[str, Any]]] = {}
+        for telegram_id, item in entries:
+            by_bucket.setdefault((telegram_id, day_start(item["timestamp"])), []).append(item)
+        
+        operations = [
+            UpdateOne(*self._bucket_upsert(telegram_id, day, items[offset:offset + HISTORY_BUCKET_SIZE]), upsert=True)
+            for (telegram_id, day), items in by_bucket.items()
+            for offset in range(0, len(items), HISTORY_BUCKET_SIZE)
+        ]
+        if operations:
+            await self.collection.bulk_write(operations, ordered=True)
+    
+    async def existing_item_ids(self, entries: List[Tuple[int, Dict[str, Any]]]) -> Set[ObjectId]:
+        """_id записів, що вже збережені в бакетах (для безпечного повтору запису)"""
+        ids = [item["_id"] for _, item in entries]
+        found = set()
+        cursor = self.collection.find(
+            {"telegram_id": {"$in": list({telegram_id for telegram_id, _ in entries})}, "items._id": {"$in": ids}},
+            {"items._id": 1}
+        )
+        async for bucket in cursor:
+            found.update(item["_id"] for item in bucket["items"])
+        return found.intersection(ids)
+    
+    async def insert_buckets(self, telegram_id: int, items: List[Dict[str, Any]]) -> int:
+        """Масове збереження записів у нові бакети (для міграції)"""
+        by_day: Dict[datetime, List[Dict[str, Any]]] = {}
+        for item in sorted(items, key=lambda i: i["timestamp"]):
+            by_day.setdefault(day_start(item["timestamp"]), []).append(item)
+        
+        now = datetime.utcnow()
+        buckets = []
+        for day, day_items in by_day.items():
+            for offset in range(0, len(day_items), HISTORY_BUCKET_SIZE):
+                chunk = day_items[offset:offset + HISTORY_BUCKET_SIZE]
+                buckets.append({
+                    "telegram_id": telegram_id,
+                    "timestamp": day,
+                    "count": len(chunk),
+                    "items": chunk,
+                    "created_at": now,
+                    "updated_at": now,
+                })
+        
+        if buckets:
+            await self.collection.insert_many(buckets, ordered=False)
+        return len(buckets)
+    
+    async def iter_items(
+        self,
+        telegram_id: int,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Записи історії від найновіших до найстаріших
+
+        Порядок — (timestamp, _id) за спаданням. Бакети читаються з БД
+        пачками по HISTORY_CURSOR_BATCH_SIZE, тож вся історія не
+        завантажується в пам'ять. cursor — значення encode_history_cursor
+        останнього отриманого запису.
+        """
+        after: Optional[Tuple[datetime, ObjectId]] = decode_history_cursor(cursor) if cursor else None
+        start = as_datetime(start) if start else None
+        end = as_datetime(end) if end else None
+        
+        upper = min(filter(None, [end, after[0] if after else None]), default=None)
+        bucket_filter: Dict[str, Any] = {"telegram_id": telegram_id}
+        if start or upper:
+            bucket_filter["timestamp"] = {}
+            if start:
+                bucket_filter["timestamp"]["$gte"] = day_start(start)
+            if upper:
+                bucket_filter["timestamp"]["$lte"] = upper
+        
+        def in_range(item: Dict[str, Any]) -> bool:
+            if start and item["timestamp"] < start:
+                return False
+            if end and item["timestamp"] > end:
+                return False
+            if after and (item["timestamp"], item["_id"]) >= after:
+                return False
+            return True
+        
+        buckets = self.collection.find(
+            bucket_filter,
+            {"timestamp": 1, "items": 1},
+            sort=[("timestamp", -1)],
+            batch_size=HISTORY_CURSOR_BATCH_SIZE,
+        )
+        
+        # Бакети одного дня зливаємо разом, щоб порядок був строгим
+        current_day = None
+        day_items: List[Dict[str, Any]] = []
+        async for bucket in buckets:
+            if bucket["timestamp"] != current_day:
+                for item in sorted(day_items, key=lambda i: (i["timestamp"], i["_id"]), reverse=True):
+                    yield item
+                current_day = bucket["timestamp"]
+                day_items = []
+            day_items.extend(item for item in bucket.get("items", []) if in_range(item))
+        
+        for item in sorted(day_items, key=lambda i: (i["timestamp"], i["_id"]), reverse=True):
+            yield item
+    
+    async def get_page(
+        self,
+        telegram_id: int,
+        limit: int,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Сторінка історії та курсор наступної сторінки"""
+        items = []
+        has_more = False
+        async with aclosing(self.iter_items(telegram_id, start=start, end=end, cursor=cursor)) as stream:
+            async for item in stream:
+                if len(items) == limit:
+                    has_more = True
+                    break
+                items.append(item)
+        return items, encode_history_cursor(items[-1]) if has_more else None
 
 
+class UsageStats:
+    """
+    Денні та тижневі лічильники використання
+
+    Документ лічильника:
+    {
+        "_id": "123456:day:2024-01-01",
+        "telegram_id": 123456,
+        "period": "day",
+        "start": <початок періоду, UTC>,
+        "allow": 7,
+        "deny": 12,
+        "requested_minutes": 85,
+        "allowed_minutes": 30,
+        "apps": {"instagram": 15, "other": 4},
+        "applied": [<маркери останніх пачок>]
+    }
+    Лічильники оновлюються атомарним $inc-upsert під час запису історії,
+    тож статистика читається за _id без сканування історії.
+    """
+
+    def __init__(self, db):
+        self.collection = db.usage_stats
+    
+    async def ensure_indexes(self):
+        await self.collection.create_index("telegram_id")
+    
+    @staticmethod
+    def rollup_id(telegram_id: int, period: str, start: datetime) -> str:
+        return f"{telegram_id}:{period}:{start.date().isoformat()}"
+    
+    @staticmethod
+    def increments(items: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Приріст лічильників для записів історії"""
+        counters: Dict[str, int] = {}
+        for item in items:
+            decision = item.get("decision")
+            minutes = item.get("duration_minutes") or 0
+            fields = {f"apps.{item.get('app') or 'other'}": 1, "requested_minutes": minutes}
+            if decision in ("allow", "deny"):
+                fields[decision] = 1
+            if decision == "allow":
+                fields["allowed_minutes"] = minutes
+            for field, value in fields.items():
+                if value:
+                    counters[field] = counters.get(field, 0) + value
+        return counters
+    
+    @staticmethod
+    def group(entries: List[Tuple[int, Dict[str, Any]]]) -> Dict[Tuple[int, str, datetime], List[Dict[str, Any]]]:
+        """Записи історії за лічильниками (користувач, період, початок періоду)"""
+        groups: Dict[Tuple[int, str, datetime], List[Dict[str, Any]]] = {}
+        for telegram_id, item in entries:
+            for period, period_start in USAGE_PERIODS.items():
+                groups.setdefault((telegram_id, period, period_start(item["timestamp"])), []).append(item)
+        return groups
+    
+    async def record(self, entries: List[Tuple[int, Dict[str, Any]]]):
+        """
+        Додавання записів історії до лічильників одним bulk_write
+
+        Маркер пачки — _id її першого запису. Якщо пачку вже враховано,
+        фільтр не знаходить документ, upsert натрапляє на наявний _id і
+        помилка дубліката ігнорується — повтор запису не рахує двічі.
+        """
+        operations = []
+        for (telegram_id, period, start), items in self.group(entries).items():
+            marker = items[0]["_id"]
+            operations.append(UpdateOne(
+                {"_id": self.rollup_id(telegram_id, period, start), "applied": {"$ne": marker}},
+                {
+                    "$inc": self.increments(items),
+                    "$push": {"applied": {"$each": [marker], "$slice": -USAGE_APPLIED_MARKERS}},
+                    "$setOnInsert": {"telegram_id": telegram_id, "period": period, "start": start},
+                },
+                upsert=True
+            ))
+        
+        # Дублікат означає або вже враховану пачку, або паралельний upsert,
+        # що створив документ першим; у другому випадку повтор оновить його
+        for attempt in range(2):
+            if not operations:
+                return
+            try:
+                await self.collection.bulk_write(operations, ordered=False)
+                return
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                if any(error.get("code") != 11000 for error in errors):
+                    raise
+                operations = [operations[error["index"]] for error in errors]
+    
+    async def get_current(self, telegram_id: int, now: Optional[datetime] = None) -> Dict[str, Dict[str, Any]]:
+        """Лічильники поточного дня та тижня"""
+        now = now or datetime.utcnow()
+        starts = {period: period_start(now) for period, period_start in USAGE_PERIODS.items()}
+        ids = {period: self.rollup_id(telegram_id, period, start) for period, start in starts.items()}
+        
+        with stage("mongo_read"):
+            docs = {
+                doc["_id"]: doc
+                async for doc in self.collection.find({"_id": {"$in": list(ids.values())}}, {"applied": 0})
+            }
+        
+        summary = {}
+        for period, rollup_id in ids.items():
+            doc = docs.get(rollup_id, {})
+            summary[period] = {
+                "start": starts[period].isoformat(),
+                **{field: doc.get(field, 0) for field in USAGE_FIELDS},
+                "apps": doc.get("apps", {}),
+            }
+        return summary
+    
+    async def rebuild(self, telegram_id: int, rollups: Dict[Tuple[str, datetime], Dict[str, int]]) -> int:
+        """Заміна всіх лічильників користувача перерахованими з історії"""
+        operations = []
+        keep = []
+        for (period, start), counters in rollups.items():
+            doc = {"telegram_id": telegram_id, "period": period, "start": start, "applied": [], "apps": {}}
+            for field, value in counters.items():
+                if field.startswith("apps."):
+                    doc["apps"][field[len("apps."):]] = value
+                else:
+                    doc[field] = value
+            rollup_id = self.rollup_id(telegram_id, period, start)
+            keep.append(rollup_id)
+            operations.append(ReplaceOne({"_id": rollup_id}, {"_id": rollup_id, **doc}, upsert=True))
+        
+        if operations:
+            await self.collection.bulk_write(operations, ordered=False)
+        await self.collection.delete_many({"telegram_id": telegram_id, "_id": {"$nin": keep}})
+        return len(operations)
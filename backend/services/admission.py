@@ -0,0 +1,168 @@
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+from backend.services.cache import TTLCache
+from backend.services.metrics import ERRORS
+
+# Скільки викликів моделі може виконуватись одночасно на процес
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+# Скільки запитів може чекати на вільний слот
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "200"))
+# Максимальний час очікування в черзі
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "10"))
+# Token bucket на користувача: швидкість поповнення та розмір "сплеску"
+LLM_USER_RATE_PER_MINUTE = float(os.getenv("LLM_USER_RATE_PER_MINUTE", "10"))
+LLM_USER_BURST = float(os.getenv("LLM_USER_BURST", "5"))
+LLM_USER_BUCKETS_MAX = int(os.getenv("LLM_USER_BUCKETS_MAX", "100000"))
+
+WAIT_SAMPLES = 1000
+
+
+class AdmissionRejected(Exception):
+    """Запит не допущено до моделі (перевантаження або ліміт користувача)"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"LLM admission rejected: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second: float, capacity: float):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def reserve(self) -> float:
+        """Бере токен; повертає, скільки секунд треба зачекати до його появи"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def refund(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class AdmissionController:
+    """
+    Контроль допуску запитів до моделі
+
+    Глобальний семафор обмежує кількість одночасних викликів, token bucket
+    обмежує частоту для кожного користувача, а черга очікування має
+    обмежену довжину та дедлайн.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        max_queue: int = LLM_MAX_QUEUE,
+        queue_timeout: float = LLM_QUEUE_TIMEOUT_SECONDS,
+        user_rate_per_minute: float = LLM_USER_RATE_PER_MINUTE,
+        user_burst: float = LLM_USER_BURST,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.user_rate = user_rate_per_minute / 60
+        self.user_burst = user_burst
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # Неактивні bucket'и видаляються, коли вони вже гарантовано повні
+        self._buckets = TTLCache(
+            max_entries=LLM_USER_BUCKETS_MAX,
+            ttl_seconds=max(user_burst / self.user_rate, 1.0) if self.user_rate > 0 else 3600,
+        )
+
+        self.in_flight = 0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {"queue_full": 0, "deadline": 0, "user_rate": 0}
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self._wait_samples: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+
+    def _user_bucket(self, telegram_id: int) -> TokenBucket:
+        bucket = self._buckets.get(telegram_id)
+        if bucket is None:
+            bucket = TokenBucket(self.user_rate, self.user_burst)
+            self._buckets.set(telegram_id, bucket)
+        return bucket
+
+    def _reject(self, reason: str, retry_after: float):
+        self.rejected[reason] += 1
+        ERRORS.labels("admission", reason).inc()
+        raise AdmissionRejected(reason, retry_after)
+
+    @asynccontextmanager
+    async def acquire(self, telegram_id: Optional[int] = None, timeout: Optional[float] = None) -> AsyncIterator[None]:
+        """Очікування дозволу на виклик моделі"""
+        started = time.monotonic()
+        deadline = started + (self.queue_timeout if timeout is None else timeout)
+
+        bucket = None
+        if telegram_id is not None and self.user_rate > 0:
+            bucket = self._user_bucket(telegram_id)
+            delay = bucket.reserve()
+            if delay > deadline - time.monotonic():
+                bucket.refund()
+                self._reject("user_rate", delay)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+        else:
+            if self.queue_depth >= self.max_queue:
+                if bucket:
+                    bucket.refund()
+                self._reject("queue_full", self.queue_timeout)
+
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                if bucket:
+                    bucket.refund()
+                self._reject("deadline", self.queue_timeout)
+            finally:
+                self.queue_depth -= 1
+
+        waited = time.monotonic() - started
+        self.admitted += 1
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        self._wait_samples.append(waited)
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        samples = sorted(self._wait_samples)
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "wait_seconds_avg": self.wait_seconds_total / self.admitted if self.admitted else 0.0,
+            "wait_seconds_p95": samples[int(len(samples) * 0.95) - 1] if samples else 0.0,
+            "wait_seconds_max": self.wait_seconds_max,
+        }
+
+
+admission_controller = AdmissionController()
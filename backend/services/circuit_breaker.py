@@ -0,0 +1,132 @@
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Tuple
+
+CIRCUIT_WINDOW_SECONDS = float(os.getenv("CIRCUIT_WINDOW_SECONDS", "60"))
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "10"))
+CIRCUIT_ERROR_RATE = float(os.getenv("CIRCUIT_ERROR_RATE", "0.5"))
+CIRCUIT_SLOW_CALL_SECONDS = float(os.getenv("CIRCUIT_SLOW_CALL_SECONDS", "8"))
+CIRCUIT_SLOW_CALL_RATE = float(os.getenv("CIRCUIT_SLOW_CALL_RATE", "0.8"))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+CIRCUIT_HALF_OPEN_PROBES = int(os.getenv("CIRCUIT_HALF_OPEN_PROBES", "3"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker для викликів моделі
+
+    Рахує помилки та повільні виклики у ковзному вікні window_seconds.
+    Коли їх частка перевищує поріг, коло розмикається на open_seconds і
+    виклики не виконуються зовсім. Потім пропускається half_open_probes
+    пробних викликів: якщо всі успішні — коло замикається, інакше знову
+    розмикається.
+    """
+
+    def __init__(
+        self,
+        window_seconds: float = CIRCUIT_WINDOW_SECONDS,
+        min_calls: int = CIRCUIT_MIN_CALLS,
+        error_rate: float = CIRCUIT_ERROR_RATE,
+        slow_call_seconds: float = CIRCUIT_SLOW_CALL_SECONDS,
+        slow_call_rate: float = CIRCUIT_SLOW_CALL_RATE,
+        open_seconds: float = CIRCUIT_OPEN_SECONDS,
+        half_open_probes: int = CIRCUIT_HALF_OPEN_PROBES,
+    ):
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._half_opened_at = 0.0
+        self._probes_started = 0
+        self._probes_succeeded = 0
+        # (час завершення, чи була помилка, чи був виклик повільним)
+        self._calls: Deque[Tuple[float, bool, bool]] = deque()
+
+        self.opened = 0
+        self.short_circuited = 0
+
+    def allow_request(self) -> bool:
+        """Чи можна зараз звертатися до моделі"""
+        if self.state == OPEN:
+            if time.monotonic() - self._opened_at < self.open_seconds:
+                self.short_circuited += 1
+                return False
+            self.state = HALF_OPEN
+            self._half_opened_at = time.monotonic()
+            self._probes_started = 0
+            self._probes_succeeded = 0
+
+        if self.state == HALF_OPEN:
+            if self._probes_started >= self.half_open_probes:
+                # Пробні виклики так і не завершились — пробуємо знову пізніше
+                if time.monotonic() - self._half_opened_at >= self.open_seconds:
+                    self._open()
+                self.short_circuited += 1
+                return False
+            self._probes_started += 1
+
+        return True
+
+    def record_success(self, latency_seconds: float):
+        slow = latency_seconds >= self.slow_call_seconds
+        if self.state == HALF_OPEN:
+            if slow:
+                self._open()
+                return
+            self._probes_succeeded += 1
+            if self._probes_succeeded >= self.half_open_probes:
+                self.state = CLOSED
+                self._calls.clear()
+            return
+        self._record(failed=False, slow=slow)
+
+    def record_failure(self):
+        if self.state == HALF_OPEN:
+            self._open()
+            return
+        self._record(failed=True, slow=False)
+
+    def _record(self, failed: bool, slow: bool):
+        now = time.monotonic()
+        self._calls.append((now, failed, slow))
+        while self._calls and self._calls[0][0] < now - self.window_seconds:
+            self._calls.popleft()
+
+        total = len(self._calls)
+        if self.state != CLOSED or total < self.min_calls:
+            return
+        failures = sum(1 for _, f, _ in self._calls if f)
+        slow_calls = sum(1 for _, _, s in self._calls if s)
+        if failures / total >= self.error_rate or slow_calls / total >= self.slow_call_rate:
+            self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._calls.clear()
+        self.opened += 1
+
+    def stats(self) -> Dict[str, Any]:
+        total = len(self._calls)
+        return {
+            "state": self.state,
+            "window_calls": total,
+            "window_error_rate": sum(1 for _, f, _ in self._calls if f) / total if total else 0.0,
+            "window_slow_rate": sum(1 for _, _, s in self._calls if s) / total if total else 0.0,
+            "opened": self.opened,
+            "short_circuited": self.short_circuited,
+        }
+
+
+llm_circuit_breaker = CircuitBreaker()
@@ -0,0 +1,80 @@
+import hashlib
+import json
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from backend.services.cache import TTLCache
+from backend.services.text_utils import normalize_text, parse_duration, duration_bucket
+
+DECISION_CACHE_MAX_ENTRIES = int(os.getenv("DECISION_CACHE_MAX_ENTRIES", "10000"))
+DECISION_CACHE_MAX_BYTES = int(os.getenv("DECISION_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+DECISION_CACHE_TTL_SECONDS = float(os.getenv("DECISION_CACHE_TTL_SECONDS", "3600"))
+
+# Поля результату валідації, які зберігаються в кеші
+CACHED_FIELDS = ("decision", "message", "alternative")
+
+
+def profile_hash(user_context: Dict[str, Any]) -> str:
+    """Хеш цілей та сценаріїв користувача; змінюється після /set_goals"""
+    payload = json.dumps(
+        [
+            user_context.get("goals", []),
+            user_context.get("allowed_usecases", []),
+            user_context.get("forbidden_usecases", []),
+        ],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _entry_size(key: Tuple[str, str, str], value: Dict[str, Any]) -> int:
+    text = "".join(key) + "".join(str(value.get(field) or "") for field in CACHED_FIELDS)
+    return len(text.encode("utf-8"))
+
+
+class DecisionCache:
+    """Кеш рішень валідації за (текст запиту, тривалість, профіль користувача)"""
+
+    def __init__(
+        self,
+        max_entries: int = DECISION_CACHE_MAX_ENTRIES,
+        max_bytes: int = DECISION_CACHE_MAX_BYTES,
+        ttl_seconds: float = DECISION_CACHE_TTL_SECONDS,
+    ):
+        self._cache = TTLCache(
+            max_entries=max_entries,
+            ttl_seconds=ttl_seconds,
+            max_bytes=max_bytes,
+            sizeof=_entry_size,
+        )
+
+    @staticmethod
+    def make_key(
+        request_text: str,
+        user_context: Dict[str, Any],
+        duration_minutes: Optional[int] = None,
+    ) -> Tuple[str, str, str]:
+        if duration_minutes is None:
+            duration_minutes = parse_duration(request_text)
+        return (
+            normalize_text(request_text),
+            duration_bucket(duration_minutes),
+            profile_hash(user_context),
+        )
+
+    def get(self, key: Tuple[str, str, str]) -> Optional[Dict[str, Any]]:
+        cached = self._cache.get(key)
+        return dict(cached) if cached is not None else None
+
+    def set(self, key: Tuple[str, str, str], result: Dict[str, Any]):
+        self._cache.set(key, {field: result.get(field) for field in CACHED_FIELDS})
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return self._cache.stats()
+
+
+decision_cache = DecisionCache()
@@ -0,0 +1,97 @@
+import os
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from backend.services.cache import TTLCache
+from backend.services.rule_classifier import phrase_tokens, rule_classifier
+
+RECENT_DECISIONS_PER_USER = int(os.getenv("RECENT_DECISIONS_PER_USER", "20"))
+RECENT_DECISIONS_MAX_USERS = int(os.getenv("RECENT_DECISIONS_MAX_USERS", "50000"))
+RECENT_DECISIONS_TTL_SECONDS = float(os.getenv("RECENT_DECISIONS_TTL_SECONDS", str(7 * 24 * 3600)))
+# Мінімальна схожість (Жаккар за стемами) з попереднім запитом
+DEGRADED_SIMILARITY = float(os.getenv("DEGRADED_SIMILARITY", "0.6"))
+# Без жодних сигналів дозволяємо лише короткі сесії
+DEGRADED_DEFAULT_ALLOW_MINUTES = int(os.getenv("DEGRADED_DEFAULT_ALLOW_MINUTES", "10"))
+
+
+class RecentDecisions:
+    """Останні рішення кожного користувача в пам'яті процесу"""
+
+    def __init__(self):
+        self._by_user = TTLCache(max_entries=RECENT_DECISIONS_MAX_USERS, ttl_seconds=RECENT_DECISIONS_TTL_SECONDS)
+
+    def record(self, telegram_id: int, request_text: str, decision: str):
+        decisions: Optional[Deque[Tuple[frozenset, str]]] = self._by_user.get(telegram_id)
+        if decisions is None:
+            decisions = deque(maxlen=RECENT_DECISIONS_PER_USER)
+        decisions.append((frozenset(phrase_tokens(request_text)), decision))
+        self._by_user.set(telegram_id, decisions)
+
+    def most_similar(self, telegram_id: int, request_text: str) -> Optional[Tuple[float, str]]:
+        """(схожість, рішення) для найсхожішого попереднього запиту"""
+        decisions = self._by_user.get(telegram_id)
+        tokens = frozenset(phrase_tokens(request_text))
+        if not decisions or not tokens:
+            return None
+
+        best = None
+        for past_tokens, decision in reversed(decisions):
+            if not past_tokens:
+                continue
+            similarity = len(tokens & past_tokens) / len(tokens | past_tokens)
+            if best is None or similarity > best[0]:
+                best = (similarity, decision)
+        return best
+
+    def similar_decisions(self, telegram_id: int, request_text: str, min_similarity: float) -> List[str]:
+        """Рішення за попередніми запитами, схожими не менше ніж на min_similarity"""
+        decisions = self._by_user.get(telegram_id)
+        tokens = frozenset(phrase_tokens(request_text))
+        if not decisions or not tokens:
+            return []
+        return [
+            decision for past_tokens, decision in decisions
+            if past_tokens and len(tokens & past_tokens) / len(tokens | past_tokens) >= min_similarity
+        ]
+
+
+recent_decisions = RecentDecisions()
+
+
+def degraded_decision(
+    telegram_id: int,
+    request_text: str,
+    user_context: Dict[str, Any],
+    duration_minutes: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Локальне рішення, коли модель недоступна
+
+    Спирається на дозволені/заборонені сценарії користувача та його
+    попередні рішення; без сигналів дозволяє лише короткі сесії.
+    """
+    matches = rule_classifier.match(telegram_id, request_text, user_context)
+    similar = recent_decisions.most_similar(telegram_id, request_text)
+
+    if matches["forbidden"]:
+        decision = "deny"
+    elif matches["allowed"]:
+        decision = "allow"
+    elif similar is not None and similar[0] >= DEGRADED_SIMILARITY:
+        decision = similar[1]
+    else:
+        decision = "allow" if (duration_minutes or 0) and duration_minutes <= DEGRADED_DEFAULT_ALLOW_MINUTES else "deny"
+
+    if decision == "allow":
+        return {
+            "decision": "allow",
+            "message": "Зараз я працюю в спрощеному режимі, але схоже, що це ок. Тримай фокус і не затримуйся довше, ніж планував.",
+            "alternative": None,
+            "source": "degraded",
+        }
+    return {
+        "decision": "deny",
+        "message": "Зараз я працюю в спрощеному режимі й не можу детально розібрати запит, тож краще утриматись.",
+        "alternative": "Зроби коротку паузу без телефону або повернись до своїх цілей.",
+        "source": "degraded",
+    }
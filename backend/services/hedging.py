@@ -0,0 +1,162 @@
+"""
+Хеджування викликів моделі
+
+Якщо основний виклик триває довше за спостережуваний квантиль затримки
+(p95), паралельно надсилається дублікат на запасну модель чи endpoint.
+Перемагає перша валідна відповідь, інший виклик скасовується. Частка
+дублікатів обмежена token bucket'ом, щоб під загальним уповільненням
+хеджування не подвоювало навантаження.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+# До накопичення стількох вимірів використовується LLM_HEDGE_DEFAULT_DELAY_SECONDS
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_DEFAULT_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY_SECONDS", "2"))
+LLM_HEDGE_MIN_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_MIN_DELAY_SECONDS", "0.2"))
+# Не більше такої частки дублікатів від основних викликів
+LLM_HEDGE_MAX_RATIO = float(os.getenv("LLM_HEDGE_MAX_RATIO", "0.1"))
+LLM_HEDGE_BURST = float(os.getenv("LLM_HEDGE_BURST", "5"))
+LLM_LATENCY_SAMPLES = int(os.getenv("LLM_LATENCY_SAMPLES", "500"))
+
+T = TypeVar("T")
+
+
+class LatencyTracker:
+    """Ковзне вікно затримок для оцінки квантилів"""
+
+    def __init__(self, max_samples: int = LLM_LATENCY_SAMPLES):
+        self._samples: Deque[float] = deque(maxlen=max_samples)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        samples = sorted(self._samples)
+        return samples[min(int(len(samples) * q), len(samples) - 1)]
+
+
+class HedgePolicy:
+    """Затримка перед дублікатом та бюджет на дублікати"""
+
+    def __init__(
+        self,
+        quantile: float = LLM_HEDGE_QUANTILE,
+        min_samples: int = LLM_HEDGE_MIN_SAMPLES,
+        default_delay: float = LLM_HEDGE_DEFAULT_DELAY_SECONDS,
+        min_delay: float = LLM_HEDGE_MIN_DELAY_SECONDS,
+        max_ratio: float = LLM_HEDGE_MAX_RATIO,
+        burst: float = LLM_HEDGE_BURST,
+    ):
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_ratio = max_ratio
+        self.burst = burst
+        self.latency = LatencyTracker()
+        self._tokens = burst
+
+        self.primary_calls = 0
+        self.hedged = 0
+        self.throttled = 0
+        self.wins: Dict[str, int] = {"primary": 0, "hedge": 0}
+
+    def delay(self) -> float:
+        """Скільки чекати на основний виклик перед дублікатом"""
+        if len(self.latency) < self.min_samples:
+            return self.default_delay
+        return max(self.latency.quantile(self.quantile), self.min_delay)
+
+    def on_primary(self):
+        self.primary_calls += 1
+        self._tokens = min(self.burst, self._tokens + self.max_ratio)
+
+    def try_hedge(self) -> bool:
+        if self._tokens < 1:
+            self.throttled += 1
+            return False
+        self._tokens -= 1
+        self.hedged += 1
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "delay_seconds": self.delay(),
+            "primary_calls": self.primary_calls,
+            "hedged": self.hedged,
+            "hedge_ratio": self.hedged / self.primary_calls if self.primary_calls else 0.0,
+            "throttled": self.throttled,
+            "wins": dict(self.wins),
+        }
+
+
+async def _cancel(tasks):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def hedged_call(
+    primary: Callable[[], Awaitable[T]],
+    hedge: Optional[Callable[[], Awaitable[T]]],
+    policy: HedgePolicy,
+    timeout: Optional[float] = None,
+) -> Tuple[T, str]:
+    """
+    Основний виклик з дублікатом після policy.delay()
+
+    Дублікат також запускається, якщо основний виклик завершився помилкою
+    раніше. Повертає (результат, "primary" | "hedge"). Якщо обидва виклики
+    невдалі, піднімає помилку основного; після timeout — asyncio.TimeoutError.
+    """
+    started = time.monotonic()
+    deadline = None if timeout is None else started + timeout
+    policy.on_primary()
+    primary_task = asyncio.ensure_future(primary())
+    names = {primary_task: "primary"}
+    pending = {primary_task}
+    hedge_at = started + policy.delay() if hedge is not None else None
+    errors: Dict[str, BaseException] = {}
+
+    try:
+        while pending or hedge_at is not None:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise asyncio.TimeoutError()
+            if hedge_at is not None and (not pending or time.monotonic() >= hedge_at):
+                hedge_at = None
+                if policy.try_hedge():
+                    hedge_task = asyncio.ensure_future(hedge())
+                    names[hedge_task] = "hedge"
+                    pending.add(hedge_task)
+                if not pending:
+                    break
+
+            wait_until = min((t for t in (deadline, hedge_at) if t is not None), default=None)
+            wait_timeout = None if wait_until is None else max(wait_until - time.monotonic(), 0)
+            done, pending = await asyncio.wait(pending, timeout=wait_timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                name = names[task]
+                if name == "primary" and task.exception() is None:
+                    policy.latency.observe(time.monotonic() - started)
+                if task.exception() is None:
+                    policy.wins[name] += 1
+                    return task.result(), name
+                errors[name] = task.exception()
+    finally:
+        if primary_task in pending:
+            # Нижня межа затримки основного виклику — інакше p95 занижується
+            policy.latency.observe(time.monotonic() - started)
+        if pending:
+            await _cancel(pending)
+
+    raise errors.get("primary") or errors["hedge"]
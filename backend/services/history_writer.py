@@ -0,0 +1,191 @@
+"""
+Відкладений запис історії валідацій (write-behind)
+
+/validate не чекає на запис у Mongo: запис кладеться в буфер процесу,
+а фонова задача зливає буфер одним bulk_write кожні
+HISTORY_FLUSH_INTERVAL_MS або щойно набирається HISTORY_FLUSH_MAX_ITEMS
+записів. Невдалий запис повторюється з експоненційною паузою; повтор
+не дублює вже збережені записи. Якщо буфер переповнений, запит чекає
+на місце, а потім пише сам — дані не губляться, але затримка запису
+знову потрапляє у відповідь. Під час зупинки застосунку буфер
+дописується повністю.
+
+Запис з'являється в GET /user/{id}/history із затримкою до одного
+інтервалу злиття.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from backend.database import get_database
+from backend.models.user import UserModel
+from backend.services.metrics import ERRORS
+
+logger = logging.getLogger(__name__)
+
+HISTORY_WRITE_BEHIND_ENABLED = os.getenv("HISTORY_WRITE_BEHIND_ENABLED", "true").lower() == "true"
+HISTORY_FLUSH_INTERVAL_MS = float(os.getenv("HISTORY_FLUSH_INTERVAL_MS", "50"))
+HISTORY_FLUSH_MAX_ITEMS = int(os.getenv("HISTORY_FLUSH_MAX_ITEMS", "500"))
+# Скільки записів може чекати в буфері
+HISTORY_BUFFER_MAX_ITEMS = int(os.getenv("HISTORY_BUFFER_MAX_ITEMS", "10000"))
+# Скільки запит чекає на місце в повному буфері, перш ніж записати сам
+HISTORY_ENQUEUE_TIMEOUT_SECONDS = float(os.getenv("HISTORY_ENQUEUE_TIMEOUT_SECONDS", "1"))
+HISTORY_FLUSH_MAX_RETRIES = int(os.getenv("HISTORY_FLUSH_MAX_RETRIES", "5"))
+HISTORY_FLUSH_RETRY_BASE_SECONDS = float(os.getenv("HISTORY_FLUSH_RETRY_BASE_SECONDS", "0.2"))
+# Скільки чекати на дописування буфера під час зупинки
+HISTORY_SHUTDOWN_TIMEOUT_SECONDS = float(os.getenv("HISTORY_SHUTDOWN_TIMEOUT_SECONDS", "10"))
+
+HistoryEntry = Tuple[int, Dict[str, Any]]
+
+
+class HistoryWriter:
+    """Буфер записів історії з фоновим пакетним записом"""
+
+    def __init__(
+        self,
+        enabled: bool = HISTORY_WRITE_BEHIND_ENABLED,
+        flush_interval_ms: float = HISTORY_FLUSH_INTERVAL_MS,
+        flush_max_items: int = HISTORY_FLUSH_MAX_ITEMS,
+        max_items: int = HISTORY_BUFFER_MAX_ITEMS,
+        enqueue_timeout: float = HISTORY_ENQUEUE_TIMEOUT_SECONDS,
+        max_retries: int = HISTORY_FLUSH_MAX_RETRIES,
+        retry_base: float = HISTORY_FLUSH_RETRY_BASE_SECONDS,
+    ):
+        self.enabled = enabled
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_max_items = flush_max_items
+        self.max_items = max_items
+        self.enqueue_timeout = enqueue_timeout
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.user_model: Optional[UserModel] = None
+        self._buffer: List[HistoryEntry] = []
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._closing = False
+        self._task: Optional[asyncio.Task] = None
+
+        self.enqueued = 0
+        self.written = 0
+        self.flushes = 0
+        self.retries = 0
+        self.failed = 0
+        self.direct_writes = 0
+        self.max_buffered = 0
+
+    def start(self, user_model: UserModel):
+        self.user_model = user_model
+        self._closing = False
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = HISTORY_SHUTDOWN_TIMEOUT_SECONDS):
+        """Дописування буфера та зупинка фонової задачі"""
+        if self._task is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self._task, timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"History writer stopped with {len(self._buffer)} unwritten entries")
+            self.failed += len(self._buffer)
+            self._buffer.clear()
+        self._task = None
+
+    async def add(self, telegram_id: int, history_item: Dict[str, Any]):
+        """Додавання запису в буфер; без фонової задачі — одразу в базу"""
+        if self._task is None or self._closing:
+            await self._write_now([(telegram_id, history_item)])
+            return
+
+        if len(self._buffer) >= self.max_items and not await self._wait_for_space():
+            # Фоновий запис не встигає — пишемо самі, сповільнюючи відповідь
+            self.direct_writes += 1
+            await self._write_now([(telegram_id, history_item)])
+            return
+
+        self._buffer.append((telegram_id, history_item))
+        self.enqueued += 1
+        self.max_buffered = max(self.max_buffered, len(self._buffer))
+        if len(self._buffer) == 1 or len(self._buffer) >= self.flush_max_items:
+            self._wakeup.set()
+
+    async def _wait_for_space(self) -> bool:
+        deadline = time.monotonic() + self.enqueue_timeout
+        while len(self._buffer) >= self.max_items:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self._space.clear()
+            try:
+                await asyncio.wait_for(self._space.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    async def _write_now(self, entries: List[HistoryEntry]):
+        user_model = self.user_model or UserModel(await get_database())
+        await user_model.add_many_to_history(entries)
+
+    async def _run(self):
+        while True:
+            if not self._buffer:
+                if self._closing:
+                    return
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            if len(self._buffer) < self.flush_max_items and not self._closing:
+                # Перший запис пачки чекає не довше за інтервал злиття
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = self._buffer[:self.flush_max_items]
+            del self._buffer[:len(batch)]
+            self._space.set()
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[HistoryEntry]):
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.user_model.add_many_to_history(batch, retry=attempt > 0)
+            except Exception as e:
+                ERRORS.labels("history_flush", e.__class__.__name__).inc()
+                if attempt == self.max_retries:
+                    self.failed += len(batch)
+                    logger.error(f"Dropping {len(batch)} history entries after {attempt + 1} attempts: {e}")
+                    return
+                self.retries += 1
+                delay = self.retry_base * 2 ** attempt
+                logger.warning(f"History flush failed (attempt {attempt + 1}), retrying in {delay:.1f} s: {e}")
+                await asyncio.sleep(delay)
+            else:
+                self.written += len(batch)
+                self.flushes += 1
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "buffered": len(self._buffer),
+            "max_buffered": self.max_buffered,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "flushes": self.flushes,
+            "avg_batch": self.written / self.flushes if self.flushes else 0.0,
+            "retries": self.retries,
+            "failed": self.failed,
+            "direct_writes": self.direct_writes,
+        }
+
+
+history_writer = HistoryWriter()
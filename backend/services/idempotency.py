@@ -0,0 +1,222 @@
+"""
+Ключі ідемпотентності для /validate
+
+Клієнт передає заголовок Idempotency-Key (бот — update_id Telegram).
+Перший запит з ключем займає його в колекції idempotency_keys
+(запис "pending"), а після відповіді зберігає її там і в LRU процесу.
+Повтор з тим самим ключем отримує збережену відповідь без виклику
+моделі та без запису в історію. Паралельний дублікат чекає на перший
+запит: у тому ж процесі — на його завершення, в іншому — опитуючи
+колекцію. Записи видаляє TTL-індекс через IDEMPOTENCY_TTL_SECONDS.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from backend.services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_CACHE_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_CACHE_MAX_ENTRIES", "10000"))
+# Скільки дублікат чекає на завершення першого запиту
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "30"))
+IDEMPOTENCY_POLL_SECONDS = float(os.getenv("IDEMPOTENCY_POLL_SECONDS", "0.1"))
+# Незавершений запис, старший за це, вважається покинутим (процес упав)
+IDEMPOTENCY_LOCK_SECONDS = float(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "60"))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+
+class IdempotencyKeyReused(Exception):
+    """Ключ уже використано для іншого запиту"""
+
+
+class IdempotencyInProgress(Exception):
+    """Запит з цим ключем ще виконується"""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Request with this Idempotency-Key is still in progress")
+        self.retry_after = retry_after
+
+
+def request_fingerprint(telegram_id: int, request_text: str, duration_minutes: Optional[int]) -> str:
+    """Відбиток тіла запиту, щоб ключ не можна було повторно використати для іншого"""
+    payload = json.dumps([telegram_id, request_text, duration_minutes], ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class IdempotencyStore:
+    """Збережені відповіді за ключами ідемпотентності"""
+
+    def __init__(
+        self,
+        ttl_seconds: int = IDEMPOTENCY_TTL_SECONDS,
+        max_entries: int = IDEMPOTENCY_CACHE_MAX_ENTRIES,
+        wait_seconds: float = IDEMPOTENCY_WAIT_SECONDS,
+        poll_seconds: float = IDEMPOTENCY_POLL_SECONDS,
+        lock_seconds: float = IDEMPOTENCY_LOCK_SECONDS,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.wait_seconds = wait_seconds
+        self.poll_seconds = poll_seconds
+        self.lock_seconds = lock_seconds
+        self.cache = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        # Ключі, зайняті запитами цього процесу: future та коли зайнято
+        self._pending: Dict[str, Tuple[asyncio.Future, float]] = {}
+
+        self.executed = 0
+        self.replayed = 0
+        self.waited = 0
+        self.in_progress = 0
+        self.reused = 0
+
+    async def ensure_indexes(self, db):
+        await db.idempotency_keys.create_index("created_at", expireAfterSeconds=self.ttl_seconds)
+
+    @staticmethod
+    def record_id(telegram_id: int, key: str) -> str:
+        return f"{telegram_id}:{key}"
+
+    async def begin(self, db, telegram_id: int, key: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """
+        Збережена відповідь для повтору або None
+
+        None означає, що ключ зайняв цей запит: після відповіді треба
+        викликати complete(), а при помилці — release().
+        """
+        record_id = self.record_id(telegram_id, key)
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            cached = self.cache.get(record_id)
+            if cached is not None:
+                return self._replay(cached, fingerprint)
+
+            pending = self._pending.get(record_id)
+            if pending is not None and time.monotonic() - pending[1] > self.lock_seconds:
+                # Власник так і не завершив запит (наприклад, потік не стартував)
+                self._resolve(record_id)
+                pending = None
+            if pending is not None:
+                # Дублікат у цьому процесі: чекаємо на перший запит і перевіряємо знову
+                self.waited += 1
+                await self._wait(pending[0], deadline)
+                continue
+
+            future = asyncio.get_running_loop().create_future()
+            self._pending[record_id] = (future, time.monotonic())
+            try:
+                record = await self._claim(db, record_id, fingerprint)
+            except BaseException:
+                self._resolve(record_id)
+                raise
+            if record is None:
+                self.executed += 1
+                return None
+            self._resolve(record_id)
+
+            if record["status"] == "done":
+                self.cache.set(record_id, record)
+                return self._replay(record, fingerprint)
+
+            # Перший запит виконується в іншому процесі
+            if record["fingerprint"] != fingerprint:
+                self.reused += 1
+                raise IdempotencyKeyReused("Idempotency-Key was already used for a different request")
+            self.waited += 1
+            if time.monotonic() + self.poll_seconds > deadline:
+                self.in_progress += 1
+                raise IdempotencyInProgress(self.poll_seconds)
+            await asyncio.sleep(self.poll_seconds)
+
+    async def complete(self, db, telegram_id: int, key: str, fingerprint: str, response: Dict[str, Any]):
+        """Збереження відповіді для повторів"""
+        record_id = self.record_id(telegram_id, key)
+        self.cache.set(record_id, {"status": "done", "fingerprint": fingerprint, "response": response})
+        self._resolve(record_id)
+        try:
+            await db.idempotency_keys.update_one(
+                {"_id": record_id},
+                {"$set": {"status": "done", "response": response, "completed_at": datetime.utcnow()}}
+            )
+        except Exception as e:
+            # Відповідь уже є; повтор в іншому процесі просто виконається знову
+            logger.error(f"Cannot store idempotent response: {e}")
+
+    async def release(self, db, telegram_id: int, key: str):
+        """Звільнення ключа після помилки, щоб повтор виконався заново"""
+        record_id = self.record_id(telegram_id, key)
+        self._resolve(record_id)
+        try:
+            await db.idempotency_keys.delete_one({"_id": record_id, "status": "pending"})
+        except Exception as e:
+            logger.error(f"Cannot release idempotency key: {e}")
+
+    def _replay(self, record: Dict[str, Any], fingerprint: str) -> Dict[str, Any]:
+        if record["fingerprint"] != fingerprint:
+            self.reused += 1
+            raise IdempotencyKeyReused("Idempotency-Key was already used for a different request")
+        self.replayed += 1
+        return record["response"]
+
+    async def _wait(self, pending: asyncio.Future, deadline: float):
+        remaining = deadline - time.monotonic()
+        if remaining > 0:
+            # shield: тайм-аут дубліката не скасовує спільне очікування
+            await asyncio.wait({asyncio.shield(pending)}, timeout=remaining)
+        if not pending.done():
+            self.in_progress += 1
+            raise IdempotencyInProgress(max(1.0, self.poll_seconds))
+
+    def _resolve(self, record_id: str):
+        pending = self._pending.pop(record_id, None)
+        if pending is not None and not pending[0].done():
+            pending[0].set_result(None)
+
+    async def _claim(self, db, record_id: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """Займає ключ; повертає наявний запис, якщо ключ уже зайнято"""
+        now = datetime.utcnow()
+        try:
+            await db.idempotency_keys.insert_one(
+                {"_id": record_id, "status": "pending", "fingerprint": fingerprint, "created_at": now}
+            )
+            return None
+        except DuplicateKeyError:
+            pass
+
+        record = await db.idempotency_keys.find_one({"_id": record_id})
+        if record is None:
+            # Запис щойно видалили (release або TTL) — пробуємо ще раз
+            return await self._claim(db, record_id, fingerprint)
+        if record["status"] == "pending" and record["created_at"] < now - timedelta(seconds=self.lock_seconds):
+            # Власник ключа, схоже, впав — забираємо ключ собі
+            taken = await db.idempotency_keys.find_one_and_update(
+                {"_id": record_id, "status": "pending", "created_at": record["created_at"]},
+                {"$set": {"fingerprint": fingerprint, "created_at": now}},
+                return_document=ReturnDocument.AFTER
+            )
+            if taken is not None:
+                return None
+            record = await db.idempotency_keys.find_one({"_id": record_id}) or record
+        return record
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "executed": self.executed,
+            "replayed": self.replayed,
+            "waited": self.waited,
+            "in_progress": self.in_progress,
+            "reused": self.reused,
+            "pending": len(self._pending),
+            "cache": self.cache.stats(),
+        }
+
+
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,416 @@
+"""
+Провайдери LLM для валідації
+
+LLMProvider — мінімальний інтерфейс над чат-моделлю: complete() повертає
+повний текст відповіді, open_stream() — потік фрагментів тексту. Тимчасові
+помилки провайдера зводяться до ProviderError, тож повтори, бюджет
+затримки та хеджування в OpenAIValidationService не залежать від SDK.
+
+Нові типи endpoint'ів додаються через register_provider().
+"""
+import asyncio
+import json
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+import httpx
+import openai
+
+from backend.services.prompt import extract_request
+
+# Налаштування HTTP-транспорту та таймаутів для OpenAI
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4.1-nano")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "20"))
+OPENAI_CONNECT_TIMEOUT_SECONDS = float(os.getenv("OPENAI_CONNECT_TIMEOUT_SECONDS", "5"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+OPENAI_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY_SECONDS", "30"))
+
+# Затримка локального фейкового провайдера
+LLM_FAKE_LATENCY_MS = float(os.getenv("LLM_FAKE_LATENCY_MS", "0"))
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+)
+
+DEFAULT_TEMPERATURE = 0.7
+
+# Маркери бездумного гортання для детермінованого фейкового рішення
+FAKE_DENY_MARKERS = ("стрічк", "скрол", "tiktok", "шортс", "погортати")
+
+
+class ProviderError(Exception):
+    """Тимчасова помилка провайдера (429, 5xx, таймаут, мережа): можна повторити"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None, rate_limited: bool = False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.rate_limited = rate_limited
+
+
+class LLMCompletion:
+    """Повна відповідь моделі та облік токенів"""
+
+    __slots__ = ("content", "usage", "model")
+
+    def __init__(self, content: str, usage: Optional[Dict[str, int]] = None, model: Optional[str] = None):
+        self.content = content
+        self.usage = usage
+        self.model = model
+
+
+class LLMStream(ABC):
+    """
+    Потік фрагментів відповіді
+
+    Ітерація дає шматки тексту; usage заповнюється після останнього
+    чанка. aclose() звільняє з'єднання, якщо потік не дочитано.
+    """
+
+    usage: Optional[Dict[str, int]] = None
+
+    @abstractmethod
+    def __aiter__(self) -> AsyncIterator[str]:
+        ...
+
+    async def aclose(self):
+        pass
+
+
+class LLMProvider(ABC):
+    """
+    Чат-модель, що відповідає JSON-об'єктом
+
+    model у викликах перевизначає модель провайдера за замовчуванням
+    (маршрутизація між моделями одного endpoint'а).
+    """
+
+    name = "base"
+
+    def __init__(self, model: str):
+        self.model = model
+
+    @abstractmethod
+    async def complete(
+        self,
+        messages: List[Dict[str, str]],
+        timeout: float,
+        model: Optional[str] = None,
+        temperature: float = DEFAULT_TEMPERATURE,
+        max_tokens: Optional[int] = None,
+    ) -> LLMCompletion:
+        ...
+
+    @abstractmethod
+    async def open_stream(
+        self,
+        messages: List[Dict[str, str]],
+        timeout: float,
+        model: Optional[str] = None,
+        temperature: float = DEFAULT_TEMPERATURE,
+        max_tokens: Optional[int] = None,
+    ) -> LLMStream:
+        """Відкриття потоку; ProviderError виникає лише до першого токена"""
+
+    async def close(self):
+        pass
+
+
+def _field(obj: Any, name: str) -> Any:
+    """Поле відповіді SDK; невідомі SDK поля приходять як dict"""
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def _usage(usage: Any) -> Optional[Dict[str, int]]:
+    """Токени промпту, з них кешованих провайдером, та відповіді"""
+    if usage is None:
+        return None
+    return {
+        "prompt_tokens": _field(usage, "prompt_tokens") or 0,
+        "completion_tokens": _field(usage, "completion_tokens") or 0,
+        "cached_tokens": _field(_field(usage, "prompt_tokens_details"), "cached_tokens") or 0,
+    }
+
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    """Значення Retry-After (секунди або HTTP-дата) з відповіді провайдера"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_at - datetime.now(tz=retry_at.tzinfo)).total_seconds(), 0.0)
+
+
+def _provider_error(error: Exception) -> ProviderError:
+    return ProviderError(
+        f"{error.__class__.__name__}: {error}",
+        retry_after=_retry_after_seconds(error),
+        rate_limited=isinstance(error, openai.RateLimitError),
+    )
+
+
+def _request_timeout(timeout: float = OPENAI_TIMEOUT_SECONDS) -> httpx.Timeout:
+    return httpx.Timeout(timeout, connect=min(OPENAI_CONNECT_TIMEOUT_SECONDS, timeout))
+
+
+def create_openai_client(
+    http_client: Optional[httpx.AsyncClient] = None,
+    api_key: Optional[str] = None,
+    base_url: Optional[str] = OPENAI_BASE_URL,
+) -> openai.AsyncOpenAI:
+    """Створення асинхронного клієнта OpenAI з пулом з'єднань"""
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY not found in environment variables")
+
+    if http_client is None:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY_SECONDS,
+            ),
+            timeout=_request_timeout(),
+        )
+
+    return openai.AsyncOpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        timeout=_request_timeout(),
+        # Повтори виконує OpenAIValidationService, щоб враховувати Retry-After та ліміти
+        max_retries=0,
+        http_client=http_client,
+    )
+
+
+class _OpenAIStream(LLMStream):
+    def __init__(self, stream):
+        self._stream = stream
+
+    async def _iterate(self) -> AsyncIterator[str]:
+        async for chunk in self._stream:
+            if getattr(chunk, "usage", None):
+                self.usage = _usage(chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self._iterate()
+
+    async def aclose(self):
+        await self._stream.response.aclose()
+
+
+class OpenAIProvider(LLMProvider):
+    """OpenAI або будь-який OpenAI-сумісний endpoint (base_url)"""
+
+    name = "openai"
+
+    def __init__(self, client: openai.AsyncOpenAI, model: str = OPENAI_MODEL):
+        super().__init__(model)
+        self.client = client
+
+    async def _create(
+        self,
+        messages: List[Dict[str, str]],
+        timeout: float,
+        stream: bool,
+        model: Optional[str],
+        temperature: float,
+        max_tokens: Optional[int],
+    ):
+        options = {"max_tokens": max_tokens} if max_tokens is not None else {}
+        try:
+            return await self.client.chat.completions.create(
+                model=model or self.model,
+                messages=messages,
+                temperature=temperature,
+                response_format={"type": "json_object"},
+                stream=stream,
+                # У потоковому режимі usage приходить останнім чанком
+                extra_body={"stream_options": {"include_usage": True}} if stream else None,
+                timeout=_request_timeout(timeout),
+                **options
+            )
+        except RETRYABLE_ERRORS as e:
+            raise _provider_error(e) from e
+
+    async def complete(
+        self,
+        messages: List[Dict[str, str]],
+        timeout: float,
+        model: Optional[str] = None,
+        temperature: float = DEFAULT_TEMPERATURE,
+        max_tokens: Optional[int] = None,
+    ) -> LLMCompletion:
+        response = await self._create(messages, timeout, False, model, temperature, max_tokens)
+        return LLMCompletion(response.choices[0].message.content, _usage(response.usage), model or self.model)
+
+    async def open_stream(
+        self,
+        messages: List[Dict[str, str]],
+        timeout: float,
+        model: Optional[str] = None,
+        temperature: float = DEFAULT_TEMPERATURE,
+        max_tokens: Optional[int] = None,
+    ) -> LLMStream:
+        return _OpenAIStream(await self._create(messages, timeout, True, model, temperature, max_tokens))
+
+    async def close(self):
+        await self.client.close()
+
+
+def fake_decision(messages: List[Dict[str, str]]) -> Dict[str, Any]:
+    """Детерміноване рішення за текстом запиту (без профілю користувача)"""
+    text = extract_request(str(messages[-1].get("content", ""))).lower() if messages else ""
+    if any(marker in text for marker in FAKE_DENY_MARKERS):
+        return {
+            "decision": "deny",
+            "confidence": 0.9,
+            "message": "Схоже, це бездумне гортання. Давай краще не зараз.",
+            "alternative": "Зроби 10 присідань і випий води.",
+        }
+    return {
+        "decision": "allow",
+        "confidence": 0.8,
+        "message": "Гаразд, це схоже на корисну справу. Не затримуйся довше, ніж планував.",
+        "alternative": None,
+    }
+
+
+class _FakeStream(LLMStream):
+    def __init__(self, content: str, usage: Dict[str, int]):
+        self._content = content
+        self._usage = usage
+
+    async def _iterate(self) -> AsyncIterator[str]:
+        for offset in range(0, len(self._content), 8):
+            await asyncio.sleep(0)
+            yield self._content[offset:offset + 8]
+        self.usage = self._usage
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self._iterate()
+
+
+class FakeLLMProvider(LLMProvider):
+    """
+    Детермінований локальний провайдер для тестів і бенчмарків
+
+    Відповідає через latency_seconds рішенням responder(messages); перші
+    failures викликів завершуються ProviderError.
+    """
+
+    name = "fake"
+
+    def __init__(
+        self,
+        model: str = "fake",
+        latency_seconds: float = LLM_FAKE_LATENCY_MS / 1000,
+        responder: Callable[[List[Dict[str, str]]], Dict[str, Any]] = fake_decision,
+        failures: int = 0,
+    ):
+        super().__init__(model)
+        self.latency_seconds = latency_seconds
+        self.responder = responder
+        self.failures = failures
+        self.calls = 0
+
+    def latency(self, model: str) -> float:
+        """Затримка чергового виклику; підкласи можуть задати розподіл"""
+        return self.latency_seconds
+
+    async def _respond(self, messages: List[Dict[str, str]], timeout: float, model: Optional[str]) -> LLMCompletion:
+        self.calls += 1
+        latency = self.latency(model or self.model)
+        if latency > timeout:
+            await asyncio.sleep(timeout)
+            raise ProviderError("Fake provider timed out")
+        await asyncio.sleep(latency)
+        if self.failures > 0:
+            self.failures -= 1
+            raise ProviderError("Fake provider failure")
+        content = json.dumps(self.responder(messages), ensure_ascii=False)
+        usage = {"prompt_tokens": sum(len(m.get("content", "")) for m in messages) // 4,
+                 "completion_tokens": len(content) // 4, "cached_tokens": 0}
+        return LLMCompletion(content, usage, model or self.model)
+
+    async def complete(
+        self,
+        messages: List[Dict[str, str]],
+        timeout: float,
+        model: Optional[str] = None,
+        temperature: float = DEFAULT_TEMPERATURE,
+        max_tokens: Optional[int] = None,
+    ) -> LLMCompletion:
+        return await self._respond(messages, timeout, model)
+
+    async def open_stream(
+        self,
+        messages: List[Dict[str, str]],
+        timeout: float,
+        model: Optional[str] = None,
+        temperature: float = DEFAULT_TEMPERATURE,
+        max_tokens: Optional[int] = None,
+    ) -> LLMStream:
+        completion = await self._respond(messages, timeout, model)
+        return _FakeStream(completion.content, completion.usage)
+
+
+def _create_openai_provider(model: str, base_url: Optional[str], api_key: Optional[str]) -> LLMProvider:
+    return OpenAIProvider(create_openai_client(api_key=api_key, base_url=base_url), model)
+
+
+def _create_fake_provider(model: str, base_url: Optional[str], api_key: Optional[str]) -> LLMProvider:
+    return FakeLLMProvider(model)
+
+
+# Тип провайдера -> фабрика(model, base_url, api_key)
+PROVIDER_FACTORIES: Dict[str, Callable[[str, Optional[str], Optional[str]], LLMProvider]] = {
+    "openai": _create_openai_provider,
+    "fake": _create_fake_provider,
+}
+
+
+def register_provider(kind: str, factory: Callable[[str, Optional[str], Optional[str]], LLMProvider]):
+    """Реєстрація нового типу провайдера"""
+    PROVIDER_FACTORIES[kind] = factory
+
+
+def create_provider(
+    kind: str,
+    model: str = OPENAI_MODEL,
+    base_url: Optional[str] = OPENAI_BASE_URL,
+    api_key: Optional[str] = None,
+) -> LLMProvider:
+    factory = PROVIDER_FACTORIES.get(kind)
+    if factory is None:
+        raise ValueError(f"Unknown LLM provider: {kind}")
+    return factory(model, base_url, api_key)
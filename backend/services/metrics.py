@@ -0,0 +1,152 @@
+"""
+Метрики Prometheus та журнал спанів запитів
+
+stage() вимірює етап обробки (читання з Mongo, побудова промпту, виклик
+моделі, запис історії) у гістограму blockmate_stage_seconds. Якщо
+увімкнено SPAN_LOG_ENABLED, етапи кожного HTTP-запиту також збираються
+в один рядок логу — щоб розібрати, куди пішов час повільного /validate.
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+from prometheus_client.core import REGISTRY, GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+SPAN_LOG_ENABLED = os.getenv("SPAN_LOG_ENABLED", "false").lower() == "true"
+# Логувати лише запити, повільніші за поріг
+SPAN_LOG_MIN_MS = float(os.getenv("SPAN_LOG_MIN_MS", "0"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+STAGE_SECONDS = Histogram(
+    "blockmate_stage_seconds", "Тривалість етапів обробки запиту", ["stage"], buckets=LATENCY_BUCKETS
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "blockmate_http_request_seconds", "Тривалість HTTP-запитів", ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_TOKENS = Counter("blockmate_llm_tokens_total", "Токени моделі", ["model", "kind"])
+ERRORS = Counter("blockmate_errors_total", "Помилки за етапами", ["stage", "error"])
+DECISIONS = Counter("blockmate_decisions_total", "Рішення за джерелом", ["source"])
+LLM_ROUTE_SECONDS = Histogram(
+    "blockmate_llm_route_seconds", "Тривалість викликів моделі за маршрутом", ["route"], buckets=LATENCY_BUCKETS
+)
+LLM_COST = Counter("blockmate_llm_cost_usd_total", "Вартість токенів моделі, USD", ["route", "model"])
+LLM_ESCALATIONS = Counter("blockmate_llm_escalations_total", "Ескалації на сильнішу модель", ["route", "reason"])
+
+_spans: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("spans", default=None)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Вимірювання тривалості етапу"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(name).observe(elapsed)
+        spans = _spans.get()
+        if spans is not None:
+            spans.append((name, elapsed))
+
+
+def _flatten(stats: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+    flat = {}
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}_"))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+class StatsCollector:
+    """Експорт наявних stats() компонентів (кеші, черги, breaker) як gauge"""
+
+    def __init__(self, sources: Dict[str, Callable[[], Dict[str, Any]]]):
+        self.sources = sources
+
+    def collect(self):
+        for component, source in self.sources.items():
+            try:
+                stats = _flatten(source())
+            except Exception as e:
+                logger.debug(f"Cannot collect stats of {component}: {e}")
+                continue
+            for key, value in stats.items():
+                name = f"blockmate_{component}_{key}"
+                if value is None:
+                    continue
+                if isinstance(value, str):
+                    metric = GaugeMetricFamily(name, f"{component} {key}", labels=["value"])
+                    metric.add_metric([value], 1)
+                else:
+                    metric = GaugeMetricFamily(name, f"{component} {key}", value=float(value))
+                yield metric
+
+
+_stats_collector: Optional[StatsCollector] = None
+
+
+def register_stats(sources: Dict[str, Callable[[], Dict[str, Any]]]):
+    """Реєстрація джерел stats() у реєстрі Prometheus (один раз на процес)"""
+    global _stats_collector
+    if _stats_collector is None:
+        _stats_collector = StatsCollector(sources)
+        REGISTRY.register(_stats_collector)
+    else:
+        _stats_collector.sources = sources
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware: гістограма HTTP-запитів і журнал спанів
+
+    Чистий ASGI, а не BaseHTTPMiddleware, щоб у вимір потрапляв увесь
+    потоковий відгук разом із фоновими задачами.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        spans: Optional[List[Tuple[str, float]]] = [] if SPAN_LOG_ENABLED else None
+        token = _spans.set(spans)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _spans.reset(token)
+            # Шаблон маршруту замість шляху, щоб telegram_id не роздував кардинальність
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            HTTP_REQUEST_SECONDS.labels(scope["method"], route_path, str(status["code"])).observe(elapsed)
+            if spans is not None and elapsed * 1000 >= SPAN_LOG_MIN_MS:
+                parts = " ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in spans)
+                logger.info(
+                    f"span {scope['method']} {scope['path']} {status['code']} "
+                    f"total={elapsed * 1000:.1f}ms {parts}"
+                )
@@ -0,0 +1,265 @@
+"""
+Маршрутизація запитів між моделями за складністю
+
+Оцінка складності рахується локально: довжина запиту, чи впізнано
+застосунок, тривалість, збіги з дозволеними й забороненими сценаріями
+та наскільки суперечливими були рішення користувача за схожими
+запитами. Прості запити йдуть на найдешевшу модель, складні — на
+стандартну. Якщо відповідь не пройшла перевірку формату або модель не
+впевнена, запит ескалюється на сильну модель.
+
+Маршрутизація дорожча за виклик лише дешевої моделі, тож вона вимкнена
+за замовчуванням (LLM_ROUTING_ENABLED) і вмикається, коли якість
+складних запитів важливіша за вартість.
+"""
+import json
+import logging
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from backend.services.degraded_mode import recent_decisions
+from backend.services.hedging import LatencyTracker
+from backend.services.llm_providers import OPENAI_MODEL
+from backend.services.metrics import LLM_COST, LLM_ESCALATIONS, LLM_ROUTE_SECONDS
+from backend.services.rule_classifier import RULES_MAX_ALLOW_MINUTES, phrase_tokens, rule_classifier
+from backend.services.text_utils import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Вимкнено: усі виклики йдуть на OPENAI_MODEL без ескалації, як без маршрутизації
+LLM_ROUTING_ENABLED = os.getenv("LLM_ROUTING_ENABLED", "false").lower() == "true"
+# Запити з оцінкою не вище порогу йдуть на дешеву модель
+LLM_ROUTE_LIGHT_MAX_SCORE = float(os.getenv("LLM_ROUTE_LIGHT_MAX_SCORE", "0.4"))
+# Нижче цієї впевненості відповідь ескалюється на сильну модель
+LLM_ROUTE_MIN_CONFIDENCE = float(os.getenv("LLM_ROUTE_MIN_CONFIDENCE", "0.6"))
+
+LLM_ROUTE_LIGHT_MODEL = os.getenv("LLM_ROUTE_LIGHT_MODEL", OPENAI_MODEL)
+LLM_ROUTE_LIGHT_TEMPERATURE = float(os.getenv("LLM_ROUTE_LIGHT_TEMPERATURE", "0.2"))
+LLM_ROUTE_LIGHT_MAX_TOKENS = int(os.getenv("LLM_ROUTE_LIGHT_MAX_TOKENS", "200"))
+LLM_ROUTE_STANDARD_MODEL = os.getenv("LLM_ROUTE_STANDARD_MODEL", "gpt-4.1-mini")
+LLM_ROUTE_STANDARD_TEMPERATURE = float(os.getenv("LLM_ROUTE_STANDARD_TEMPERATURE", "0.5"))
+LLM_ROUTE_STANDARD_MAX_TOKENS = int(os.getenv("LLM_ROUTE_STANDARD_MAX_TOKENS", "400"))
+# Порожнє значення вимикає ескалацію
+LLM_ROUTE_STRONG_MODEL = os.getenv("LLM_ROUTE_STRONG_MODEL", "gpt-4.1")
+LLM_ROUTE_STRONG_TEMPERATURE = float(os.getenv("LLM_ROUTE_STRONG_TEMPERATURE", "0.3"))
+LLM_ROUTE_STRONG_MAX_TOKENS = int(os.getenv("LLM_ROUTE_STRONG_MAX_TOKENS", "400"))
+
+# USD за 1M токенів: (промпт, кешований промпт, відповідь); доповнюється через LLM_MODEL_PRICES (JSON)
+MODEL_PRICES: Dict[str, Tuple[float, float, float]] = {
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+}
+MODEL_PRICES.update({
+    model: tuple(price) for model, price in json.loads(os.getenv("LLM_MODEL_PRICES", "{}")).items()
+})
+
+# Запит, довший за стільки значущих токенів, вважається максимально складним за довжиною
+ROUTER_LONG_REQUEST_TOKENS = 25
+# Схожість (Жаккар за стемами), з якої попередній запит враховується
+ROUTER_SIMILARITY = 0.3
+
+ROUTE_LIGHT = "light"
+ROUTE_STANDARD = "standard"
+ROUTE_STRONG = "strong"
+
+# Застосунок -> варіанти назви; довгі варіанти збігаються як префікс (відмінки)
+APP_ALIASES = {
+    "instagram": ("instagram", "insta", "інстаграм", "інста", "reels", "рілс"),
+    "tiktok": ("tiktok", "тікток", "тiкток"),
+    "youtube": ("youtube", "ютуб", "shorts", "шортс"),
+    "telegram": ("telegram", "телеграм", "тг"),
+    "facebook": ("facebook", "фейсбук", "fb"),
+    "twitter": ("twitter", "твіттер", "твітер"),
+    "reddit": ("reddit", "реддіт", "редіт"),
+    "threads": ("threads", "тредс"),
+}
+
+
+def detect_app(request_text: str) -> Optional[str]:
+    """Застосунок, згаданий у запиті, або None"""
+    for token in tokenize(request_text):
+        for app, aliases in APP_ALIASES.items():
+            for alias in aliases:
+                if token == alias or (len(alias) >= 4 and token.startswith(alias)):
+                    return app
+    return None
+
+
+def confidence_of(result: Dict[str, Any]) -> float:
+    """Впевненість моделі з відповіді; без поля вважаємо відповідь впевненою"""
+    try:
+        return min(max(float(result.get("confidence", 1.0)), 0.0), 1.0)
+    except (TypeError, ValueError):
+        return 1.0
+
+
+class ModelRoute:
+    """Модель та параметри виклику для одного маршруту"""
+
+    __slots__ = ("name", "model", "temperature", "max_tokens")
+
+    def __init__(self, name: str, model: str, temperature: float, max_tokens: Optional[int]):
+        self.name = name
+        self.model = model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+
+
+class RouteStats:
+    def __init__(self):
+        self.calls = 0
+        self.latency = LatencyTracker()
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "latency_p50_seconds": self.latency.quantile(0.5) or 0.0,
+            "latency_p95_seconds": self.latency.quantile(0.95) or 0.0,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cost_usd": round(self.cost_usd, 6),
+            "cost_usd_per_call": round(self.cost_usd / self.calls, 8) if self.calls else 0.0,
+        }
+
+
+def token_cost(model: str, prompt_tokens: int, cached_tokens: int, completion_tokens: int) -> float:
+    """Вартість виклику в USD; невідома модель коштує 0"""
+    price = MODEL_PRICES.get(model)
+    if price is None:
+        return 0.0
+    prompt_price, cached_price, completion_price = price
+    return (
+        (prompt_tokens - cached_tokens) * prompt_price
+        + cached_tokens * cached_price
+        + completion_tokens * completion_price
+    ) / 1_000_000
+
+
+class ModelRouter:
+    """Вибір маршруту за оцінкою складності та облік затримки й вартості маршрутів"""
+
+    def __init__(
+        self,
+        enabled: bool = LLM_ROUTING_ENABLED,
+        light_max_score: float = LLM_ROUTE_LIGHT_MAX_SCORE,
+        min_confidence: float = LLM_ROUTE_MIN_CONFIDENCE,
+    ):
+        self.enabled = enabled
+        self.light_max_score = light_max_score
+        self.min_confidence = min_confidence
+        self.routes = {
+            ROUTE_LIGHT: ModelRoute(
+                ROUTE_LIGHT, LLM_ROUTE_LIGHT_MODEL, LLM_ROUTE_LIGHT_TEMPERATURE, LLM_ROUTE_LIGHT_MAX_TOKENS
+            ),
+            ROUTE_STANDARD: ModelRoute(
+                ROUTE_STANDARD, LLM_ROUTE_STANDARD_MODEL, LLM_ROUTE_STANDARD_TEMPERATURE, LLM_ROUTE_STANDARD_MAX_TOKENS
+            ),
+        }
+        if LLM_ROUTE_STRONG_MODEL:
+            self.routes[ROUTE_STRONG] = ModelRoute(
+                ROUTE_STRONG, LLM_ROUTE_STRONG_MODEL, LLM_ROUTE_STRONG_TEMPERATURE, LLM_ROUTE_STRONG_MAX_TOKENS
+            )
+        self._stats = {name: RouteStats() for name in self.routes}
+        self.routed: Dict[str, int] = {name: 0 for name in self.routes}
+        self.escalations: Dict[str, int] = {"invalid_response": 0, "low_confidence": 0}
+
+    def default_route(self) -> ModelRoute:
+        return self.routes[ROUTE_LIGHT]
+
+    def score(
+        self,
+        telegram_id: int,
+        request_text: str,
+        user_context: Dict[str, Any],
+        duration_minutes: Optional[int] = None,
+    ) -> float:
+        """Оцінка складності запиту від 0 (однозначний) до 1"""
+        tokens = phrase_tokens(request_text)
+        score = 0.35 * min(len(tokens) / ROUTER_LONG_REQUEST_TOKENS, 1.0)
+
+        if detect_app(request_text) is None:
+            score += 0.1
+
+        if not duration_minutes:
+            score += 0.1
+        elif duration_minutes > RULES_MAX_ALLOW_MINUTES:
+            score += 0.15
+
+        matches = rule_classifier.match(telegram_id, request_text, user_context)
+        if matches["allowed"] and matches["forbidden"]:
+            # Запит одночасно схожий на дозволене й заборонене
+            score += 0.25
+        elif not matches["allowed"] and not matches["forbidden"]:
+            score += 0.1
+        elif matches["allowed"] and matches["coverage"] < 0.5:
+            score += 0.1
+
+        past = recent_decisions.similar_decisions(telegram_id, request_text, ROUTER_SIMILARITY)
+        if past:
+            allowed = past.count("allow")
+            # 0 — рішення завжди однакові, 1 — порівну allow і deny
+            score += 0.25 * (1 - abs(2 * allowed - len(past)) / len(past))
+
+        return min(score, 1.0)
+
+    def route(
+        self,
+        telegram_id: int,
+        request_text: str,
+        user_context: Dict[str, Any],
+        duration_minutes: Optional[int] = None,
+    ) -> ModelRoute:
+        """Найдешевший маршрут, що має впоратися із запитом"""
+        if not self.enabled:
+            route = self.default_route()
+        elif self.score(telegram_id, request_text, user_context, duration_minutes) <= self.light_max_score:
+            route = self.routes[ROUTE_LIGHT]
+        else:
+            route = self.routes[ROUTE_STANDARD]
+        self.routed[route.name] += 1
+        return route
+
+    def escalation_for(self, route: ModelRoute) -> Optional[ModelRoute]:
+        """Сильніший маршрут для повторної спроби або None"""
+        if not self.enabled or route.name == ROUTE_STRONG:
+            return None
+        return self.routes.get(ROUTE_STRONG)
+
+    def record_escalation(self, route: ModelRoute, reason: str):
+        self.escalations[reason] += 1
+        LLM_ESCALATIONS.labels(route.name, reason).inc()
+        logger.info(f"Escalating LLM call from route {route.name}: {reason}")
+
+    def record_call(self, route: ModelRoute, latency_seconds: float):
+        stats = self._stats[route.name]
+        stats.calls += 1
+        stats.latency.observe(latency_seconds)
+        LLM_ROUTE_SECONDS.labels(route.name).observe(latency_seconds)
+
+    def record_usage(self, route: ModelRoute, model: str, usage: Dict[str, int]):
+        stats = self._stats[route.name]
+        stats.prompt_tokens += usage["prompt_tokens"]
+        stats.cached_tokens += usage["cached_tokens"]
+        stats.completion_tokens += usage["completion_tokens"]
+        cost = token_cost(model, usage["prompt_tokens"], usage["cached_tokens"], usage["completion_tokens"])
+        stats.cost_usd += cost
+        LLM_COST.labels(route.name, model).inc(cost)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "routed": dict(self.routed),
+            "escalations": dict(self.escalations),
+            "routes": {name: stats.to_dict() for name, stats in self._stats.items()},
+        }
+
+
+model_router = ModelRouter()
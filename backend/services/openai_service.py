@@ -1,105 +1,492 @@
-import openai
+import asyncio
+import functools
 import os
 import logging
-from typing import Dict, Any, Optional
+import random
+import re
+import time
+from typing import AsyncIterator, Callable, Dict, Any, List, Optional, Tuple
 from datetime import datetime
 from dotenv import load_dotenv
 import json
 
+from backend.services.hedging import HedgePolicy, hedged_call
+from backend.services.llm_providers import (
+    OPENAI_BASE_URL,
+    OPENAI_MODEL,
+    OPENAI_TIMEOUT_SECONDS,
+    LLMProvider,
+    LLMStream,
+    ProviderError,
+    create_provider,
+)
+from backend.services.metrics import ERRORS, LLM_TOKENS, stage
+from backend.services.model_router import ModelRoute, ModelRouter, confidence_of, model_router
+from backend.services.prompt import build_messages
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Основний провайдер моделі (див. llm_providers.PROVIDER_FACTORIES)
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai")
+# Запасний провайдер для хеджованих запитів; порожнє значення вимикає хеджування
+LLM_HEDGE_PROVIDER = os.getenv("LLM_HEDGE_PROVIDER", "")
+LLM_HEDGE_MODEL = os.getenv("LLM_HEDGE_MODEL", OPENAI_MODEL)
+LLM_HEDGE_BASE_URL = os.getenv("LLM_HEDGE_BASE_URL", OPENAI_BASE_URL)
+LLM_HEDGE_API_KEY = os.getenv("LLM_HEDGE_API_KEY")
+
+# Повтори при 429/5xx/мережевих помилках: експоненційний backoff з jitter
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BASE_DELAY_SECONDS = float(os.getenv("LLM_RETRY_BASE_DELAY_SECONDS", "0.5"))
+LLM_RETRY_MAX_DELAY_SECONDS = float(os.getenv("LLM_RETRY_MAX_DELAY_SECONDS", "8"))
+
+_service: Optional["OpenAIValidationService"] = None
+
+
+def init_validation_service() -> "OpenAIValidationService":
+    """Ініціалізація спільного для процесу сервісу валідації"""
+    global _service
+    if _service is None:
+        provider = create_provider(LLM_PROVIDER)
+        hedge_provider = None
+        if LLM_HEDGE_PROVIDER:
+            hedge_provider = create_provider(LLM_HEDGE_PROVIDER, LLM_HEDGE_MODEL, LLM_HEDGE_BASE_URL, LLM_HEDGE_API_KEY)
+        _service = OpenAIValidationService(provider, hedge_provider)
+    return _service
+
+
+def get_validation_service() -> "OpenAIValidationService":
+    """Отримання спільного сервісу валідації"""
+    if _service is None:
+        return init_validation_service()
+    return _service
+
+
+async def close_validation_service():
+    """Закриття провайдерів моделі та їхніх HTTP-пулів"""
+    global _service
+    if _service is not None:
+        await _service.close()
+    _service = None
+
+
+_DECISION_PATTERN = re.compile(r'"decision"\s*:\s*"(\w+)"')
+_CONFIDENCE_PATTERN = re.compile(r'"confidence"\s*:\s*([0-9.]+)\s*[,}]')
+_MESSAGE_PATTERN = re.compile(r'"message"\s*:\s*"')
+
+
+def _streamed_decision(buffer: str) -> Optional[Tuple[str, float]]:
+    """
+    (рішення, впевненість) з початку потоку або None, якщо ще рано
+
+    Впевненість іде одразу після рішення; якщо модель її пропустила
+    (почалось повідомлення), вважаємо відповідь впевненою.
+    """
+    match = _DECISION_PATTERN.search(buffer)
+    if not match:
+        return None
+    decision = match.group(1) if match.group(1) in ("allow", "deny") else "deny"
+    confidence = _CONFIDENCE_PATTERN.search(buffer, match.end())
+    if confidence:
+        return decision, confidence_of({"confidence": confidence.group(1)})
+    if _MESSAGE_PATTERN.search(buffer, match.end()):
+        return decision, 1.0
+    return None
+
+
+def _decode_partial_json_string(buffer: str, start: int) -> Tuple[str, bool]:
+    """
+    Декодування JSON-рядка, який ще може дописуватись
+
+    start — позиція одразу після відкривної лапки. Повертає (текст, чи
+    рядок уже закрито). Незавершені escape-послідовності відкидаються.
+    """
+    position = start
+    while position < len(buffer):
+        char = buffer[position]
+        if char == "\\":
+            if buffer.startswith("\\u", position):
+                # Сурогатна пара займає дві послідовності \uXXXX
+                length = 12 if buffer[position + 2:position + 3].lower() == "d" and \
+                    buffer[position + 3:position + 4].lower() in "89ab" else 6
+            else:
+                length = 2
+            if position + length > len(buffer):
+                break
+            position += length
+            continue
+        if char == '"':
+            return json.loads('"' + buffer[start:position] + '"'), True
+        position += 1
+    return json.loads('"' + buffer[start:position] + '"'), False
+
+
+class LLMUnavailableError(Exception):
+    """Провайдер перевантажений або недоступний після всіх повторів"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class InvalidLLMResponse(ValueError):
+    """Відповідь моделі не є коректним JSON-рішенням"""
+
+
+def parse_result(content: str) -> Dict[str, Any]:
+    """Рішення з відповіді моделі; InvalidLLMResponse, якщо відповідь непридатна"""
+    try:
+        result = json.loads(content)
+    except (TypeError, ValueError) as e:
+        raise InvalidLLMResponse(f"Response is not JSON: {e}") from e
+    if not isinstance(result, dict) or "decision" not in result or not result.get("message"):
+        raise InvalidLLMResponse("Response has no decision or message")
+    # Перевірка формату
+    if result["decision"] not in ["allow", "deny"]:
+        result["decision"] = "deny"
+    return result
+
 
 class OpenAIValidationService:
-    def __init__(self):
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY not found in environment variables")
-        openai.api_key = api_key
-        self.client = openai.OpenAI(api_key=api_key)
+    """
+    Валідація запитів через LLM-провайдера
+
+    Модель і параметри виклику задає маршрут (model_router). Повтори з
+    backoff, бюджет затримки (deadline) та хеджування: якщо основний
+    провайдер відповідає довше за спостережуваний p95 маршруту, запит
+    дублюється на hedge_provider і береться перша валідна відповідь.
+    Непридатна або невпевнена відповідь ескалюється на сильнішу модель.
+    """
+
+    def __init__(
+        self,
+        provider: LLMProvider,
+        hedge_provider: Optional[LLMProvider] = None,
+        hedge_policy_factory: Callable[[], HedgePolicy] = HedgePolicy,
+        router: ModelRouter = model_router,
+    ):
+        self.provider = provider
+        self.hedge_provider = hedge_provider
+        self.hedge_policy_factory = hedge_policy_factory
+        self.router = router
+        # Окрема політика на маршрут: p95 дешевої й сильної моделей різні
+        self.hedge_policies: Dict[str, HedgePolicy] = {}
+        self.retries = 0
+        self.rate_limited = 0
+        self.unavailable = 0
+        self.budget_exhausted = 0
+        self.invalid_responses = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+    
+    async def close(self):
+        await self.provider.close()
+        if self.hedge_provider is not None:
+            await self.hedge_provider.close()
+    
+    def _hedge_policy(self, route: ModelRoute) -> HedgePolicy:
+        policy = self.hedge_policies.get(route.name)
+        if policy is None:
+            policy = self.hedge_policies[route.name] = self.hedge_policy_factory()
+        return policy
+    
+    def _record_usage(self, route: ModelRoute, model: str, usage: Optional[Dict[str, int]]):
+        """Облік токенів промпту, з них кешованих провайдером, та відповіді"""
+        if usage is None:
+            return
+        prompt_tokens = usage["prompt_tokens"]
+        completion_tokens = usage["completion_tokens"]
+        cached = usage["cached_tokens"]
+        
+        self.prompt_tokens += prompt_tokens
+        self.cached_tokens += cached
+        self.completion_tokens += completion_tokens
+        LLM_TOKENS.labels(model, "prompt").inc(prompt_tokens)
+        LLM_TOKENS.labels(model, "cached").inc(cached)
+        LLM_TOKENS.labels(model, "completion").inc(completion_tokens)
+        self.router.record_usage(route, model, usage)
+        logger.info(
+            f"LLM usage: route={route.name} model={model} prompt_tokens={prompt_tokens} "
+            f"cached_tokens={cached} completion_tokens={completion_tokens}"
+        )
+    
+    def _exhausted(self, message: str) -> LLMUnavailableError:
+        self.budget_exhausted += 1
+        ERRORS.labels("llm_call", "LatencyBudgetExhausted").inc()
+        return LLMUnavailableError(message, LLM_RETRY_BASE_DELAY_SECONDS)
+    
+    async def _call(
+        self,
+        provider: LLMProvider,
+        messages: List[Dict[str, str]],
+        deadline: Optional[float],
+        route: ModelRoute,
+        model: Optional[str],
+        stream: bool = False,
+    ):
+        """Виклик провайдера з повторами при 429/5xx та мережевих помилках у межах deadline"""
+        attempt = 0
+        while True:
+            timeout = OPENAI_TIMEOUT_SECONDS
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.monotonic())
+                if timeout <= 0:
+                    raise self._exhausted(f"Latency budget exhausted before {provider.name} call")
+            try:
+                call = provider.open_stream if stream else provider.complete
+                return await call(messages, timeout, model, route.temperature, route.max_tokens)
+            except ProviderError as e:
+                ERRORS.labels("llm_call", (e.__cause__ or e).__class__.__name__).inc()
+                if e.rate_limited:
+                    self.rate_limited += 1
+                
+                backoff = min(LLM_RETRY_MAX_DELAY_SECONDS, LLM_RETRY_BASE_DELAY_SECONDS * 2 ** attempt)
+                delay = max(random.uniform(0, backoff), e.retry_after or 0)
+                
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    raise self._exhausted(f"{provider.name} unavailable within latency budget: {e}") from e
+                if attempt >= LLM_MAX_RETRIES or delay > LLM_RETRY_MAX_DELAY_SECONDS:
+                    self.unavailable += 1
+                    raise LLMUnavailableError(f"{provider.name} unavailable: {e}", e.retry_after or backoff) from e
+                
+                attempt += 1
+                self.retries += 1
+                logger.warning(f"{provider.name} call failed ({e}), retry {attempt} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+    
+    async def _validated(
+        self,
+        provider: LLMProvider,
+        messages: List[Dict[str, str]],
+        deadline: Optional[float],
+        route: ModelRoute,
+        model: Optional[str],
+    ) -> Dict[str, Any]:
+        completion = await self._call(provider, messages, deadline, route, model)
+        self._record_usage(route, completion.model or provider.model, completion.usage)
+        try:
+            return parse_result(completion.content)
+        except InvalidLLMResponse:
+            self.invalid_responses += 1
+            raise
+    
+    async def _routed_call(
+        self,
+        route: ModelRoute,
+        messages: List[Dict[str, str]],
+        deadline: Optional[float],
+    ) -> Dict[str, Any]:
+        """Виклик моделі маршруту з хеджуванням"""
+        hedge = None
+        if self.hedge_provider is not None:
+            # Запасний endpoint відповідає своєю моделлю з параметрами маршруту
+            hedge = functools.partial(self._validated, self.hedge_provider, messages, deadline, route, None)
+        timeout = None if deadline is None else deadline - time.monotonic()
+        started = time.monotonic()
+        result, winner = await hedged_call(
+            functools.partial(self._validated, self.provider, messages, deadline, route, route.model),
+            hedge,
+            self._hedge_policy(route),
+            timeout
+        )
+        self.router.record_call(route, time.monotonic() - started)
+        if winner == "hedge":
+            logger.info(f"Hedged LLM call won: route={route.name} model={self.hedge_provider.model}")
+        return result
+    
+    async def _answer(
+        self,
+        route: ModelRoute,
+        messages: List[Dict[str, str]],
+        deadline: Optional[float],
+    ) -> Dict[str, Any]:
+        """Відповідь маршруту з ескалацією на сильнішу модель"""
+        escalation = self.router.escalation_for(route)
+        try:
+            result = await self._routed_call(route, messages, deadline)
+        except InvalidLLMResponse:
+            if escalation is None:
+                raise
+            self.router.record_escalation(route, "invalid_response")
+            return await self._routed_call(escalation, messages, deadline)
+        
+        if escalation is None or confidence_of(result) >= self.router.min_confidence:
+            return result
+        self.router.record_escalation(route, "low_confidence")
+        try:
+            return await self._routed_call(escalation, messages, deadline)
+        except (InvalidLLMResponse, LLMUnavailableError, asyncio.TimeoutError) as e:
+            # Невпевнена відповідь краща за жодну
+            logger.warning(f"Escalation to route {escalation.name} failed: {e}")
+            return result
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "provider": self.provider.model,
+            "hedge_provider": self.hedge_provider.model if self.hedge_provider else None,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "unavailable": self.unavailable,
+            "budget_exhausted": self.budget_exhausted,
+            "invalid_responses": self.invalid_responses,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_token_ratio": self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+            "hedge": {name: policy.stats() for name, policy in self.hedge_policies.items()},
+        }
+    
+    @staticmethod
+    def _fallback_result() -> Dict[str, Any]:
+        """Консервативна відповідь у випадку помилки"""
+        return {
+            "decision": "deny",
+            "message": "Вибач, зараз не можу обробити запит. Спробуй пізніше.",
+            "alternative": "Зроби коротку паузу без телефону.",
+            "timestamp": datetime.utcnow().isoformat(),
+            "source": "fallback"
+        }
     
     async def validate_request(
         self,
         request_text: str,
         user_context: Dict[str, Any],
-        duration_minutes: Optional[int] = None
+        duration_minutes: Optional[int] = None,
+        deadline: Optional[float] = None,
+        route: Optional[ModelRoute] = None
     ) -> Dict[str, Any]:
         """
-        Валідація запиту користувача через OpenAI
+        Валідація запиту користувача через модель
+        
+        deadline — момент (time.monotonic()), до якого потрібна відповідь;
+        після нього піднімається LLMUnavailableError. route — маршрут від
+        model_router; за замовчуванням найдешевший.
         
         Повертає:
         {
             "decision": "allow" | "deny",
             "message": "текст відповіді",
             "alternative": "альтернативна пропозиція (опціонально)",
-            "timestamp": datetime
+            "timestamp": datetime,
+            "source": "llm" | "fallback"
         }
         """
+        route = route or self.router.default_route()
+        with stage("prompt_build"):
+            messages = build_messages(request_text, user_context, duration_minutes)
         
-        # Формуємо промпт для OpenAI
-        goals_text = "\n".join([f"- {goal}" for goal in user_context.get("goals", [])])
-        allowed_text = "\n".join([f"- {use}" for use in user_context.get("allowed_usecases", [])])
-        forbidden_text = "\n".join([f"- {use}" for use in user_context.get("forbidden_usecases", [])])
-        
-        duration_info = f" на {duration_minutes} хвилин" if duration_minutes else ""
-        
-        system_prompt = """Ти допомагаєш користувачам боротись з залежністю від соціальних мереж. 
-Твоя задача - проаналізувати запит користувача на використання соцмережі та дати обґрунтовану відповідь.
-
-Відповідай українською мовою, бути дружнім та підтримуючим.
-Якщо запит узгоджений з цілями користувача - дозволи його.
-Якщо це виглядає як відволікання - запропонуй альтернативу.
-
-Формат відповіді (JSON):
-{
-    "decision": "allow" або "deny",
-    "message": "персональне повідомлення користувачу",
-    "alternative": "альтернативна пропозиція (тільки якщо decision=deny)"
-}"""
-
-        user_prompt = f"""Користувач хоче: {request_text}{duration_info}
-
-Цілі користувача:
-{goals_text if goals_text else "Не вказано"}
-
-Дозволені сценарії використання:
-{allowed_text if allowed_text else "Не вказано"}
-
-Заборонені сценарії використання:
-{forbidden_text if forbidden_text else "Не вказано"}
-
-Проаналізуй запит та дай відповідь у форматі JSON."""
-
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4.1-nano",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.7,
-                response_format={"type": "json_object"}
-            )
-            
-            result = json.loads(response.choices[0].message.content)
+            with stage("llm_call"):
+                result = await self._answer(route, messages, deadline)
             
             # Додаємо timestamp
             result["timestamp"] = datetime.utcnow().isoformat()
-            
-            # Перевірка формату
-            if result["decision"] not in ["allow", "deny"]:
-                result["decision"] = "deny"
+            result["source"] = "llm"
             
             return result
             
+        except asyncio.TimeoutError:
+            raise self._exhausted("Latency budget exhausted")
+        except LLMUnavailableError:
+            # Перевантаження провайдера — не привід відмовляти користувачу
+            raise
         except Exception as e:
             # У випадку помилки повертаємо консервативну відповідь
-            logger.error(f"Error validating request with OpenAI: {e}", exc_info=True)
-            return {
-                "decision": "deny",
-                "message": "Вибач, зараз не можу обробити запит. Спробуй пізніше.",
-                "alternative": "Зроби коротку паузу без телефону.",
-                "timestamp": datetime.utcnow().isoformat()
-            }
+            logger.error(f"Error validating request with LLM: {e}", exc_info=True)
+            ERRORS.labels("llm_response", e.__class__.__name__).inc()
+            return self._fallback_result()
+    
+    async def stream_request(
+        self,
+        request_text: str,
+        user_context: Dict[str, Any],
+        duration_minutes: Optional[int] = None,
+        deadline: Optional[float] = None,
+        route: Optional[ModelRoute] = None
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Потокова валідація запиту
 
+        Генерує події ("decision", "allow" | "deny") одразу, як модель її
+        видала, далі ("message", фрагмент тексту), і наостанок
+        ("result", повний результат як у validate_request). deadline
+        обмежує лише очікування першого токена; потік не хеджується.
+        Ескалація на сильнішу модель можлива, лише поки рішення ще не
+        показано: для цього рішення віддається разом з впевненістю.
+        """
+        route = route or self.router.default_route()
+        with stage("prompt_build"):
+            messages = build_messages(request_text, user_context, duration_minutes)
+        
+        while True:
+            escalation = self.router.escalation_for(route)
+            escalate_reason = None
+            buffer = ""
+            decision = None
+            message = ""
+            message_start = None
+            started = time.monotonic()
+            
+            try:
+                with stage("llm_first_byte"):
+                    stream: LLMStream = await self._call(self.provider, messages, deadline, route, route.model, stream=True)
+                with stage("llm_stream"):
+                    try:
+                        async for delta in stream:
+                            buffer += delta
+                        
+                            if decision is None:
+                                found = _streamed_decision(buffer)
+                                if found is None:
+                                    continue
+                                if escalation is not None and found[1] < self.router.min_confidence:
+                                    escalate_reason = "low_confidence"
+                                    break
+                                decision = found[0]
+                                yield "decision", decision
+                        
+                            if message_start is None:
+                                match = _MESSAGE_PATTERN.search(buffer)
+                                message_start = match.end() if match else None
+                            if message_start is not None:
+                                decoded, _ = _decode_partial_json_string(buffer, message_start)
+                                if len(decoded) > len(message):
+                                    yield "message", decoded[len(message):]
+                                    message = decoded
+                    finally:
+                        await stream.aclose()
+                self._record_usage(route, route.model, stream.usage)
+                self.router.record_call(route, time.monotonic() - started)
+                
+                if escalate_reason is None:
+                    result = json.loads(buffer)
+                    if decision is None:
+                        # Рішення не знайдено в потоці — відповідь непридатна
+                        raise InvalidLLMResponse("Streamed response has no decision")
+                    result["decision"] = decision
+                    result["message"] = result.get("message") or message
+                    result["timestamp"] = datetime.utcnow().isoformat()
+                    result["source"] = "llm"
+                    break
+                
+            except LLMUnavailableError:
+                # Виникає лише до першого токена — так само, як у validate_request
+                raise
+            except Exception as e:
+                if decision is None and escalation is not None:
+                    escalate_reason = "invalid_response"
+                else:
+                    logger.error(f"Error streaming validation from LLM: {e}", exc_info=True)
+                    ERRORS.labels("llm_response", e.__class__.__name__).inc()
+                    result = self._fallback_result()
+                    if decision is not None:
+                        # Рішення вже показано користувачу — не суперечимо йому
+                        result.update({"decision": decision, "message": message or result["message"], "alternative": None})
+                    break
+            
+            self.router.record_escalation(route, escalate_reason)
+            route = escalation
+        
+        yield "result", result
@@ -0,0 +1,111 @@
+import math
+import os
+from typing import Any, Dict, List, Optional
+
+# Бюджет токенів на блок профілю (цілі та сценарії)
+PROMPT_PROFILE_TOKEN_BUDGET = int(os.getenv("PROMPT_PROFILE_TOKEN_BUDGET", "600"))
+# Грубо: кирилиця з токенізатором OpenAI дає ~3 символи на токен
+CHARS_PER_TOKEN = 3
+
+# Рядок повідомлення користувача, з якого починається сам запит
+REQUEST_MARKER = "Користувач хоче: "
+
+# Статична частина промпту однакова для всіх користувачів і йде першою,
+# щоб провайдер міг кешувати префікс
+SYSTEM_PROMPT = """Ти допомагаєш користувачам боротись з залежністю від соціальних мереж. 
+Твоя задача - проаналізувати запит користувача на використання соцмережі та дати обґрунтовану відповідь.
+
+Відповідай українською мовою, бути дружнім та підтримуючим.
+Якщо запит узгоджений з цілями користувача - дозволи його.
+Якщо це виглядає як відволікання - запропонуй альтернативу.
+
+Формат відповіді (JSON, поля саме в такому порядку):
+{
+    "decision": "allow" або "deny",
+    "confidence": число від 0 до 1 — наскільки ти впевнений у рішенні,
+    "message": "персональне повідомлення користувачу",
+    "alternative": "альтернативна пропозиція (тільки якщо decision=deny)"
+}"""
+
+PROFILE_SECTIONS = (
+    ("goals", "Цілі користувача"),
+    ("allowed_usecases", "Дозволені сценарії використання"),
+    ("forbidden_usecases", "Заборонені сценарії використання"),
+)
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _fit_to_budget(sections: Dict[str, List[str]], budget: int) -> Dict[str, List[str]]:
+    """Обрізає списки по черзі (по одному пункту з кожного), поки вони вміщаються в бюджет"""
+    kept: Dict[str, List[str]] = {key: [] for key in sections}
+    used = 0
+    depth = 0
+    while any(depth < len(items) for items in sections.values()):
+        for key, items in sections.items():
+            if depth >= len(items):
+                continue
+            cost = estimate_tokens(f"- {items[depth]}\n")
+            if used + cost > budget:
+                return kept
+            kept[key].append(items[depth])
+            used += cost
+        depth += 1
+    return kept
+
+
+def render_profile_prefix(user_context: Dict[str, Any], budget: int = PROMPT_PROFILE_TOKEN_BUDGET) -> str:
+    """
+    Блок профілю користувача для промпту
+
+    Рендериться під час /set_goals і зберігається разом з профілем.
+    Списки, що не вміщаються в бюджет токенів, обрізаються.
+    """
+    sections = {key: list(user_context.get(key, [])) for key, _ in PROFILE_SECTIONS}
+    kept = _fit_to_budget(sections, budget)
+
+    blocks = []
+    for key, title in PROFILE_SECTIONS:
+        lines = [f"- {item}" for item in kept[key]]
+        dropped = len(sections[key]) - len(kept[key])
+        if dropped:
+            lines.append(f"- … і ще {dropped}")
+        blocks.append(f"{title}:\n" + ("\n".join(lines) if lines else "Не вказано"))
+    return "\n\n".join(blocks)
+
+
+def build_messages(
+    request_text: str,
+    user_context: Dict[str, Any],
+    duration_minutes: Optional[int] = None,
+) -> List[Dict[str, str]]:
+    """
+    Повідомлення для моделі: статична інструкція, профіль, а запит — в кінці
+
+    Змінний текст запиту йде останнім, тож system-промпт і профіль
+    утворюють стабільний префікс для кешування на боці провайдера.
+    """
+    profile_prefix = user_context.get("prompt_prefix") or render_profile_prefix(user_context)
+    duration_info = f" на {duration_minutes} хвилин" if duration_minutes else ""
+
+    user_prompt = f"""{profile_prefix}
+
+{REQUEST_MARKER}{request_text}{duration_info}
+
+Проаналізуй запит та дай відповідь у форматі JSON."""
+
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt}
+    ]
+
+
+def extract_request(user_prompt: str) -> str:
+    """Текст запиту з повідомлення build_messages без блоку профілю"""
+    # Запит іде після профілю, тож беремо останній рядок з маркером
+    for line in reversed(user_prompt.splitlines()):
+        if line.startswith(REQUEST_MARKER):
+            return line[len(REQUEST_MARKER):]
+    return user_prompt
@@ -0,0 +1,215 @@
+import os
+from collections import deque
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from backend.services.cache import TTLCache
+from backend.services.decision_cache import profile_hash
+from backend.services.text_utils import tokenize
+
+RULES_CACHE_MAX_USERS = int(os.getenv("RULES_CACHE_MAX_USERS", "50000"))
+RULES_CACHE_TTL_SECONDS = float(os.getenv("RULES_CACHE_TTL_SECONDS", "86400"))
+# Частка значущих токенів запиту, яку має покрити дозволений сценарій
+RULES_MIN_ALLOW_COVERAGE = float(os.getenv("RULES_MIN_ALLOW_COVERAGE", "0.5"))
+# Частка значущих токенів запиту, яку має покрити заборонений сценарій: стеми
+# обрізані до STEM_LENGTH, тож одиночний збіг у довгому запиті може бути випадковим
+# ("insta" з "install")
+RULES_MIN_DENY_COVERAGE = float(os.getenv("RULES_MIN_DENY_COVERAGE", "0.5"))
+# Довші сесії завжди віддаємо на розгляд моделі
+RULES_MAX_ALLOW_MINUTES = int(os.getenv("RULES_MAX_ALLOW_MINUTES", "30"))
+
+# Службові слова, які не несуть змісту сценарію
+STOPWORDS = frozenset("""
+    хочу хочеться хотів хотіла хотілося треба потрібно можна мені я мене
+    на в у і й та з із за до по для що щоб як а але це ще трохи хвилинку
+    відкрити відкрию зайти зайду подивитись подивитися глянути
+    i want need to the a an and or for in on at of my me just open check
+""".split())
+
+STEM_LENGTH = 5
+
+
+def _stem(token: str) -> str:
+    """Грубий стемінг: обрізання до префікса, щоб ігнорувати відмінки"""
+    return token[:STEM_LENGTH]
+
+
+def phrase_tokens(text: str) -> List[str]:
+    """Значущі стеми фрази"""
+    return [_stem(token) for token in tokenize(text) if token not in STOPWORDS]
+
+
+class AhoCorasickMatcher:
+    """Мультишаблонний пошук фраз (послідовностей токенів) за один прохід"""
+
+    def __init__(self, patterns: Sequence[Tuple[Sequence[str], Any]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[Tuple[int, Any]]] = [[]]
+
+        for tokens, payload in patterns:
+            if not tokens:
+                continue
+            node = 0
+            for token in tokens:
+                nxt = self._goto[node].get(token)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][token] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                node = nxt
+            self._output[node].append((len(tokens), payload))
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for token, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and token not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(token, 0)
+                if self._fail[child] == child:
+                    self._fail[child] = 0
+                self._output[child].extend(self._output[self._fail[child]])
+
+    def search(self, tokens: Sequence[str]) -> List[Tuple[int, int, Any]]:
+        """Повертає (початок, довжина, payload) для кожного входження"""
+        matches = []
+        node = 0
+        for position, token in enumerate(tokens):
+            while node and token not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(token, 0)
+            for length, payload in self._output[node]:
+                matches.append((position - length + 1, length, payload))
+        return matches
+
+
+class RuleClassifier:
+    """
+    Локальний попередній класифікатор запитів
+
+    Запити, що однозначно збігаються з дозволеними або забороненими
+    сценаріями користувача, вирішуються без виклику моделі. Решта
+    повертає None і йде до OpenAIValidationService.
+    """
+
+    def __init__(
+        self,
+        max_users: int = RULES_CACHE_MAX_USERS,
+        ttl_seconds: float = RULES_CACHE_TTL_SECONDS,
+    ):
+        # telegram_id -> (хеш профілю, скомпільований matcher)
+        self._matchers = TTLCache(max_entries=max_users, ttl_seconds=ttl_seconds)
+        self.total = 0
+        self.fast_allow = 0
+        self.fast_deny = 0
+        self.compilations = 0
+
+    def _get_matcher(self, telegram_id: int, user_context: Dict[str, Any]) -> AhoCorasickMatcher:
+        current_hash = profile_hash(user_context)
+        cached = self._matchers.get(telegram_id)
+        if cached is not None and cached[0] == current_hash:
+            return cached[1]
+
+        patterns = []
+        for kind, key in (("allow", "allowed_usecases"), ("deny", "forbidden_usecases")):
+            for phrase in user_context.get(key, []):
+                patterns.append((phrase_tokens(phrase), (kind, phrase)))
+
+        matcher = AhoCorasickMatcher(patterns)
+        self._matchers.set(telegram_id, (current_hash, matcher))
+        self.compilations += 1
+        return matcher
+
+    def invalidate(self, telegram_id: int):
+        self._matchers.invalidate(telegram_id)
+
+    def match(self, telegram_id: int, request_text: str, user_context: Dict[str, Any]) -> Dict[str, Any]:
+        """Збіги запиту з дозволеними та забороненими сценаріями"""
+        tokens = phrase_tokens(request_text)
+        matcher = self._get_matcher(telegram_id, user_context)
+
+        allowed, forbidden = [], []
+        covered, forbidden_covered = set(), set()
+        for start, length, (kind, phrase) in matcher.search(tokens):
+            if kind == "allow":
+                allowed.append(phrase)
+                covered.update(range(start, start + length))
+            else:
+                forbidden.append(phrase)
+                forbidden_covered.update(range(start, start + length))
+
+        return {
+            "allowed": allowed,
+            "forbidden": forbidden,
+            "coverage": len(covered) / len(tokens) if tokens else 0.0,
+            "forbidden_coverage": len(forbidden_covered) / len(tokens) if tokens else 0.0,
+        }
+
+    def classify(
+        self,
+        telegram_id: int,
+        request_text: str,
+        user_context: Dict[str, Any],
+        duration_minutes: Optional[int] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """Рішення для однозначних випадків або None"""
+        self.total += 1
+        matches = self.match(telegram_id, request_text, user_context)
+        allowed, forbidden = matches["allowed"], matches["forbidden"]
+
+        if forbidden and not allowed and matches["forbidden_coverage"] >= RULES_MIN_DENY_COVERAGE:
+            self.fast_deny += 1
+            return self._deny(forbidden[0], user_context)
+
+        if (
+            allowed
+            and not forbidden
+            and matches["coverage"] >= RULES_MIN_ALLOW_COVERAGE
+            and (duration_minutes or 0) <= RULES_MAX_ALLOW_MINUTES
+        ):
+            self.fast_allow += 1
+            return self._allow(allowed[0], duration_minutes)
+
+        return None
+
+    @staticmethod
+    def _allow(phrase: str, duration_minutes: Optional[int]) -> Dict[str, Any]:
+        duration_info = f" Маєш {duration_minutes} хв — використай їх з користю." if duration_minutes else ""
+        return {
+            "decision": "allow",
+            "message": f"Це узгоджується з твоїм дозволеним сценарієм «{phrase}».{duration_info} 👍",
+            "alternative": None,
+            "source": "rules",
+        }
+
+    @staticmethod
+    def _deny(phrase: str, user_context: Dict[str, Any]) -> Dict[str, Any]:
+        goals = user_context.get("goals", [])
+        alternative = (
+            f"Приділи цей час своїй цілі «{goals[0]}»."
+            if goals else "Зроби коротку паузу без телефону."
+        )
+        return {
+            "decision": "deny",
+            "message": f"Схоже, це підпадає під заборонений тобою сценарій «{phrase}». Давай не зараз 🙂",
+            "alternative": alternative,
+            "source": "rules",
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        handled = self.fast_allow + self.fast_deny
+        return {
+            "total": self.total,
+            "fast_allow": self.fast_allow,
+            "fast_deny": self.fast_deny,
+            "fast_path_fraction": handled / self.total if self.total else 0.0,
+            "compilations": self.compilations,
+            "cached_users": len(self._matchers),
+        }
+
+
+rule_classifier = RuleClassifier()
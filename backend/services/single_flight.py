@@ -0,0 +1,58 @@
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+# Скільки секунд після завершення ще віддавати той самий результат дублікатам
+SINGLE_FLIGHT_LINGER_SECONDS = float(os.getenv("SINGLE_FLIGHT_LINGER_SECONDS", "1.0"))
+
+
+class SingleFlight:
+    """
+    Об'єднання однакових паралельних викликів в один
+
+    Перший виклик з ключем запускає роботу окремою задачею; решта чекають
+    на той самий результат. Після успішного завершення результат ще
+    linger_seconds віддається дублікатам, що прийшли трохи пізніше.
+    """
+
+    def __init__(self, linger_seconds: float = SINGLE_FLIGHT_LINGER_SECONDS):
+        self.linger_seconds = linger_seconds
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def start(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[asyncio.Task, bool]:
+        """Спільна задача для ключа (без очікування) та чи її запустив інший виклик"""
+        task = self._tasks.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            self.executed += 1
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._on_done(key, done))
+        return task, shared
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Повертає (результат, чи був він спільним з іншим викликом)"""
+        task, shared = self.start(key, fn)
+        # shield: скасування одного з очікувачів не скасовує спільну роботу
+        return await asyncio.shield(task), shared
+
+    def _on_done(self, key: Hashable, task: asyncio.Task):
+        if task.cancelled() or task.exception() is not None or self.linger_seconds <= 0:
+            self._forget(key, task)
+        else:
+            asyncio.get_running_loop().call_later(self.linger_seconds, self._forget, key, task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": sum(1 for task in self._tasks.values() if not task.done()),
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+        }
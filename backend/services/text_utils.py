@@ -0,0 +1,44 @@
+import re
+import unicodedata
+from typing import List, Optional
+
+# Згадки тривалості на кшталт "10 хв", "15 хвилин", "20 min"
+DURATION_PATTERN = re.compile(
+    r'(\d+)\s*(хвилин\w*|хв|минут\w*|мин|minutes?|min|m)\b',
+    re.IGNORECASE
+)
+_PUNCTUATION = re.compile(r"[^\w\s]+", re.UNICODE)
+_WHITESPACE = re.compile(r"\s+")
+
+# Межі (в хвилинах) для групування тривалості
+DURATION_BUCKETS = (5, 15, 30, 60)
+
+
+def normalize_text(text: str) -> str:
+    """Нормалізація тексту запиту: регістр, пунктуація, пробіли, тривалість"""
+    text = unicodedata.normalize("NFKC", text).lower().replace("’", "'")
+    text = DURATION_PATTERN.sub(" ", text)
+    text = _PUNCTUATION.sub(" ", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def tokenize(text: str) -> List[str]:
+    """Розбиття нормалізованого тексту на токени"""
+    normalized = normalize_text(text)
+    return normalized.split(" ") if normalized else []
+
+
+def parse_duration(text: str) -> Optional[int]:
+    """Витягує тривалість у хвилинах з тексту запиту"""
+    match = DURATION_PATTERN.search(text)
+    return int(match.group(1)) if match else None
+
+
+def duration_bucket(duration_minutes: Optional[int]) -> str:
+    """Група тривалості: "none", "<=5", "<=15", "<=30", "<=60" або ">60" """
+    if not duration_minutes:
+        return "none"
+    for limit in DURATION_BUCKETS:
+        if duration_minutes <= limit:
+            return f"<={limit}"
+    return f">{DURATION_BUCKETS[-1]}"
@@ -0,0 +1,307 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from backend.services.admission import admission_controller
+from backend.services.circuit_breaker import llm_circuit_breaker
+from backend.services.decision_cache import decision_cache
+from backend.services.degraded_mode import degraded_decision, recent_decisions
+from backend.services.history_writer import history_writer
+from backend.services.metrics import DECISIONS
+from backend.services.model_router import detect_app, model_router
+from backend.services.openai_service import get_validation_service, LLMUnavailableError
+from backend.services.rule_classifier import rule_classifier
+from backend.services.single_flight import SingleFlight
+from backend.services.text_utils import normalize_text, parse_duration
+
+# Наскрізний бюджет затримки /validate: після нього — локальне рішення
+VALIDATE_LATENCY_BUDGET_SECONDS = float(os.getenv("VALIDATE_LATENCY_BUDGET_SECONDS", "15"))
+
+# Однакові паралельні запити (подвійний тап, повторна доставка Telegram)
+# ділять один виклик моделі та один запис в історію
+validation_flight = SingleFlight()
+
+
+def latency_deadline(budget_ms: Optional[int] = None) -> float:
+    """Момент (time.monotonic()), до якого потрібне рішення; клієнт може лише скоротити бюджет"""
+    budget = VALIDATE_LATENCY_BUDGET_SECONDS
+    if budget_ms is not None:
+        budget = min(budget, max(budget_ms, 0) / 1000)
+    return time.monotonic() + budget
+
+
+def user_context_from_profile(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """Контекст користувача для валідації"""
+    return {
+        "goals": profile.get("goals", []),
+        "allowed_usecases": profile.get("allowed_usecases", []),
+        "forbidden_usecases": profile.get("forbidden_usecases", []),
+        "prompt_prefix": profile.get("prompt_prefix"),
+    }
+
+
+def _local_decision(
+    telegram_id: int,
+    request_text: str,
+    user_context: Dict[str, Any],
+    duration_minutes: Optional[int],
+    cache_key: Tuple[str, str, str],
+) -> Optional[Dict[str, Any]]:
+    """Рішення без моделі: за правилами користувача або з кешу"""
+    # Однозначні випадки вирішуємо локально за правилами користувача
+    validation_result = rule_classifier.classify(telegram_id, request_text, user_context, duration_minutes)
+    if validation_result is None:
+        # Далі шукаємо готове рішення в кеші
+        validation_result = decision_cache.get(cache_key)
+        if validation_result is not None:
+            validation_result["source"] = "cache"
+    return validation_result
+
+
+def _finish(telegram_id: int, request_text: str, validation_result: Dict[str, Any]) -> Dict[str, Any]:
+    validation_result.setdefault("timestamp", datetime.utcnow().isoformat())
+    DECISIONS.labels(validation_result["source"]).inc()
+    if validation_result["source"] != "degraded":
+        recent_decisions.record(telegram_id, request_text, validation_result["decision"])
+    return validation_result
+
+
+async def resolve_decision(
+    telegram_id: int,
+    request_text: str,
+    user_context: Dict[str, Any],
+    duration_minutes: Optional[int] = None,
+    deadline: Optional[float] = None,
+    user_rate_limit: bool = True,
+) -> Dict[str, Any]:
+    """
+    Рішення щодо запиту: локальні правила, потім кеш, потім модель
+
+    Результат містить поле source: "rules", "cache", "llm" або "degraded"
+    (локальне рішення, коли модель недоступна або не вклалась у бюджет
+    deadline). Якщо черга до моделі переповнена, піднімає AdmissionRejected.
+    user_rate_limit=False пропускає ліміт частоти користувача (пакетна
+    валідація), лишаючи лише глобальне обмеження конкурентності.
+    """
+    cache_key = decision_cache.make_key(request_text, user_context, duration_minutes)
+    validation_result = _local_decision(telegram_id, request_text, user_context, duration_minutes, cache_key)
+    
+    if validation_result is None:
+        validation_result = await _call_llm(
+            telegram_id, request_text, user_context, duration_minutes, deadline or latency_deadline(), user_rate_limit
+        )
+        # Кешуємо лише справжні відповіді моделі
+        if validation_result["source"] == "llm":
+            decision_cache.set(cache_key, validation_result)
+    
+    return _finish(telegram_id, request_text, validation_result)
+
+
+def _queue_timeout(deadline: float) -> float:
+    """Очікування в черзі до моделі не довше за залишок бюджету"""
+    return min(admission_controller.queue_timeout, max(deadline - time.monotonic(), 0))
+
+
+async def _call_llm(
+    telegram_id: int,
+    request_text: str,
+    user_context: Dict[str, Any],
+    duration_minutes: Optional[int],
+    deadline: float,
+    user_rate_limit: bool = True,
+) -> Dict[str, Any]:
+    """Виклик моделі через circuit breaker; при збоях — локальне рішення"""
+    if not llm_circuit_breaker.allow_request():
+        return degraded_decision(telegram_id, request_text, user_context, duration_minutes)
+    
+    # Викликаємо OpenAI для валідації, якщо контроль допуску пропускає запит
+    openai_service = get_validation_service()
+    route = model_router.route(telegram_id, request_text, user_context, duration_minutes)
+    rate_limited_id = telegram_id if user_rate_limit else None
+    async with admission_controller.acquire(rate_limited_id, timeout=_queue_timeout(deadline)):
+        started = time.monotonic()
+        try:
+            validation_result = await openai_service.validate_request(
+                request_text=request_text,
+                user_context=user_context,
+                duration_minutes=duration_minutes,
+                deadline=deadline,
+                route=route
+            )
+        except LLMUnavailableError:
+            validation_result = {"source": "fallback"}
+        latency = time.monotonic() - started
+    
+    if validation_result["source"] == "fallback":
+        llm_circuit_breaker.record_failure()
+        return degraded_decision(telegram_id, request_text, user_context, duration_minutes)
+    
+    llm_circuit_breaker.record_success(latency)
+    return validation_result
+
+
+async def stream_decision(
+    telegram_id: int,
+    request_text: str,
+    user_context: Dict[str, Any],
+    duration_minutes: Optional[int] = None,
+    deadline: Optional[float] = None,
+) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Потокова версія resolve_decision
+
+    Генерує ("decision", {"decision": ...}) якомога раніше, далі
+    ("message", {"delta": ...}) з фрагментами тексту і наостанок
+    ("done", повний результат).
+    """
+    cache_key = decision_cache.make_key(request_text, user_context, duration_minutes)
+    validation_result = _local_decision(telegram_id, request_text, user_context, duration_minutes, cache_key)
+    decision_sent = False
+    
+    if validation_result is None and not llm_circuit_breaker.allow_request():
+        validation_result = degraded_decision(telegram_id, request_text, user_context, duration_minutes)
+    
+    if validation_result is None:
+        deadline = deadline or latency_deadline()
+        openai_service = get_validation_service()
+        route = model_router.route(telegram_id, request_text, user_context, duration_minutes)
+        async with admission_controller.acquire(telegram_id, timeout=_queue_timeout(deadline)):
+            started = time.monotonic()
+            try:
+                async for event, value in openai_service.stream_request(
+                    request_text, user_context, duration_minutes, deadline, route
+                ):
+                    if event == "decision":
+                        decision_sent = True
+                        yield "decision", {"decision": value}
+                    elif event == "message":
+                        yield "message", {"delta": value}
+                    else:
+                        validation_result = value
+            except LLMUnavailableError:
+                validation_result = {"source": "fallback"}
+            latency = time.monotonic() - started
+        
+        if validation_result["source"] == "fallback":
+            llm_circuit_breaker.record_failure()
+            if not decision_sent:
+                validation_result = degraded_decision(telegram_id, request_text, user_context, duration_minutes)
+        else:
+            llm_circuit_breaker.record_success(latency)
+            decision_cache.set(cache_key, validation_result)
+    
+    if not decision_sent:
+        yield "decision", {"decision": validation_result["decision"]}
+        yield "message", {"delta": validation_result["message"]}
+    
+    yield "done", _finish(telegram_id, request_text, validation_result)
+
+
+def make_history_item(
+    request_text: str,
+    duration_minutes: Optional[int],
+    validation_result: Dict[str, Any],
+) -> Dict[str, Any]:
+    """Запис історії для результату валідації"""
+    return {
+        "timestamp": validation_result.get("timestamp"),
+        "request": request_text,
+        "app": detect_app(request_text),
+        "decision": validation_result["decision"],
+        "alternative": validation_result.get("alternative"),
+        "duration_minutes": duration_minutes
+    }
+
+
+def reminder_time(validation_result: Dict[str, Any], duration_minutes: Optional[int]) -> Optional[int]:
+    """Через скільки хвилин нагадати (лише для дозволених запитів з тривалістю)"""
+    if validation_result["decision"] == "allow" and duration_minutes:
+        return duration_minutes
+    return None
+
+
+def flight_key(telegram_id: int, request_text: str, duration_minutes: Optional[int]) -> Tuple[int, str, Optional[int]]:
+    """Ключ об'єднання однакових запитів: той самий текст і тривалість"""
+    if duration_minutes is None:
+        duration_minutes = parse_duration(request_text)
+    return telegram_id, normalize_text(request_text), duration_minutes
+
+
+async def validate_and_record(
+    telegram_id: int,
+    request_text: str,
+    profile: Dict[str, Any],
+    duration_minutes: Optional[int] = None,
+    deadline: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    Рішення щодо запиту із записом в історію, з об'єднанням дублікатів
+
+    Запис іде через history_writer і не чекає на Mongo.
+    """
+    
+    async def run() -> Dict[str, Any]:
+        validation_result = await resolve_decision(
+            telegram_id=telegram_id,
+            request_text=request_text,
+            user_context=user_context_from_profile(profile),
+            duration_minutes=duration_minutes,
+            deadline=deadline
+        )
+        history_item = make_history_item(request_text, duration_minutes, validation_result)
+        await history_writer.add(telegram_id, history_item)
+        return validation_result
+    
+    validation_result, _ = await validation_flight.do(flight_key(telegram_id, request_text, duration_minutes), run)
+    return validation_result
+
+
+async def stream_and_record(
+    telegram_id: int,
+    request_text: str,
+    profile: Dict[str, Any],
+    duration_minutes: Optional[int] = None,
+    deadline: Optional[float] = None,
+) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Потокова версія validate_and_record з тим самим об'єднанням дублікатів
+
+    Потік моделі та запис в історію виконує спільна задача першого
+    запиту, тож обрив його з'єднання їх не скасовує. Дублікат (зокрема
+    з /validate) не викликає модель, а чекає на підсумковий результат і
+    отримує його подіями decision, message і done.
+    """
+    events: asyncio.Queue = asyncio.Queue()
+    
+    async def run() -> Dict[str, Any]:
+        validation_result = None
+        try:
+            async for event, data in stream_decision(
+                telegram_id=telegram_id,
+                request_text=request_text,
+                user_context=user_context_from_profile(profile),
+                duration_minutes=duration_minutes,
+                deadline=deadline
+            ):
+                if event == "done":
+                    validation_result = data
+                else:
+                    events.put_nowait((event, data))
+        finally:
+            # Кінець потоку для першого запиту, зокрема після помилки
+            events.put_nowait(None)
+        history_item = make_history_item(request_text, duration_minutes, validation_result)
+        await history_writer.add(telegram_id, history_item)
+        return validation_result
+    
+    task, shared = validation_flight.start(flight_key(telegram_id, request_text, duration_minutes), run)
+    if not shared:
+        while (item := await events.get()) is not None:
+            yield item
+    validation_result = await asyncio.shield(task)
+    if shared:
+        yield "decision", {"decision": validation_result["decision"]}
+        yield "message", {"delta": validation_result["message"]}
+    yield "done", validation_result
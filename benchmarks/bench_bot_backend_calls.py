@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Кількість запитів бота до backend на одну взаємодію користувача
+
+Прогоняє сценарій (повторні /start, налаштування цілей, запити на
+валідацію до й після налаштування) через справжні обробники бота з
+фейковими Telegram API та backend і порівнює роботу без кешу сесій
+та з ним.
+
+Використання:
+    python -m benchmarks.bench_bot_backend_calls --users 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Dict, List
+
+import httpx
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:bench")
+
+from telegram import Update
+from telegram.ext import Application, CommandHandler, MessageHandler, filters
+
+import bot.main as bot_main
+from bot.session import SessionCache
+from benchmarks.bench_bot_webhook import FakeTelegramRequest
+
+
+def fake_backend() -> httpx.MockTransport:
+    """Backend, що пам'ятає користувачів та їхні цілі"""
+    users: Dict[int, Dict] = {}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content) if request.content else {}
+        telegram_id = body.get("telegram_id")
+        if request.url.path == "/register_user":
+            user = users.get(telegram_id)
+            if user is None:
+                users[telegram_id] = {"has_goals": False, "profile_version": 0}
+                return httpx.Response(200, json={"created": True, "has_goals": False, "profile_version": 0})
+            return httpx.Response(200, json={"created": False, **user})
+        if request.url.path == "/set_goals":
+            user = users[telegram_id]
+            user["has_goals"] = True
+            user["profile_version"] += 1
+            return httpx.Response(200, json={"profile_version": user["profile_version"]})
+        if request.url.path == "/validate/stream":
+            result = {"decision": "deny", "message": "Краще не зараз", "alternative": None, "reminder_time": None}
+            events = (
+                f"event: decision\ndata: {json.dumps({'decision': 'deny'})}\n\n"
+                f"event: message\ndata: {json.dumps({'delta': result['message']})}\n\n"
+                f"event: done\ndata: {json.dumps(result)}\n\n"
+            )
+            return httpx.Response(200, text=events, headers={"Content-Type": "text/event-stream"})
+        return httpx.Response(404)
+
+    return httpx.MockTransport(handler)
+
+
+def message_update(update_id: int, user_id: int, text: str) -> dict:
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "User"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+def scenario() -> List[str]:
+    """Типова поведінка: кілька /start, спроба валідації без цілей, цілі, валідації"""
+    return [
+        "/start",
+        "Хочу відкрити Instagram на 10 хв",
+        "/start",
+        "/goals",
+        "Цілі: вивчити Python\nДозволені: навчання\nЗаборонені: скрол",
+        "Хочу відкрити YouTube на 20 хв",
+        "/start",
+        "Хочу перевірити повідомлення в Instagram",
+    ]
+
+
+async def run(users: int, sessions: SessionCache) -> Dict:
+    client = httpx.AsyncClient(transport=fake_backend())
+    bot_main.bot_instance = bot_main.BlockMateBot(client=client, sessions=sessions)
+
+    application = Application.builder().token("123456:bench").request(FakeTelegramRequest(0)).build()
+    application.add_handler(CommandHandler("start", bot_main.start))
+    application.add_handler(CommandHandler("goals", bot_main.set_goals_command))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot_main.handle_message))
+    await application.initialize()
+
+    update_id = 0
+    for user_id in range(1, users + 1):
+        for text in scenario():
+            update_id += 1
+            await application.process_update(Update.de_json(message_update(update_id, user_id, text), application.bot))
+
+    await application.shutdown()
+    await bot_main.bot_instance.close()
+    return bot_main.bot_instance.stats()
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    args = parser.parse_args()
+
+    without_cache = await run(args.users, SessionCache(max_entries=0))
+    with_cache = await run(args.users, SessionCache())
+
+    print("=" * 50)
+    print(f"Користувачів: {args.users}, взаємодій: {without_cache['interactions']}")
+    print("=" * 50)
+    for name, stats in (("без кешу сесій", without_cache), ("з кешем сесій", with_cache)):
+        print(
+            f"{name:<16} запитів до backend: {stats['backend_calls']:>6}  "
+            f"на взаємодію: {stats['backend_calls_per_interaction']:.2f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
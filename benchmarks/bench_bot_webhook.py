@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Навантажувальний тест прийому оновлень бота: polling проти webhook
+
+Синтетичні оновлення обробляє той самий обробник (імітація звернення до
+backend + відповідь через фейковий Telegram API з затримкою):
+- polling: оновлення надходять у чергу застосунку й обробляються по одному,
+  як у run_polling без concurrent_updates;
+- webhook: оновлення надсилаються POST-запитами в ASGI-застосунок
+  create_webhook_app і обробляються паралельно PerChatUpdateProcessor.
+
+Мережа не використовується.
+
+Використання:
+    python -m benchmarks.bench_bot_webhook --updates 500 --users 100 --handler-ms 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Optional, Tuple
+
+import httpx
+
+os.environ.setdefault("BOT_WEBHOOK_SECRET", "bench-secret")
+os.environ.setdefault("BOT_WEBHOOK_REGISTER", "false")
+
+from telegram import Update
+from telegram.ext import Application, ContextTypes, MessageHandler, filters
+from telegram.request import BaseRequest, RequestData
+
+from bot.webhook import PerChatUpdateProcessor, create_webhook_app, WEBHOOK_PATH, SECRET_HEADER
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "BlockMate", "username": "blockmate_bot"}
+
+
+class FakeTelegramRequest(BaseRequest):
+    """Імітація Bot API з фіксованою затримкою"""
+
+    def __init__(self, latency_ms: float):
+        self.latency = latency_ms / 1000
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=None, write_timeout=None, connect_timeout=None,
+                         pool_timeout=None) -> Tuple[int, bytes]:
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        if endpoint == "getMe":
+            result = BOT_USER
+        elif endpoint == "sendMessage":
+            await asyncio.sleep(self.latency)
+            result = {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": params["chat_id"], "type": "private"},
+                "from": BOT_USER,
+                "text": params["text"],
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def make_update(update_id: int, user_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "User"},
+            "text": "Хочу відкрити Instagram на 10 хв, щоб перевірити повідомлення",
+        },
+    }
+
+
+def build_application(concurrent: bool, telegram_ms: float, handler_ms: float, total: int) -> Tuple[Application, asyncio.Event]:
+    builder = Application.builder().token("123456:bench").request(FakeTelegramRequest(telegram_ms))
+    if concurrent:
+        builder = builder.updater(None).concurrent_updates(PerChatUpdateProcessor())
+    else:
+        builder = builder.get_updates_request(FakeTelegramRequest(telegram_ms))
+    application = builder.build()
+
+    done = asyncio.Event()
+    processed = {"count": 0}
+
+    async def handle(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # Імітація звернення до backend
+        await asyncio.sleep(handler_ms / 1000)
+        await update.message.reply_text("ok")
+        processed["count"] += 1
+        if processed["count"] == total:
+            done.set()
+
+    application.add_handler(MessageHandler(filters.TEXT, handle))
+    return application, done
+
+
+async def bench_polling(args) -> float:
+    application, done = build_application(False, args.telegram_ms, args.handler_ms, args.updates)
+    await application.initialize()
+    await application.start()
+    started = time.perf_counter()
+    for i in range(args.updates):
+        await application.update_queue.put(Update.de_json(make_update(i, i % args.users), application.bot))
+    await done.wait()
+    elapsed = time.perf_counter() - started
+    await application.stop()
+    await application.shutdown()
+    return args.updates / elapsed
+
+
+async def bench_webhook(args) -> float:
+    application, done = build_application(True, args.telegram_ms, args.handler_ms, args.updates)
+    app = create_webhook_app(application, replica_urls=[])
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bot") as client:
+
+            async def post(i: int):
+                async with semaphore:
+                    response = await client.post(
+                        WEBHOOK_PATH,
+                        json=make_update(i, i % args.users),
+                        headers={SECRET_HEADER: os.environ["BOT_WEBHOOK_SECRET"]},
+                    )
+                    response.raise_for_status()
+
+            started = time.perf_counter()
+            await asyncio.gather(*(post(i) for i in range(args.updates)))
+            await done.wait()
+            elapsed = time.perf_counter() - started
+    return args.updates / elapsed
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=500)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--handler-ms", type=float, default=50.0, help="затримка backend на оновлення")
+    parser.add_argument("--telegram-ms", type=float, default=30.0, help="затримка Bot API на sendMessage")
+    parser.add_argument("--concurrency", type=int, default=40, help="паралельні з'єднання вебхука")
+    args = parser.parse_args()
+
+    print("=" * 50)
+    print(f"Оновлень: {args.updates}, користувачів: {args.users}")
+    print("=" * 50)
+    polling = await bench_polling(args)
+    print(f"polling: {polling:>10.1f} оновлень/с")
+    webhook = await bench_webhook(args)
+    print(f"webhook: {webhook:>10.1f} оновлень/с  (x{webhook / polling:.1f})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
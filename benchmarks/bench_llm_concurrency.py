@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк пропускної здатності OpenAIValidationService при різній конкурентності
+
+Замість справжнього OpenAI використовується локальний HTTP-транспорт із
+штучною затримкою, тому скрипт працює офлайн і не витрачає токени.
+
+Використання:
+    python -m benchmarks.bench_llm_concurrency --latency-ms 300 --requests 64
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import httpx
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from backend.services.llm_providers import OpenAIProvider, create_openai_client
+from backend.services.openai_service import OpenAIValidationService
+
+
+def make_fake_transport(latency_ms: float) -> httpx.MockTransport:
+    """Транспорт, що імітує OpenAI chat completions із заданою затримкою"""
+    completion = {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": "gpt-4.1-nano",
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {
+                "role": "assistant",
+                "content": json.dumps({
+                    "decision": "allow",
+                    "message": "Гаразд, 10 хвилин на повідомлення.",
+                    "alternative": None,
+                }, ensure_ascii=False),
+            },
+        }],
+        "usage": {"prompt_tokens": 200, "completion_tokens": 30, "total_tokens": 230},
+    }
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(latency_ms / 1000)
+        return httpx.Response(200, json=completion)
+
+    return httpx.MockTransport(handler)
+
+
+async def run_level(service: OpenAIValidationService, concurrency: int, total: int) -> float:
+    """Виконує total запитів з обмеженням concurrency, повертає запитів/с"""
+    semaphore = asyncio.Semaphore(concurrency)
+    user_context = {
+        "goals": ["вивчити Python"],
+        "allowed_usecases": ["перевірити повідомлення"],
+        "forbidden_usecases": ["скрол стрічки"],
+    }
+
+    async def one():
+        async with semaphore:
+            await service.validate_request(
+                request_text="хочу відкрити Instagram на 10 хв перевірити повідомлення",
+                user_context=user_context,
+                duration_minutes=10,
+            )
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    return total / (time.perf_counter() - started)
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--levels", default="1,2,4,8,16,32")
+    args = parser.parse_args()
+
+    http_client = httpx.AsyncClient(transport=make_fake_transport(args.latency_ms))
+    client = create_openai_client(http_client=http_client)
+    service = OpenAIValidationService(OpenAIProvider(client))
+
+    print("=" * 50)
+    print(f"Затримка моделі: {args.latency_ms:.0f} мс, запитів на рівень: {args.requests}")
+    print("=" * 50)
+    print(f"{'конкурентність':>15} {'запитів/с':>12}")
+
+    try:
+        for level in [int(x) for x in args.levels.split(",")]:
+            throughput = await run_level(service, level, args.requests)
+            print(f"{level:>15} {throughput:>12.1f}")
+    finally:
+        await client.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
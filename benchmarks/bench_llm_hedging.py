@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Хвостова затримка валідації без хеджування та з ним
+
+Основний і запасний провайдери — локальні FakeLLMProvider з логнормальною
+затримкою та рідкісними «зависаннями» (--stall-rate). Порівнюються
+p50/p95/p99 та частка дублікатів.
+
+Використання:
+    python -m benchmarks.bench_llm_hedging --requests 500 --latency-ms 200
+"""
+import argparse
+import asyncio
+import logging
+import math
+import random
+import sys
+import time
+from typing import List
+
+from backend.services.llm_providers import FakeLLMProvider
+from backend.services.openai_service import OpenAIValidationService
+
+
+class TailLatencyProvider(FakeLLMProvider):
+    """Логнормальна затримка та зрідка — багатократно довша відповідь"""
+
+    def __init__(self, model: str, median: float, sigma: float, stall_rate: float, stall_factor: float, seed: int):
+        super().__init__(model)
+        self.median = median
+        self.sigma = sigma
+        self.stall_rate = stall_rate
+        self.stall_factor = stall_factor
+        self.rng = random.Random(seed)
+
+    def latency(self, model: str) -> float:
+        latency = self.median * math.exp(self.sigma * self.rng.gauss(0, 1))
+        if self.rng.random() < self.stall_rate:
+            latency *= self.stall_factor
+        return latency
+
+
+def percentile(samples: List[float], q: float) -> float:
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * q), len(samples) - 1)]
+
+
+async def run(service: OpenAIValidationService, total: int, concurrency: int) -> List[float]:
+    user_context = {
+        "goals": ["менше часу в соцмережах"],
+        "allowed_usecases": ["відповісти на повідомлення"],
+        "forbidden_usecases": ["скрол стрічки"],
+    }
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i: int):
+        async with semaphore:
+            started = time.perf_counter()
+            await service.validate_request(f"хочу відкрити Instagram #{i}", user_context, 10)
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return latencies
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="медіана затримки моделі")
+    parser.add_argument("--sigma", type=float, default=0.3)
+    parser.add_argument("--stall-rate", type=float, default=0.03, help="частка дуже повільних відповідей")
+    parser.add_argument("--stall-factor", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    def provider(model: str, seed: int) -> TailLatencyProvider:
+        return TailLatencyProvider(
+            model, args.latency_ms / 1000, args.sigma, args.stall_rate, args.stall_factor, seed
+        )
+
+    print("=" * 60)
+    print(f"Медіана моделі: {args.latency_ms:.0f} мс, зависань: {args.stall_rate:.0%} x{args.stall_factor:.0f}")
+    print("=" * 60)
+    print(f"{'режим':>12} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'дублікатів':>11}")
+
+    for mode in ("без хеджу", "з хеджем"):
+        primary = provider("primary", args.seed)
+        hedge = provider("secondary", args.seed + 1) if mode == "з хеджем" else None
+        service = OpenAIValidationService(primary, hedge)
+        latencies = await run(service, args.requests, args.concurrency)
+        extra = (hedge.calls if hedge else 0) / args.requests
+        print(
+            f"{mode:>12} {percentile(latencies, 0.5) * 1000:>9.0f} {percentile(latencies, 0.95) * 1000:>9.0f} "
+            f"{percentile(latencies, 0.99) * 1000:>9.0f} {extra:>11.1%}"
+        )
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
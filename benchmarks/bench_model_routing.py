@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Маршрутизація між моделями: затримка та вартість за маршрутами
+
+Суміш коротких однозначних і довгих неоднозначних запитів проходить
+через model_router та OpenAIValidationService з локальним провайдером,
+затримка якого залежить від моделі, а впевненість — від запиту.
+Порівнюється вартість токенів з поведінкою за замовчуванням (маршрутизацію
+вимкнено: усе на дешеву модель без ескалації) та з варіантом «усе на
+стандартну модель».
+
+Використання:
+    python -m benchmarks.bench_model_routing --requests 500
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+from typing import Any, Dict, List
+
+from backend.services.llm_providers import FakeLLMProvider
+from backend.services.model_router import ROUTE_STANDARD, ModelRouter
+from backend.services.openai_service import OpenAIValidationService
+
+# Затримка відповіді за моделлю, секунди
+MODEL_LATENCY = {"gpt-4.1-nano": 0.15, "gpt-4.1-mini": 0.3, "gpt-4.1": 0.6}
+
+SHORT_REQUESTS = [
+    "5 хв перевірити DM в Instagram",
+    "відповісти на повідомлення в Telegram",
+    "хочу погортати стрічку в TikTok",
+    "подивитися шортс на YouTube",
+]
+LONG_REQUESTS = [
+    "Розумієш, я сьогодні дуже багато працював і мені здається, що я заслужив трохи відпочинку, "
+    "тому хочу подивитися кілька відео, але водночас я розумію, що можу застрягнути там надовго",
+    "Мені треба знайти в одній групі оголошення про роботу, яке хтось скидав минулого тижня, "
+    "але я не пам'ятаю, де саме, тож доведеться трохи пошукати і, можливо, погортати",
+]
+
+
+class BenchProvider(FakeLLMProvider):
+    """Затримка залежить від моделі; довгі запити дешева модель вирішує невпевнено"""
+
+    def latency(self, model: str) -> float:
+        return MODEL_LATENCY.get(model, 0.2)
+
+    async def _respond(self, messages, timeout, model):
+        completion = await super()._respond(messages, timeout, model)
+        if (model or self.model) == "gpt-4.1-nano" and len(messages[-1]["content"]) > 400:
+            result = json.loads(completion.content)
+            result["confidence"] = 0.4
+            completion.content = json.dumps(result, ensure_ascii=False)
+        return completion
+
+
+async def run(router: ModelRouter, requests: List[str], force_standard: bool, concurrency: int) -> Dict[str, Any]:
+    service = OpenAIValidationService(BenchProvider(), router=router)
+    user_context = {
+        "goals": ["вивчити Python"],
+        "allowed_usecases": ["відповісти на повідомлення"],
+        "forbidden_usecases": ["скрол стрічки"],
+    }
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int, text: str):
+        route = router.routes[ROUTE_STANDARD] if force_standard else router.route(i, text, user_context)
+        async with semaphore:
+            await service.validate_request(text, user_context, route=route)
+
+    await asyncio.gather(*(one(i, text) for i, text in enumerate(requests)))
+    return router.stats()
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--long-share", type=float, default=0.2, help="частка довгих неоднозначних запитів")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    rng = random.Random(args.seed)
+    requests = [
+        rng.choice(LONG_REQUESTS if rng.random() < args.long_share else SHORT_REQUESTS)
+        for _ in range(args.requests)
+    ]
+
+    print("=" * 72)
+    print(f"Запитів: {args.requests}, довгих: {args.long_share:.0%}")
+    print("=" * 72)
+    print(f"{'режим':>16} {'маршрут':>10} {'викликів':>9} {'p50, мс':>8} {'p95, мс':>8} {'USD/виклик':>12}")
+
+    totals = {}
+    modes = (
+        ("усе на light", False, False),
+        ("усе на standard", True, True),
+        ("маршрутизація", True, False),
+    )
+    for mode, enabled, force_standard in modes:
+        stats = await run(ModelRouter(enabled=enabled), requests, force_standard, args.concurrency)
+        totals[mode] = sum(route["cost_usd"] for route in stats["routes"].values())
+        for name, route in stats["routes"].items():
+            if not route["calls"]:
+                continue
+            print(
+                f"{mode:>16} {name:>10} {route['calls']:>9} {route['latency_p50_seconds'] * 1000:>8.0f} "
+                f"{route['latency_p95_seconds'] * 1000:>8.0f} {route['cost_usd_per_call']:>12.6f}"
+            )
+        print(f"{mode:>16} ескалацій: {stats['escalations']}")
+
+    print()
+    baseline = totals["усе на light"]
+    for mode, total in totals.items():
+        relative = f"  (x{total / baseline:.2f} до «усе на light»)" if baseline else ""
+        print(f"{mode:>16}: ${total / args.requests * 1000:.4f} за 1000 запитів{relative}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк затримки пошуку користувача за telegram_id з індексом і без
+
+Потребує запущеної MongoDB (MONGODB_URL). Дані створюються в окремій
+базі MONGODB_BENCH_DB_NAME (за замовчуванням blockmate_bench), яка
+видаляється після завершення.
+
+Використання:
+    python -m benchmarks.bench_user_lookup --sizes 100000,1000000
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+SEED_BATCH = 10_000
+
+
+def make_user(telegram_id: int) -> dict:
+    return {
+        "telegram_id": telegram_id,
+        "username": f"user{telegram_id}",
+        "goals": ["вивчити Python", "більше спати"],
+        "allowed_usecases": ["перевірити повідомлення", "навчання"],
+        "forbidden_usecases": ["скрол стрічки", "бездумні відео"],
+        "history": [],
+    }
+
+
+async def seed(collection, size: int):
+    """Доповнює колекцію до size користувачів"""
+    existing = await collection.estimated_document_count()
+    for start in range(existing, size, SEED_BATCH):
+        end = min(start + SEED_BATCH, size)
+        await collection.insert_many([make_user(i) for i in range(start, end)], ordered=False)
+
+
+async def measure(collection, size: int, lookups: int) -> dict:
+    """Затримки find_one для випадкових telegram_id, мс"""
+    latencies = []
+    for _ in range(lookups):
+        telegram_id = random.randrange(size)
+        started = time.perf_counter()
+        await collection.find_one({"telegram_id": telegram_id}, {"goals": 1, "_id": 0})
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return {
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+        "max": latencies[-1],
+    }
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100000,1000000")
+    parser.add_argument("--lookups", type=int, default=1000, help="кількість пошуків з індексом")
+    parser.add_argument("--scan-lookups", type=int, default=50, help="кількість пошуків без індексу")
+    args = parser.parse_args()
+
+    mongodb_url = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
+    db_name = os.getenv("MONGODB_BENCH_DB_NAME", "blockmate_bench")
+    client = AsyncIOMotorClient(mongodb_url)
+    collection = client[db_name].users
+
+    print("=" * 60)
+    print(f"{'користувачів':>12} {'індекс':>8} {'p50, мс':>10} {'p95, мс':>10} {'max, мс':>10}")
+    print("=" * 60)
+
+    try:
+        await collection.drop()
+        for size in sorted(int(x) for x in args.sizes.split(",")):
+            await seed(collection, size)
+
+            await collection.drop_indexes()
+            result = await measure(collection, size, args.scan_lookups)
+            print(f"{size:>12} {'ні':>8} {result['p50']:>10.2f} {result['p95']:>10.2f} {result['max']:>10.2f}")
+
+            await collection.create_index("telegram_id", unique=True)
+            result = await measure(collection, size, args.lookups)
+            print(f"{size:>12} {'так':>8} {result['p50']:>10.2f} {result['p95']:>10.2f} {result['max']:>10.2f}")
+    finally:
+        await client.drop_database(db_name)
+        client.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
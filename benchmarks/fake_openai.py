@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Фейковий OpenAI-сумісний сервер для офлайн-бенчмарків
+
+Відповідає на POST /v1/chat/completions JSON-рішенням у форматі, який
+очікує OpenAIValidationService. Затримка має логнормальний розподіл
+(медіана та sigma), частину запитів можна завершувати помилками 500 та
+429 з Retry-After. Підтримується і потоковий режим (stream=true).
+
+Окремий запуск:
+    python -m benchmarks.fake_openai --port 9999 --latency-ms 300 --error-rate 0.01
+    OPENAI_BASE_URL=http://127.0.0.1:9999/v1 uvicorn backend.main:app
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from typing import Any, Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from backend.services.llm_providers import fake_decision
+
+
+class LatencyModel:
+    """Логнормальна затримка з заданою медіаною та розкидом"""
+
+    def __init__(self, median_ms: float, sigma: float, rng: random.Random):
+        self.median = median_ms / 1000
+        self.sigma = sigma
+        self.rng = rng
+
+    def sample(self) -> float:
+        if self.median <= 0:
+            return 0.0
+        return self.median * math.exp(self.sigma * self.rng.gauss(0, 1))
+
+
+def create_fake_openai(
+    latency_ms: float = 200.0,
+    latency_sigma: float = 0.3,
+    error_rate: float = 0.0,
+    rate_limit_rate: float = 0.0,
+    retry_after_seconds: float = 0.2,
+    seed: Optional[int] = None,
+) -> FastAPI:
+    rng = random.Random(seed)
+    latency = LatencyModel(latency_ms, latency_sigma, rng)
+    app = FastAPI(title="Fake OpenAI")
+    app.state.requests = 0
+    app.state.errors = 0
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        await asyncio.sleep(latency.sample())
+
+        roll = rng.random()
+        if roll < rate_limit_rate:
+            app.state.errors += 1
+            return JSONResponse(
+                status_code=429,
+                content={"error": {"message": "Rate limit reached", "type": "requests"}},
+                headers={"retry-after": str(retry_after_seconds)},
+            )
+        if roll < rate_limit_rate + error_rate:
+            app.state.errors += 1
+            return JSONResponse(status_code=500, content={"error": {"message": "Internal error", "type": "server_error"}})
+
+        content = json.dumps(fake_decision(body.get("messages")), ensure_ascii=False)
+        usage = {"prompt_tokens": 250, "completion_tokens": 40, "total_tokens": 290,
+                 "prompt_tokens_details": {"cached_tokens": 128}}
+        base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": body.get("model", "fake")}
+
+        if not body.get("stream"):
+            return {
+                **base,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": usage,
+            }
+
+        async def chunks():
+            # Відповідь частинами по кілька символів, usage — окремим останнім чанком
+            for offset in range(0, len(content), 8):
+                chunk = {**base, "object": "chat.completion.chunk", "choices": [
+                    {"index": 0, "delta": {"content": content[offset:offset + 8]}, "finish_reason": None}
+                ]}
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            yield f"data: {json.dumps({**base, 'object': 'chat.completion.chunk', 'choices': [], 'usage': usage})}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9999)
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="медіана затримки")
+    parser.add_argument("--latency-sigma", type=float, default=0.3, help="sigma логнормального розподілу")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="частка відповідей 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="частка відповідей 429")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    app = create_fake_openai(args.latency_ms, args.latency_sigma, args.error_rate, args.rate_limit_rate, seed=args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
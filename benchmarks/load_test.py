@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Офлайн навантажувальний тест backend з порівнянням із базовою лінією
+
+Піднімає FastAPI-застосунок у процесі разом із фейковим OpenAI-сервером
+(benchmarks/fake_openai.py) та in-memory MongoDB (mongomock-motor) або
+локальною MongoDB і проганяє фази /register_user, /set_goals, /validate
+та /user/{id} із заданою конкурентністю. Для кожного endpoint виводить
+пропускну здатність та p50/p95/p99.
+
+Результати порівнюються з benchmarks/baseline.json: якщо p95 зріс або
+пропускна здатність впала більше ніж на --tolerance (медіана з --repeat
+прогонів), скрипт завершується
+з кодом 1. Базова лінія залежить від машини — оновлюйте її прапорцем
+--update-baseline на тому ж середовищі, де запускаєте перевірку.
+
+Використання:
+    pip install -r requirements-bench.txt
+    python -m benchmarks.load_test
+    python -m benchmarks.load_test --mongo-url mongodb://localhost:27017 --concurrency 64
+    python -m benchmarks.load_test --update-baseline
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+import httpx
+import uvicorn
+
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+BENCH_DB_NAME = "blockmate_bench"
+
+APPS = ["Instagram", "YouTube", "TikTok", "Telegram", "Facebook"]
+PURPOSES = [
+    "перевірити повідомлення",
+    "подивитися лекцію з Python",
+    "просто погортати стрічку",
+    "відповісти другу",
+    "знайти рецепт на вечерю",
+]
+DURATIONS = [5, 10, 15, 30]
+GOALS = [
+    (["вивчити Python"], ["навчання", "перевірити повідомлення"], ["скрол стрічки", "шортси"]),
+    (["більше спорту"], ["фітнес", "відповісти другу"], ["бездумні відео"]),
+    (["розвивати блог"], ["робота", "інспірація"], ["чужі новини", "погортати стрічку"]),
+]
+# Параметри, від яких залежать результати: порівнюємо лише однакові конфігурації
+CONFIG_KEYS = ("users", "requests", "concurrency", "repeat", "llm_latency_ms", "llm_latency_sigma",
+               "llm_error_rate", "llm_rate_limit_rate", "seed", "mongo")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(samples: List[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(q * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+async def run_phase(
+    name: str,
+    calls: List[Callable[[], Awaitable[httpx.Response]]],
+    concurrency: int,
+) -> Dict[str, Any]:
+    """Виконання запитів фази з обмеженням конкурентності"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+
+    async def one(call):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await call()
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status = e.__class__.__name__
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(call) for call in calls))
+    elapsed = time.perf_counter() - started
+    return {
+        "endpoint": name,
+        "requests": len(calls),
+        "throughput": len(calls) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "errors": errors,
+    }
+
+
+def request_text(rng: random.Random) -> Dict[str, Any]:
+    duration = rng.choice(DURATIONS)
+    return {
+        "request_text": f"Хочу відкрити {rng.choice(APPS)} на {duration} хв, щоб {rng.choice(PURPOSES)}",
+        "duration_minutes": duration,
+    }
+
+
+async def start_fake_openai(args, port: int) -> Tuple[uvicorn.Server, asyncio.Task]:
+    # Імпорт після налаштування оточення: fake_openai тягне модулі backend
+    from benchmarks.fake_openai import create_fake_openai
+
+    app = create_fake_openai(
+        latency_ms=args.llm_latency_ms,
+        latency_sigma=args.llm_latency_sigma,
+        error_rate=args.llm_error_rate,
+        rate_limit_rate=args.llm_rate_limit_rate,
+        seed=args.seed,
+    )
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    return server, task
+
+
+async def prepare_database(args):
+    """In-memory MongoDB або окрема база на локальному сервері"""
+    if args.mongo_url:
+        os.environ["MONGODB_URL"] = args.mongo_url
+        os.environ["MONGODB_DB_NAME"] = BENCH_DB_NAME
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(args.mongo_url)
+        await client.drop_database(BENCH_DB_NAME)
+        client.close()
+        return
+
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        sys.exit("mongomock-motor не встановлено: pip install -r requirements-bench.txt або вкажіть --mongo-url")
+
+    import backend.database as database
+    database._db = AsyncMongoMockClient()[BENCH_DB_NAME]
+
+
+async def run_suite(args, port: int, repeat: int) -> List[Dict[str, Any]]:
+    """Один прогін усіх фаз на чистій базі"""
+    fake_openai, fake_openai_task = await start_fake_openai(args, port)
+    await prepare_database(args)
+    # Імпорт після налаштування оточення: модулі читають конфігурацію при імпорті
+    from backend.main import app
+    from backend.services.decision_cache import decision_cache
+
+    # Кеш рішень спільний для всіх користувачів — інакше повторні прогони були б «теплими»
+    decision_cache.clear()
+    # Джиттер повторів у клієнті моделі
+    random.seed(args.seed)
+
+    rng = random.Random(args.seed)
+    # Нові id на кожен прогін: ліміти та кеші на користувача в процесі не скидаються
+    first_id = 1_000_000 + repeat * args.users
+    user_ids = list(range(first_id, first_id + args.users))
+    validate_items = [(rng.choice(user_ids), request_text(rng)) for _ in range(args.requests)]
+
+    results = []
+    try:
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://backend", timeout=60.0) as client:
+                results.append(await run_phase("POST /register_user", [
+                    lambda telegram_id=telegram_id: client.post(
+                        "/register_user", json={"telegram_id": telegram_id, "username": f"user{telegram_id}"}
+                    )
+                    for telegram_id in user_ids
+                ], args.concurrency))
+
+                results.append(await run_phase("POST /set_goals", [
+                    lambda telegram_id=telegram_id: client.post("/set_goals", json={
+                        "telegram_id": telegram_id,
+                        "goals": GOALS[telegram_id % len(GOALS)][0],
+                        "allowed_usecases": GOALS[telegram_id % len(GOALS)][1],
+                        "forbidden_usecases": GOALS[telegram_id % len(GOALS)][2],
+                    })
+                    for telegram_id in user_ids
+                ], args.concurrency))
+
+                results.append(await run_phase("POST /validate", [
+                    lambda telegram_id=telegram_id, item=item: client.post(
+                        "/validate", json={"telegram_id": telegram_id, **item}
+                    )
+                    for telegram_id, item in validate_items
+                ], args.concurrency))
+
+                results.append(await run_phase("GET /user/{id}", [
+                    lambda telegram_id=telegram_id: client.get(f"/user/{telegram_id}")
+                    for telegram_id in user_ids
+                ], args.concurrency))
+    finally:
+        fake_openai.should_exit = True
+        await fake_openai_task
+
+    return results
+
+
+def median_results(runs: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Медіана кожної метрики по прогонах — менше шуму від сусідніх процесів"""
+    results = []
+    for phases in zip(*runs):
+        merged = dict(phases[0])
+        for key in ("throughput", "p50_ms", "p95_ms", "p99_ms"):
+            merged[key] = statistics.median(phase[key] for phase in phases)
+        errors: Dict[str, int] = {}
+        for phase in phases:
+            for code, count in phase["errors"].items():
+                errors[code] = errors.get(code, 0) + count
+        merged["errors"] = {code: round(count / len(phases)) for code, count in errors.items()}
+        results.append(merged)
+    return results
+
+
+def compare(
+    results: List[Dict[str, Any]], baseline: Dict[str, Any], tolerance: float, min_delta_ms: float
+) -> List[str]:
+    """Список регресій відносно базової лінії"""
+    regressions = []
+    reference = {item["endpoint"]: item for item in baseline["results"]}
+    for result in results:
+        base = reference.get(result["endpoint"])
+        if base is None:
+            continue
+        # Для мілісекундних endpoint'ів відносний поріг надто чутливий до шуму
+        if result["p95_ms"] > max(base["p95_ms"] * (1 + tolerance), base["p95_ms"] + min_delta_ms):
+            regressions.append(
+                f"{result['endpoint']}: p95 {result['p95_ms']:.1f} мс > {base['p95_ms']:.1f} мс (+{tolerance:.0%})"
+            )
+        if result["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"{result['endpoint']}: {result['throughput']:.1f} запитів/с < {base['throughput']:.1f} (-{tolerance:.0%})"
+            )
+        # Помилки моделі випадкові, тож допускаємо ще 1% запитів понад базову лінію
+        allowed_errors = sum(base["errors"].values()) * (1 + tolerance) + 0.01 * result["requests"]
+        if sum(result["errors"].values()) > allowed_errors:
+            regressions.append(f"{result['endpoint']}: помилок {result['errors']} проти {base['errors']}")
+    return regressions
+
+
+def print_results(results: List[Dict[str, Any]]):
+    print(f"{'endpoint':<22} {'запитів':>8} {'запитів/с':>10} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9}  помилки")
+    for r in results:
+        errors = ", ".join(f"{code}: {count}" for code, count in r["errors"].items()) or "-"
+        print(
+            f"{r['endpoint']:<22} {r['requests']:>8} {r['throughput']:>10.1f} "
+            f"{r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f}  {errors}"
+        )
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--requests", type=int, default=1000, help="кількість запитів /validate")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--llm-latency-ms", type=float, default=150.0, help="медіана затримки фейкової моделі")
+    parser.add_argument("--llm-latency-sigma", type=float, default=0.3)
+    parser.add_argument("--llm-error-rate", type=float, default=0.01, help="частка відповідей 500")
+    parser.add_argument("--llm-rate-limit-rate", type=float, default=0.01, help="частка відповідей 429")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=3, help="кількість прогонів; звітується медіана")
+    parser.add_argument("--mongo-url", default=None, help="локальна MongoDB замість in-memory")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=0.3, help="допустиме погіршення відносно базової лінії")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="мінімальний приріст p95, що вважається регресією")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--output", type=Path, default=None, help="зберегти результати в JSON")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    config = {key: getattr(args, key, None) for key in CONFIG_KEYS if key != "mongo"}
+    config["mongo"] = "local" if args.mongo_url else "memory"
+
+    print("=" * 80)
+    print(f"Конфігурація: {json.dumps(config, ensure_ascii=False)}")
+    print("=" * 80)
+    port = free_port()
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+    runs = []
+    for repeat in range(args.repeat):
+        runs.append(await run_suite(args, port, repeat))
+    results = median_results(runs)
+    print_results(results)
+
+    report = {"config": config, "results": results}
+    if args.output:
+        args.output.write_text(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(report, ensure_ascii=False, indent=2) + "\n")
+        print(f"\nБазову лінію оновлено: {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        print(f"\nБазової лінії {args.baseline} немає — запустіть з --update-baseline")
+        return 0
+
+    baseline = json.loads(args.baseline.read_text())
+    if baseline.get("config") != config:
+        print(f"\nКонфігурація відрізняється від базової лінії ({json.dumps(baseline.get('config'))}), порівняння неможливе")
+        return 2
+
+    regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+    if regressions:
+        print("\n❌ Регресії відносно базової лінії:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print("\n✅ Без регресій відносно базової лінії")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -1,10 +1,12 @@
 import asyncio
+import json
 import logging
 import os
-from datetime import datetime, timedelta
-from typing import Dict
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
 
-from telegram import Update
+from telegram import Message, Update
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -12,10 +14,14 @@ from telegram.ext import (
     ContextTypes,
     filters
 )
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.date import DateTrigger
-
 import httpx
+from prometheus_client import start_http_server
+
+from bot.metrics import BACKEND_CALLS, BOT_METRICS_PORT, ERRORS, INTERACTIONS, stage
+from bot.outbound import OutboundQueue
+from bot.reminders import get_reminders, start_reminders, stop_reminders
+from bot.session import SessionCache
+from bot.webhook import PerChatUpdateProcessor, create_webhook_app
 
 # Налаштування логування
 logging.basicConfig(
@@ -27,33 +33,80 @@ logger = logging.getLogger(__name__)
 # Змінні оточення
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
+# "polling" (за замовчуванням) або "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+BOT_WEBHOOK_PORT = int(os.getenv("BOT_WEBHOOK_PORT", "8080"))
+# Пул з'єднань до backend
+BOT_HTTP_MAX_CONNECTIONS = int(os.getenv("BOT_HTTP_MAX_CONNECTIONS", "100"))
+BOT_HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("BOT_HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+BOT_HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("BOT_HTTP_KEEPALIVE_EXPIRY_SECONDS", "30"))
 
 if not TELEGRAM_BOT_TOKEN:
     raise ValueError("TELEGRAM_BOT_TOKEN not found in environment variables")
 
-# Глобальний scheduler для нагадувань
-scheduler = AsyncIOScheduler()
-scheduler.start()
+
+def create_backend_client() -> httpx.AsyncClient:
+    """HTTP-клієнт до backend з keep-alive пулом з'єднань"""
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(30.0, connect=5.0),
+        limits=httpx.Limits(
+            max_connections=BOT_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=BOT_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=BOT_HTTP_KEEPALIVE_EXPIRY_SECONDS,
+        ),
+    )
 
 
 class BlockMateBot:
-    def __init__(self):
+    def __init__(self, client: Optional[httpx.AsyncClient] = None, sessions: Optional[SessionCache] = None):
         self.backend_url = BACKEND_URL
-        self.client = httpx.AsyncClient(timeout=30.0)
+        self.client = client or create_backend_client()
+        self.sessions = sessions if sessions is not None else SessionCache()
+        # Лічильники для оцінки кількості запитів до backend на взаємодію
+        self.interactions = 0
+        self.backend_calls = 0
+        self.client.event_hooks["request"].append(self._count_backend_call)
+    
+    async def _count_backend_call(self, request: httpx.Request):
+        self.backend_calls += 1
+        BACKEND_CALLS.inc()
+    
+    def record_interaction(self):
+        self.interactions += 1
+        INTERACTIONS.inc()
+    
+    async def close(self):
+        await self.client.aclose()
+    
+    def stats(self) -> Dict:
+        return {
+            "interactions": self.interactions,
+            "backend_calls": self.backend_calls,
+            "backend_calls_per_interaction": self.backend_calls / self.interactions if self.interactions else 0.0,
+            "sessions": self.sessions.stats(),
+        }
     
     async def register_user(self, telegram_id: int, username: str = None) -> bool:
-        """Реєстрація користувача в системі"""
+        """Реєстрація користувача в системі (відомих користувачів пропускаємо)"""
+        if self.sessions.get(telegram_id) is not None:
+            return True
         try:
-            response = await self.client.post(
-                f"{self.backend_url}/register_user",
-                json={
-                    "telegram_id": telegram_id,
-                    "username": username
-                }
-            )
-            return response.status_code == 200
+            with stage("backend_register"):
+                response = await self.client.post(
+                    f"{self.backend_url}/register_user",
+                    json={
+                        "telegram_id": telegram_id,
+                        "username": username
+                    }
+                )
+            if response.status_code != 200:
+                return False
+            data = response.json()
+            self.sessions.set(telegram_id, data.get("has_goals", False), data.get("profile_version", 0))
+            return True
         except Exception as e:
             logger.error(f"Error registering user: {e}")
+            ERRORS.labels("backend_register", e.__class__.__name__).inc()
             return False
     
     async def set_goals(
@@ -65,45 +118,155 @@ class BlockMateBot:
     ) -> bool:
         """Встановлення цілей користувача"""
         try:
-            response = await self.client.post(
-                f"{self.backend_url}/set_goals",
-                json={
-                    "telegram_id": telegram_id,
-                    "goals": goals,
-                    "allowed_usecases": allowed_usecases,
-                    "forbidden_usecases": forbidden_usecases
-                }
+            with stage("backend_set_goals"):
+                response = await self.client.post(
+                    f"{self.backend_url}/set_goals",
+                    json={
+                        "telegram_id": telegram_id,
+                        "goals": goals,
+                        "allowed_usecases": allowed_usecases,
+                        "forbidden_usecases": forbidden_usecases
+                    }
+                )
+            if response.status_code != 200:
+                self.sessions.invalidate(telegram_id)
+                return False
+            self.sessions.set(
+                telegram_id,
+                bool(goals or allowed_usecases or forbidden_usecases),
+                response.json().get("profile_version", 0)
             )
-            return response.status_code == 200
+            return True
         except Exception as e:
             logger.error(f"Error setting goals: {e}")
+            ERRORS.labels("backend_set_goals", e.__class__.__name__).inc()
             return False
     
     async def validate_request(
         self,
         telegram_id: int,
         request_text: str,
-        duration_minutes: int = None
+        duration_minutes: int = None,
+        on_progress: Optional[Callable[[str, str], Awaitable[None]]] = None,
+        idempotency_key: Optional[str] = None
     ) -> Dict:
-        """Валідація запиту користувача"""
+        """
+        Валідація запиту користувача через потоковий /validate/stream
+
+        on_progress(decision, message_so_far) викликається, щойно відоме
+        рішення, і далі з кожним новим фрагментом тексту. idempotency_key
+        (update_id Telegram) робить повторну доставку того самого
+        оновлення безпечною: backend поверне збережену відповідь.
+        """
+        session = self.sessions.get(telegram_id)
+        if session is not None and not session["has_goals"]:
+            # Без цілей валідувати нема з чим — не ходимо в backend
+            return {"error": "Спочатку налаштуй свої цілі."}
         try:
-            response = await self.client.post(
-                f"{self.backend_url}/validate",
-                json={
-                    "telegram_id": telegram_id,
-                    "request_text": request_text,
-                    "duration_minutes": duration_minutes
-                }
-            )
-            if response.status_code == 200:
-                return response.json()
-            else:
-                return {"error": response.text}
+            with stage("backend_validate"):
+                async with self.client.stream(
+                    "POST",
+                    f"{self.backend_url}/validate/stream",
+                    json={
+                        "telegram_id": telegram_id,
+                        "request_text": request_text,
+                        "duration_minutes": duration_minutes
+                    },
+                    headers={"Idempotency-Key": idempotency_key} if idempotency_key else None
+                ) as response:
+                    if response.status_code != 200:
+                        await response.aread()
+                        if response.status_code == 404:
+                            self.sessions.invalidate(telegram_id)
+                        if response.status_code in (409, 429, 503):
+                            retry_after = response.headers.get("Retry-After", "кілька")
+                            return {"error": f"Сервіс зараз перевантажений, спробуй через {retry_after} с."}
+                        return {"error": response.text}
+                
+                    decision = None
+                    message = ""
+                    async for event, data in iter_sse_events(response):
+                        if event == "decision":
+                            decision = data["decision"]
+                        elif event == "message":
+                            message += data["delta"]
+                        elif event == "done":
+                            return data
+                        elif event == "error":
+                            retry_after = data.get("retry_after", "кілька")
+                            return {"error": f"Сервіс зараз перевантажений, спробуй через {retry_after} с."}
+                    
+                        if on_progress and decision:
+                            await on_progress(decision, message)
+                
+                    return {"error": "Відповідь сервера обірвалась"}
         except Exception as e:
             logger.error(f"Error validating request: {e}")
+            ERRORS.labels("backend_validate", e.__class__.__name__).inc()
             return {"error": str(e)}
 
 
+async def iter_sse_events(response: httpx.Response) -> AsyncIterator[Tuple[str, Dict]]:
+    """Розбір потоку Server-Sent Events на пари (подія, дані)"""
+    event = "message"
+    data_lines = []
+    async for line in response.aiter_lines():
+        if not line:
+            if data_lines:
+                yield event, json.loads("\n".join(data_lines))
+            event = "message"
+            data_lines = []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[len("data:"):].strip())
+
+
+class ProgressiveReply:
+    """Одне повідомлення в Telegram, яке поступово доповнюється текстом"""
+    
+    # Telegram обмежує частоту редагувань, тож оновлюємо не частіше
+    EDIT_INTERVAL_SECONDS = 1.0
+    
+    def __init__(self, message: Message):
+        self.source = message
+        self.reply: Optional[Message] = None
+        self.text = ""
+        self.last_edit = 0.0
+    
+    async def update(self, decision: str, message: str):
+        text = format_decision_text(decision, message)
+        if text == self.text:
+            return
+        if self.reply is None:
+            self.reply = await self.source.reply_text(text)
+            self.text = text
+            self.last_edit = time.monotonic()
+        elif time.monotonic() - self.last_edit >= self.EDIT_INTERVAL_SECONDS:
+            await self._edit(text)
+    
+    async def finish(self, text: str):
+        if self.reply is None:
+            self.reply = await self.source.reply_text(text)
+            self.text = text
+        elif text != self.text:
+            await self._edit(text)
+    
+    async def _edit(self, text: str):
+        try:
+            await self.reply.edit_text(text)
+        except BadRequest as e:
+            # "Message is not modified" та подібні — не критично
+            logger.debug(f"Cannot edit message: {e}")
+        self.text = text
+        self.last_edit = time.monotonic()
+
+
+def format_decision_text(decision: str, message: str) -> str:
+    header = "✅ Можна" if decision == "allow" else "🤔 Краще не зараз"
+    return f"{header}\n\n{message}" if message else header
+
+
 bot_instance = BlockMateBot()
 
 
@@ -113,6 +276,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     telegram_id = user.id
     username = user.username
     
+    bot_instance.record_interaction()
+    
     # Реєструємо користувача
     await bot_instance.register_user(telegram_id, username)
     
@@ -143,6 +308,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 /goals - Налаштувати цілі та правила
 /validate - Перевірити запит на використання соцмережі
+/cancel_reminder - Скасувати активне нагадування
 
 💡 Як працює валідація:
 1. Створи Shortcut на iPhone, який відкриває цього бота
@@ -197,6 +363,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обробник звичайних повідомлень"""
     user_id = update.effective_user.id
     message_text = update.message.text
+    bot_instance.record_interaction()
     
     # Перевіряємо, чи користувач налаштовує цілі
     if context.user_data.get('setting_goals'):
@@ -204,7 +371,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # Інакше - це запит на валідацію
-    await process_validation_request(update, context, message_text)
+    with stage("validation_request"):
+        await process_validation_request(update, context, message_text)
 
 
 async def process_goals_setup(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
@@ -293,11 +461,14 @@ async def process_validation_request(update: Update, context: ContextTypes.DEFAU
     if duration_match:
         duration_minutes = int(duration_match.group(1))
     
-    # Викликаємо API для валідації
-    result = await bot_instance.validate_request(user_id, text, duration_minutes)
+    # Викликаємо API для валідації; відповідь з'являється поступово
+    progress = ProgressiveReply(update.message)
+    result = await bot_instance.validate_request(
+        user_id, text, duration_minutes, on_progress=progress.update, idempotency_key=str(update.update_id)
+    )
     
     if "error" in result:
-        await update.message.reply_text(
+        await progress.finish(
             f"❌ Помилка: {result['error']}\n\n"
             "Переконайся, що ти зареєстрований (/start) та налаштував цілі (/goals)."
         )
@@ -309,63 +480,85 @@ async def process_validation_request(update: Update, context: ContextTypes.DEFAU
     reminder_time = result.get("reminder_time")
     
     # Формуємо відповідь
-    response_text = message
+    response_text = format_decision_text(decision, message)
     
     if alternative:
         response_text += f"\n\n💡 Альтернатива: {alternative}"
     
     # Якщо дозволено та вказана тривалість - налаштовуємо нагадування
     if decision == "allow" and reminder_time:
-        await schedule_reminder(user_id, reminder_time, update.effective_chat.id)
-        response_text += f"\n\n⏰ Нагадування встановлено на {reminder_time} хвилин."
+        try:
+            await get_reminders().schedule(user_id, update.effective_chat.id, reminder_time)
+            response_text += f"\n\n⏰ Нагадування встановлено на {reminder_time} хвилин."
+        except Exception as e:
+            logger.error(f"Error scheduling reminder: {e}")
     
-    await update.message.reply_text(response_text)
+    await progress.finish(response_text)
 
 
-async def send_reminder(chat_id: int, user_id: int):
-    """Надсилання нагадування користувачу"""
-    try:
-        from telegram import Bot
-        bot_token = os.getenv("TELEGRAM_BOT_TOKEN")
-        bot = Bot(token=bot_token)
-        
-        await bot.send_message(
-            chat_id=chat_id,
-            text="⏰ Час вийшов! Запланований час використання соцмережі минув.\n\n"
-                 "Рекомендую закрити додаток та повернутись до своїх цілей. 💪"
-        )
-    except Exception as e:
-        logger.error(f"Error sending reminder: {e}")
+async def cancel_reminder_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обробник команди /cancel_reminder"""
+    if await get_reminders().cancel(update.effective_user.id):
+        await update.message.reply_text("🔕 Нагадування скасовано.")
+    else:
+        await update.message.reply_text("Активних нагадувань немає.")
 
 
-async def schedule_reminder(user_id: int, minutes: int, chat_id: int):
-    """Планування нагадування"""
-    reminder_time = datetime.utcnow() + timedelta(minutes=minutes)
-    
-    scheduler.add_job(
-        send_reminder,
-        trigger=DateTrigger(run_date=reminder_time),
-        args=[chat_id, user_id],
-        id=f"reminder_{user_id}_{datetime.utcnow().timestamp()}"
-    )
+async def on_startup(application: Application):
+    """Запуск диспетчера нагадувань зі спільним екземпляром бота"""
+    await start_reminders(application.bot)
 
 
-def main():
-    """Запуск бота"""
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+async def on_shutdown(application: Application):
+    await stop_reminders()
+    await bot_instance.close()
+    logger.info(f"Backend usage: {bot_instance.stats()}")
+
+
+def build_application(concurrent: bool = False) -> Application:
+    """Створення застосунку бота з усіма обробниками"""
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        # Усі відповіді та нагадування проходять через спільну чергу з лімітами Telegram
+        .rate_limiter(OutboundQueue())
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if concurrent:
+        # Оновлення різних чатів обробляються паралельно, одного чату — по черзі
+        builder = builder.updater(None).concurrent_updates(PerChatUpdateProcessor())
+    application = builder.build()
     
     # Реєстрація обробників
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("goals", set_goals_command))
     application.add_handler(CommandHandler("validate", validate_command))
+    application.add_handler(CommandHandler("cancel_reminder", cancel_reminder_command))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-    
-    logger.info("Bot starting...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    return application
 
 
-if __name__ == "__main__":
-    main()
+def main():
+    """Запуск бота"""
+    if BOT_MODE == "webhook":
+        import uvicorn
+        
+        application = build_application(concurrent=True)
+        logger.info(f"Bot starting in webhook mode on port {BOT_WEBHOOK_PORT}...")
+        server = uvicorn.Server(uvicorn.Config(
+            create_webhook_app(application, stats=bot_instance.stats), host="0.0.0.0", port=BOT_WEBHOOK_PORT
+        ))
+        server.run()
+    else:
+        application = build_application()
+        if BOT_METRICS_PORT:
+            # У режимі polling HTTP-сервера немає — метрики віддаємо окремо
+            start_http_server(BOT_METRICS_PORT)
+        logger.info("Bot starting...")
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""
+Метрики Prometheus бота
+
+У режимі webhook віддаються на /metrics застосунку вебхука, у режимі
+polling — окремим HTTP-сервером на BOT_METRICS_PORT.
+"""
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from prometheus_client import Counter, Gauge, Histogram
+
+BOT_METRICS_PORT = int(os.getenv("BOT_METRICS_PORT", "9100"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGE_SECONDS = Histogram(
+    "blockmate_bot_stage_seconds", "Тривалість етапів обробки в боті", ["stage"], buckets=LATENCY_BUCKETS
+)
+ERRORS = Counter("blockmate_bot_errors_total", "Помилки бота за етапами", ["stage", "error"])
+INTERACTIONS = Counter("blockmate_bot_interactions_total", "Взаємодії користувачів з ботом")
+BACKEND_CALLS = Counter("blockmate_bot_backend_calls_total", "Запити бота до backend")
+SESSION_CACHE = Counter("blockmate_bot_session_cache_total", "Звернення до кешу сесій", ["result"])
+OUTBOUND_QUEUE_DEPTH = Gauge("blockmate_bot_outbound_queue_depth", "Запити в черзі відправки")
+OUTBOUND_DROPPED = Counter("blockmate_bot_outbound_dropped_total", "Відкинуті вихідні повідомлення", ["reason"])
+OUTBOUND_RETRY_AFTER = Counter("blockmate_bot_outbound_retry_after_total", "Відповіді RetryAfter від Telegram")
+REMINDERS = Counter("blockmate_bot_reminders_total", "Оброблені нагадування", ["result"])
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Вимірювання тривалості етапу"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(name).observe(time.perf_counter() - started)
@@ -0,0 +1,282 @@
+"""
+Черга вихідних повідомлень бота
+
+Усі запити до Bot API, що стосуються конкретного чату (sendMessage,
+editMessageText, sendChatAction, ...), проходять через одну чергу з
+глобальним та per-chat token bucket. Інтерактивні відповіді мають
+пріоритет над нагадуваннями, а RetryAfter від Telegram призупиняє
+відправку і запит повторюється автоматично.
+"""
+import asyncio
+import bisect
+import itertools
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Coroutine, Deque, Dict, List, Optional, Union
+
+from telegram.error import RetryAfter, TelegramError
+from telegram.ext import BaseRateLimiter
+
+from bot.metrics import OUTBOUND_DROPPED, OUTBOUND_QUEUE_DEPTH, OUTBOUND_RETRY_AFTER, STAGE_SECONDS, stage
+
+logger = logging.getLogger(__name__)
+
+# Telegram: ~30 повідомлень/с на бота, ~1/с у приватний чат, 20/хв у групу
+OUTBOUND_GLOBAL_RATE_PER_SECOND = float(os.getenv("OUTBOUND_GLOBAL_RATE_PER_SECOND", "30"))
+OUTBOUND_GLOBAL_BURST = float(os.getenv("OUTBOUND_GLOBAL_BURST", "30"))
+OUTBOUND_CHAT_RATE_PER_SECOND = float(os.getenv("OUTBOUND_CHAT_RATE_PER_SECOND", "1"))
+OUTBOUND_CHAT_BURST = float(os.getenv("OUTBOUND_CHAT_BURST", "3"))
+OUTBOUND_GROUP_RATE_PER_MINUTE = float(os.getenv("OUTBOUND_GROUP_RATE_PER_MINUTE", "20"))
+OUTBOUND_CHAT_BUCKETS_MAX = int(os.getenv("OUTBOUND_CHAT_BUCKETS_MAX", "10000"))
+# Скільки запитів може чекати в черзі
+OUTBOUND_MAX_QUEUE = int(os.getenv("OUTBOUND_MAX_QUEUE", "1000"))
+# Запит, що чекав довше, відкидається
+OUTBOUND_MAX_WAIT_SECONDS = float(os.getenv("OUTBOUND_MAX_WAIT_SECONDS", "60"))
+# Скільки разів повторювати запит після RetryAfter
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "2"))
+
+# Менше значення — вищий пріоритет
+PRIORITY_INTERACTIVE = 0
+PRIORITY_REMINDER = 10
+
+WAIT_SAMPLES = 1000
+
+
+class OutboundDropped(TelegramError):
+    """Повідомлення відкинуто чергою (переповнення або задовге очікування)"""
+
+
+class RateBucket:
+    def __init__(self, rate_per_second: float, capacity: float):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, now: float) -> float:
+        """Скільки секунд до появи вільного токена"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "chat_id", "enqueued_at", "future")
+
+    def __init__(self, priority: int, seq: int, chat_id: Union[int, str]):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.enqueued_at = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class OutboundQueue(BaseRateLimiter[Dict[str, Any]]):
+    """
+    Пріоритетна черга вихідних запитів з обмеженням частоти
+
+    Один фоновий диспетчер видає дозволи в порядку пріоритету, пропускаючи
+    чати, чий ліміт вичерпано, тож повільний чат не блокує інші.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = OUTBOUND_GLOBAL_RATE_PER_SECOND,
+        global_burst: float = OUTBOUND_GLOBAL_BURST,
+        chat_rate: float = OUTBOUND_CHAT_RATE_PER_SECOND,
+        chat_burst: float = OUTBOUND_CHAT_BURST,
+        group_rate_per_minute: float = OUTBOUND_GROUP_RATE_PER_MINUTE,
+        max_queue: int = OUTBOUND_MAX_QUEUE,
+        max_wait: float = OUTBOUND_MAX_WAIT_SECONDS,
+        max_retries: int = OUTBOUND_MAX_RETRIES,
+    ):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate_per_minute / 60
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self._global = RateBucket(global_rate, global_burst)
+        self._chats: "OrderedDict[Union[int, str], RateBucket]" = OrderedDict()
+        self._waiting: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._paused_until = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+        self.sent = 0
+        self.max_queue_depth = 0
+        self.retry_after = 0
+        self.dropped: Dict[str, int] = {"queue_full": 0, "deadline": 0}
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self._wait_samples: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+        OUTBOUND_QUEUE_DEPTH.set_function(lambda: len(self._waiting))
+
+    async def initialize(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for waiter in self._waiting:
+            if not waiter.future.done():
+                waiter.future.set_exception(OutboundDropped("Bot is shutting down"))
+        self._waiting.clear()
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Dict[str, Any]],
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]]]:
+        chat_id = data.get("chat_id")
+        if chat_id is None:
+            # getMe, getUpdates, setWebhook тощо не лімітуються
+            return await callback(*args, **kwargs)
+
+        priority = (rate_limit_args or {}).get("priority", PRIORITY_INTERACTIVE)
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(chat_id, priority)
+            try:
+                with stage("telegram_send"):
+                    return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self.retry_after += 1
+                OUTBOUND_RETRY_AFTER.inc()
+                logger.warning(f"Telegram flood control on {endpoint}: retry after {e.retry_after} s")
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                self._wakeup.set()
+                if attempt == self.max_retries:
+                    raise
+
+    async def _acquire(self, chat_id: Union[int, str], priority: int):
+        if len(self._waiting) >= self.max_queue:
+            lowest = self._waiting[-1]
+            if lowest.priority <= priority:
+                self.dropped["queue_full"] += 1
+                OUTBOUND_DROPPED.labels("queue_full").inc()
+                raise OutboundDropped("Outbound queue is full")
+            # Витісняємо найменш важливий запит
+            self._waiting.pop()
+            self._drop(lowest, "queue_full")
+
+        waiter = _Waiter(priority, next(self._seq), chat_id)
+        bisect.insort(self._waiting, waiter)
+        self.max_queue_depth = max(self.max_queue_depth, len(self._waiting))
+        self._wakeup.set()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter in self._waiting:
+                self._waiting.remove(waiter)
+            raise
+
+        waited = time.monotonic() - waiter.enqueued_at
+        self.sent += 1
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        self._wait_samples.append(waited)
+        STAGE_SECONDS.labels("outbound_queue_wait").observe(waited)
+
+    def _drop(self, waiter: _Waiter, reason: str):
+        self.dropped[reason] += 1
+        OUTBOUND_DROPPED.labels(reason).inc()
+        if not waiter.future.done():
+            waiter.future.set_exception(OutboundDropped(f"Outbound message dropped: {reason}"))
+
+    def _chat_bucket(self, chat_id: Union[int, str]) -> RateBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Від'ємні id та @username — групи й канали
+            is_group = not isinstance(chat_id, int) or chat_id < 0
+            if is_group:
+                bucket = RateBucket(self.group_rate, 1)
+            else:
+                bucket = RateBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+            if len(self._chats) > OUTBOUND_CHAT_BUCKETS_MAX:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    def _expire(self, now: float):
+        """Прибирання скасованих і задовго очікуючих запитів"""
+        alive = []
+        for waiter in self._waiting:
+            if waiter.future.done():
+                continue
+            if now - waiter.enqueued_at > self.max_wait:
+                self._drop(waiter, "deadline")
+                continue
+            alive.append(waiter)
+        self._waiting = alive
+
+    async def _dispatch(self):
+        while True:
+            now = time.monotonic()
+            self._expire(now)
+            if not self._waiting:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            delay = max(self._paused_until - now, self._global.wait_time(now))
+            if delay <= 0:
+                delay = self.max_wait
+                for index, waiter in enumerate(self._waiting):
+                    bucket = self._chat_bucket(waiter.chat_id)
+                    chat_delay = bucket.wait_time(now)
+                    if chat_delay <= 0:
+                        del self._waiting[index]
+                        self._global.take(now)
+                        bucket.take(now)
+                        waiter.future.set_result(None)
+                        delay = 0.0
+                        break
+                    delay = min(delay, chat_delay)
+                if delay == 0.0:
+                    continue
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        samples = sorted(self._wait_samples)
+        return {
+            "queue_depth": len(self._waiting),
+            "max_queue_depth": self.max_queue_depth,
+            "sent": self.sent,
+            "dropped": dict(self.dropped),
+            "retry_after": self.retry_after,
+            "wait_seconds_avg": self.wait_seconds_total / self.sent if self.sent else 0.0,
+            "wait_seconds_p95": samples[int(len(samples) * 0.95) - 1] if samples else 0.0,
+            "wait_seconds_max": self.wait_seconds_max,
+        }
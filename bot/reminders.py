@@ -0,0 +1,271 @@
+"""
+Надійні нагадування бота
+
+Нагадування зберігаються в MongoDB (колекція reminders) і переживають
+перезапуск. Один диспетчер на процес забирає прострочені нагадування
+пачками з атомарним «захопленням», тож кілька реплік бота не надсилають
+одне нагадування двічі. У кожного користувача щонайбільше одне
+очікуване нагадування: нове замінює попереднє.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+from bot.metrics import REMINDERS
+from bot.outbound import PRIORITY_REMINDER
+
+logger = logging.getLogger(__name__)
+
+MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
+MONGODB_DB_NAME = os.getenv("MONGODB_DB_NAME", "blockmate")
+# Скільки нагадувань забирати з бази за один прохід
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", "100"))
+# Максимальна пауза між перевірками бази (нагадування інших реплік)
+REMINDER_POLL_SECONDS = float(os.getenv("REMINDER_POLL_SECONDS", "5"))
+# Захоплене, але не надіслане за цей час нагадування забирає інший диспетчер
+REMINDER_CLAIM_TIMEOUT_SECONDS = int(os.getenv("REMINDER_CLAIM_TIMEOUT_SECONDS", "60"))
+REMINDER_MAX_ATTEMPTS = int(os.getenv("REMINDER_MAX_ATTEMPTS", "5"))
+REMINDER_RETRY_BASE_SECONDS = float(os.getenv("REMINDER_RETRY_BASE_SECONDS", "30"))
+
+REMINDER_TEXT = (
+    "⏰ Час вийшов! Запланований час використання соцмережі минув.\n\n"
+    "Рекомендую закрити додаток та повернутись до своїх цілей. 💪"
+)
+
+PENDING = "pending"
+CLAIMED = "claimed"
+
+
+class ReminderStore:
+    """Колекція нагадувань у MongoDB"""
+
+    def __init__(self, collection: AsyncIOMotorCollection):
+        self.collection = collection
+
+    async def ensure_indexes(self):
+        # Пошук прострочених нагадувань
+        await self.collection.create_index([("status", ASCENDING), ("due_at", ASCENDING)])
+        # Одне очікуване нагадування на користувача
+        await self.collection.create_index(
+            "telegram_id",
+            unique=True,
+            partialFilterExpression={"status": PENDING},
+            name="telegram_id_pending_unique",
+        )
+
+    async def schedule(self, telegram_id: int, chat_id: int, due_at: datetime):
+        """Створення або заміна очікуваного нагадування користувача"""
+        query = {"telegram_id": telegram_id, "status": PENDING}
+        update = {
+            "$set": {"chat_id": chat_id, "due_at": due_at, "attempts": 0},
+            "$setOnInsert": {"created_at": datetime.utcnow()},
+        }
+        try:
+            await self.collection.update_one(query, update, upsert=True)
+        except DuplicateKeyError:
+            # Паралельний upsert уже створив документ — оновлюємо його
+            await self.collection.update_one(query, update)
+
+    async def cancel(self, telegram_id: int) -> bool:
+        """Скасування очікуваного нагадування користувача"""
+        result = await self.collection.delete_one({"telegram_id": telegram_id, "status": PENDING})
+        return result.deleted_count > 0
+
+    async def next_due(self) -> Optional[datetime]:
+        doc = await self.collection.find_one(
+            {"status": PENDING}, {"due_at": 1}, sort=[("due_at", ASCENDING)]
+        )
+        return doc["due_at"] if doc else None
+
+    async def claim_due(self, now: datetime, limit: int = REMINDER_BATCH_SIZE) -> List[Dict]:
+        """
+        Атомарне захоплення пачки прострочених нагадувань
+
+        Документи позначаються унікальним токеном; оновлення повторно
+        перевіряє умову, тож документ дістанеться лише одному диспетчеру.
+        """
+        stale = now - timedelta(seconds=REMINDER_CLAIM_TIMEOUT_SECONDS)
+        due = {"$or": [
+            {"status": PENDING, "due_at": {"$lte": now}},
+            {"status": CLAIMED, "claimed_at": {"$lte": stale}},
+        ]}
+        cursor = self.collection.find(due, {"_id": 1}).sort("due_at", ASCENDING).limit(limit)
+        ids = [doc["_id"] async for doc in cursor]
+        if not ids:
+            return []
+
+        token = uuid.uuid4().hex
+        await self.collection.update_many(
+            {"_id": {"$in": ids}, **due},
+            {"$set": {"status": CLAIMED, "claimed_at": now, "claim": token}},
+        )
+        # Перечитуємо за _id (індекс), а токен відсікає захоплені іншим диспетчером
+        return await self.collection.find({"_id": {"$in": ids}, "claim": token}).to_list(length=None)
+
+    async def complete(self, reminder: Dict):
+        await self.collection.delete_one({"_id": reminder["_id"], "claim": reminder["claim"]})
+
+    async def retry_later(self, reminder: Dict, due_at: datetime, count_attempt: bool = True):
+        """Повернення нагадування в чергу після невдалої спроби"""
+        update = {
+            "$set": {"status": PENDING, "due_at": due_at},
+            "$unset": {"claim": "", "claimed_at": ""},
+        }
+        if count_attempt:
+            update["$inc"] = {"attempts": 1}
+        try:
+            await self.collection.update_one({"_id": reminder["_id"], "claim": reminder["claim"]}, update)
+        except DuplicateKeyError:
+            # Користувач уже має новіше нагадування — старе не потрібне
+            await self.complete(reminder)
+
+
+class ReminderDispatcher:
+    """
+    Єдиний фоновий диспетчер нагадувань
+
+    Спить до найближчого терміну (індекс по due_at виконує роль купи),
+    але не довше за REMINDER_POLL_SECONDS; schedule() будить його, якщо
+    нове нагадування настає раніше.
+    """
+
+    def __init__(self, store: ReminderStore, bot: Bot):
+        self.store = store
+        self.bot = bot
+        self._wakeup = asyncio.Event()
+        self._next_wakeup: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.failed = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def schedule(self, telegram_id: int, chat_id: int, minutes: int) -> datetime:
+        due_at = datetime.utcnow() + timedelta(minutes=minutes)
+        await self.store.schedule(telegram_id, chat_id, due_at)
+        if self._next_wakeup is None or due_at < self._next_wakeup:
+            self._wakeup.set()
+        return due_at
+
+    async def cancel(self, telegram_id: int) -> bool:
+        return await self.store.cancel(telegram_id)
+
+    async def _run(self):
+        while True:
+            try:
+                batch = await self.store.claim_due(datetime.utcnow())
+                if batch:
+                    await asyncio.gather(*(self._deliver(reminder) for reminder in batch))
+                    if len(batch) >= REMINDER_BATCH_SIZE:
+                        # Можливо, є ще прострочені — без паузи
+                        continue
+                next_due = await self.store.next_due()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Reminder dispatcher error: {e}")
+                next_due = None
+
+            now = datetime.utcnow()
+            delay = REMINDER_POLL_SECONDS
+            if next_due is not None:
+                delay = min(delay, max(0.0, (next_due - now).total_seconds()))
+            self._next_wakeup = now + timedelta(seconds=delay)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, reminder: Dict):
+        try:
+            # Нагадування поступаються інтерактивним відповідям у черзі відправки
+            await self.bot.send_message(
+                chat_id=reminder["chat_id"],
+                text=REMINDER_TEXT,
+                rate_limit_args={"priority": PRIORITY_REMINDER},
+            )
+        except RetryAfter as e:
+            REMINDERS.labels("retry").inc()
+            await self.store.retry_later(
+                reminder, datetime.utcnow() + timedelta(seconds=e.retry_after), count_attempt=False
+            )
+            return
+        except (Forbidden, BadRequest) as e:
+            # Бот заблокований або чат недоступний — повтор не допоможе
+            logger.warning(f"Dropping reminder for chat {reminder['chat_id']}: {e}")
+            self.failed += 1
+            REMINDERS.labels("dropped").inc()
+            await self.store.complete(reminder)
+            return
+        except Exception as e:
+            attempts = reminder.get("attempts", 0) + 1
+            self.failed += 1
+            if attempts >= REMINDER_MAX_ATTEMPTS:
+                logger.error(f"Giving up on reminder for chat {reminder['chat_id']}: {e}")
+                REMINDERS.labels("failed").inc()
+                await self.store.complete(reminder)
+            else:
+                logger.warning(f"Error sending reminder (attempt {attempts}): {e}")
+                REMINDERS.labels("retry").inc()
+                delay = REMINDER_RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+                await self.store.retry_later(reminder, datetime.utcnow() + timedelta(seconds=delay))
+            return
+
+        self.sent += 1
+        REMINDERS.labels("sent").inc()
+        await self.store.complete(reminder)
+
+    def stats(self) -> Dict:
+        return {"sent": self.sent, "failed": self.failed}
+
+
+_client: Optional[AsyncIOMotorClient] = None
+_dispatcher: Optional[ReminderDispatcher] = None
+
+
+async def start_reminders(bot: Bot) -> ReminderDispatcher:
+    """Підключення до MongoDB та запуск диспетчера нагадувань"""
+    global _client, _dispatcher
+    _client = AsyncIOMotorClient(MONGODB_URL)
+    store = ReminderStore(_client[MONGODB_DB_NAME]["reminders"])
+    await store.ensure_indexes()
+    _dispatcher = ReminderDispatcher(store, bot)
+    _dispatcher.start()
+    return _dispatcher
+
+
+def get_reminders() -> ReminderDispatcher:
+    if _dispatcher is None:
+        raise RuntimeError("Reminder dispatcher is not started")
+    return _dispatcher
+
+
+async def stop_reminders():
+    global _client, _dispatcher
+    if _dispatcher is not None:
+        await _dispatcher.stop()
+    if _client is not None:
+        _client.close()
+    _client = None
+    _dispatcher = None
@@ -0,0 +1,74 @@
+"""
+Кеш сесій користувачів на боці бота
+
+Зберігає, що користувач уже зареєстрований, чи налаштовані в нього цілі
+та версію профілю з backend. Дозволяє не реєструвати користувача на
+кожен /start і не надсилати /validate, який гарантовано не має сенсу.
+"""
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from bot.metrics import SESSION_CACHE
+
+BOT_SESSION_CACHE_MAX_ENTRIES = int(os.getenv("BOT_SESSION_CACHE_MAX_ENTRIES", "100000"))
+BOT_SESSION_CACHE_TTL_SECONDS = float(os.getenv("BOT_SESSION_CACHE_TTL_SECONDS", "3600"))
+# Стан «цілей ще немає» живе коротше: цілі могли задати через іншу репліку
+BOT_SESSION_NO_GOALS_TTL_SECONDS = float(os.getenv("BOT_SESSION_NO_GOALS_TTL_SECONDS", "60"))
+
+
+class SessionCache:
+    """LRU-кеш сесій з TTL та обмеженням кількості записів"""
+
+    def __init__(
+        self,
+        max_entries: int = BOT_SESSION_CACHE_MAX_ENTRIES,
+        ttl_seconds: float = BOT_SESSION_CACHE_TTL_SECONDS,
+        no_goals_ttl_seconds: float = BOT_SESSION_NO_GOALS_TTL_SECONDS,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.no_goals_ttl_seconds = no_goals_ttl_seconds
+        self._data: "OrderedDict[int, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, telegram_id: int) -> Optional[Dict[str, Any]]:
+        entry = self._data.get(telegram_id)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._data[telegram_id]
+            self.misses += 1
+            SESSION_CACHE.labels("miss").inc()
+            return None
+        self._data.move_to_end(telegram_id)
+        self.hits += 1
+        SESSION_CACHE.labels("hit").inc()
+        return entry[1]
+
+    def set(self, telegram_id: int, has_goals: bool, profile_version: int = 0):
+        """Запам'ятовує зареєстрованого користувача та стан його профілю"""
+        if self.max_entries <= 0:
+            return
+        ttl = self.ttl_seconds if has_goals else self.no_goals_ttl_seconds
+        session = {"has_goals": has_goals, "profile_version": profile_version}
+        self._data[telegram_id] = (time.monotonic() + ttl, session)
+        self._data.move_to_end(telegram_id)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def invalidate(self, telegram_id: int):
+        self._data.pop(telegram_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,203 @@
+import asyncio
+import hmac
+import logging
+import os
+import zlib
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+from fastapi import FastAPI, Request, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from telegram import Update
+from telegram.ext import Application, BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Публічна адреса вебхука, яку отримує Telegram (наприклад, https://bot.example.com/telegram)
+WEBHOOK_URL = os.getenv("BOT_WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("BOT_WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("BOT_WEBHOOK_SECRET")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("BOT_WEBHOOK_MAX_CONNECTIONS", "40"))
+# Чи реєструвати вебхук у Telegram під час старту (достатньо однієї репліки)
+WEBHOOK_REGISTER = os.getenv("BOT_WEBHOOK_REGISTER", "true").lower() == "true"
+MAX_CONCURRENT_UPDATES = int(os.getenv("BOT_MAX_CONCURRENT_UPDATES", "256"))
+
+# Репліки за балансувальником: внутрішні адреси всіх реплік та індекс поточної.
+# Оновлення користувача завжди обробляє одна й та сама репліка, тож порядок зберігається.
+REPLICA_URLS = [url.strip() for url in os.getenv("BOT_REPLICA_URLS", "").split(",") if url.strip()]
+REPLICA_INDEX = int(os.getenv("BOT_REPLICA_INDEX", "0"))
+FORWARD_PATH = "/internal/forward"
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def ordering_key(update: object) -> Optional[int]:
+    """Ключ, у межах якого оновлення обробляються строго по черзі"""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return update.effective_user.id
+    return None
+
+
+def _raw_ordering_key(data: Dict[str, Any]) -> Optional[int]:
+    """ordering_key для сирого JSON оновлення (без побудови Update)"""
+    for value in data.values():
+        if not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat and "id" in chat:
+            return chat["id"]
+        user = value.get("from")
+        if user and "id" in user:
+            return user["id"]
+    return None
+
+
+def owner_replica(key: int, replicas: int) -> int:
+    return zlib.crc32(str(key).encode()) % replicas
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Паралельна обробка оновлень зі збереженням порядку в межах чату
+
+    Оновлення різних чатів обробляються конкурентно, а оновлення одного
+    чату — послідовно, в порядку надходження.
+    """
+
+    def __init__(self, max_concurrent_updates: int = MAX_CONCURRENT_UPDATES):
+        super().__init__(max_concurrent_updates)
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._waiters: Dict[int, int] = {}
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = ordering_key(update)
+        if key is None:
+            await coroutine
+            return
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                await coroutine
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                del self._locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+def _secret_matches(request: Request, secret: str) -> bool:
+    return hmac.compare_digest(request.headers.get(SECRET_HEADER, "").encode(), secret.encode())
+
+
+def create_webhook_app(
+    application: Application,
+    replica_urls: Optional[List[str]] = None,
+    stats: Optional[Callable[[], Dict[str, Any]]] = None,
+) -> FastAPI:
+    """
+    ASGI-застосунок, що приймає оновлення Telegram через вебхук
+
+    Оновлення перевіряються за секретним токеном і кладуться в чергу
+    application; обробка йде у фоні через PerChatUpdateProcessor.
+    Без BOT_WEBHOOK_SECRET застосунок не створюється: інакше будь-хто
+    міг би надсилати підроблені оновлення.
+    """
+    if not WEBHOOK_SECRET:
+        raise ValueError("BOT_WEBHOOK_SECRET must be set in webhook mode")
+    secret = WEBHOOK_SECRET
+    replica_urls = REPLICA_URLS if replica_urls is None else replica_urls
+    peers: Dict[str, httpx.AsyncClient] = {}
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        # Як і run_polling: initialize → post_init → start
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        if replica_urls:
+            peers["client"] = httpx.AsyncClient(timeout=5.0)
+        if WEBHOOK_REGISTER and WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL,
+                secret_token=secret,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+            )
+            logger.info(f"Webhook registered at {WEBHOOK_URL}")
+        try:
+            yield
+        finally:
+            if "client" in peers:
+                await peers["client"].aclose()
+            await application.stop()
+            await application.shutdown()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
+
+    app = FastAPI(title="BlockMate Bot Webhook", lifespan=lifespan)
+
+    async def enqueue(data: Dict[str, Any]) -> Response:
+        update = Update.de_json(data, application.bot)
+        await application.update_queue.put(update)
+        return Response(status_code=200)
+
+    @app.post(WEBHOOK_PATH)
+    async def telegram_webhook(request: Request):
+        """Прийом оновлення від Telegram"""
+        if not _secret_matches(request, secret):
+            return Response(status_code=403)
+
+        data = await request.json()
+        key = _raw_ordering_key(data)
+        if replica_urls and key is not None:
+            owner = owner_replica(key, len(replica_urls))
+            if owner != REPLICA_INDEX:
+                try:
+                    forwarded = await peers["client"].post(
+                        f"{replica_urls[owner]}{FORWARD_PATH}",
+                        json=data,
+                        headers={SECRET_HEADER: secret},
+                    )
+                    # Не 200 — Telegram повторить доставку пізніше
+                    return Response(status_code=forwarded.status_code)
+                except httpx.HTTPError as e:
+                    logger.warning(f"Replica {owner} unavailable, processing update locally: {e}")
+
+        return await enqueue(data)
+
+    @app.post(FORWARD_PATH)
+    async def forwarded_update(request: Request):
+        """Прийом оновлення, переспрямованого іншою реплікою"""
+        if not _secret_matches(request, secret):
+            return Response(status_code=403)
+        return await enqueue(await request.json())
+
+    @app.get("/metrics")
+    async def metrics():
+        return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+    @app.get("/healthz")
+    async def healthz():
+        health = {"status": "ok", "replica": REPLICA_INDEX, "pending_updates": application.update_queue.qsize()}
+        rate_limiter = application.bot.rate_limiter
+        if rate_limiter is not None and hasattr(rate_limiter, "stats"):
+            health["outbound"] = rate_limiter.stats()
+        if stats is not None:
+            health["backend"] = stats()
+        return health
+
+    return app
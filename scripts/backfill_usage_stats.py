@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Перерахунок денних і тижневих лічильників використання з історії
+
+Читає бакети validation_history курсором, відсортованим за користувачем,
+тож у пам'яті тримаються лише лічильники одного користувача. Лічильники
+кожного користувача замінюються перерахованими, тому повторний запуск
+безпечний. Записи, додані під час перерахунку, можуть не врахуватися —
+запускайте в години низького навантаження.
+
+Використання:
+    python -m scripts.backfill_usage_stats [--telegram-id 123] [--dry-run] [--batch-size 200]
+"""
+import argparse
+import asyncio
+import sys
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from backend.database import get_database
+from backend.models.user import USAGE_PERIODS, UsageStats, as_datetime
+from backend.services.model_router import detect_app
+
+Rollups = Dict[Tuple[str, datetime], Dict[str, int]]
+
+
+def add_item(rollups: Rollups, item: dict):
+    """Додавання одного запису історії до лічильників користувача"""
+    if "app" not in item:
+        # Записи, збережені до появи поля app
+        item["app"] = detect_app(item.get("request", ""))
+    timestamp = as_datetime(item.get("timestamp"))
+    for field, value in UsageStats.increments([item]).items():
+        for period, period_start in USAGE_PERIODS.items():
+            counters = rollups.setdefault((period, period_start(timestamp)), {})
+            counters[field] = counters.get(field, 0) + value
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--telegram-id", type=int, default=None, help="лише один користувач")
+    parser.add_argument("--dry-run", action="store_true", help="лише порахувати лічильники")
+    parser.add_argument("--batch-size", type=int, default=200, help="бакетів за один round trip курсора")
+    args = parser.parse_args()
+    
+    db = await get_database()
+    usage = UsageStats(db)
+    await usage.ensure_indexes()
+    
+    bucket_filter = {} if args.telegram_id is None else {"telegram_id": args.telegram_id}
+    cursor = db.validation_history.find(
+        bucket_filter,
+        {"telegram_id": 1, "items": 1},
+        sort=[("telegram_id", 1), ("timestamp", 1)],
+        batch_size=args.batch_size,
+    )
+    
+    users_seen = 0
+    items_seen = 0
+    rollups_written = 0
+    current_user: Optional[int] = None
+    rollups: Rollups = {}
+    
+    async def flush_user():
+        nonlocal users_seen, rollups_written
+        if current_user is None:
+            return
+        users_seen += 1
+        rollups_written += len(rollups) if args.dry_run else await usage.rebuild(current_user, rollups)
+        if users_seen % 1000 == 0:
+            print(f"… оброблено користувачів: {users_seen}, записів: {items_seen}")
+    
+    async for bucket in cursor:
+        if bucket["telegram_id"] != current_user:
+            await flush_user()
+            current_user = bucket["telegram_id"]
+            rollups = {}
+        for item in bucket.get("items", []):
+            add_item(rollups, item)
+            items_seen += 1
+    await flush_user()
+    
+    action = "Пораховано" if args.dry_run else "Перераховано"
+    print(f"✅ {action} {rollups_written} лічильників з {items_seen} записів у {users_seen} користувачів")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Видалення дублікатів users.telegram_id
+
+Дублікати не дають створити унікальний індекс telegram_id, і backend
+без нього не стартує. Для кожного telegram_id лишається один документ:
+з найбільшою profile_version, потім з найсвіжішим updated_at, потім
+найновіший за _id; решта видаляється, після чого звичайний індекс
+telegram_id_1 (від старту з USERS_ALLOW_DUPLICATE_IDS) замінюється
+унікальним. Повна історія та лічильники зберігаються окремо за
+telegram_id і не втрачаються. Стару вбудовану історію спершу слід
+перенести (scripts.migrate_history).
+
+Використання:
+    python -m scripts.dedup_users [--dry-run]
+"""
+import argparse
+import asyncio
+import sys
+from datetime import datetime
+
+from backend.database import get_database
+from backend.models.user import UserModel
+
+
+def keeper_key(user: dict):
+    """Ключ сортування: документ з найбільшим значенням лишається"""
+    return (
+        user.get("profile_version") or 0,
+        user.get("updated_at") or user.get("created_at") or datetime.min,
+        user["_id"],
+    )
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="лише показати дублікати")
+    args = parser.parse_args()
+
+    db = await get_database()
+
+    groups = 0
+    removed = 0
+    cursor = db.users.aggregate([
+        {"$group": {"_id": "$telegram_id", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ])
+    async for group in cursor:
+        users = await db.users.find(
+            {"_id": {"$in": group["ids"]}},
+            {"profile_version": 1, "updated_at": 1, "created_at": 1},
+        ).to_list(None)
+        users.sort(key=keeper_key, reverse=True)
+        extra = [user["_id"] for user in users[1:]]
+        groups += 1
+        print(f"telegram_id {group['_id']}: лишаємо {users[0]['_id']}, видаляємо {len(extra)}")
+        if not args.dry_run:
+            result = await db.users.delete_many({"_id": {"$in": extra}})
+            removed += result.deleted_count
+        else:
+            removed += len(extra)
+
+    action = "Знайдено" if args.dry_run else "Видалено"
+    print(f"✅ {action} {removed} дублікатів у {groups} користувачів")
+    if args.dry_run:
+        return 0
+
+    if not await UserModel(db).ensure_unique_telegram_id_index():
+        print("❌ Унікальний індекс telegram_id не створено: з'явилися нові дублікати, запустіть ще раз")
+        return 1
+    print("✅ Унікальний індекс telegram_id створено")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Міграція вбудованої історії валідацій у колекцію validation_history
+
+Переносить записи з масиву users.history у денні бакети, після чого
+залишає в документі користувача лише HISTORY_RECENT_LIMIT останніх записів.
+Кожен крок ідемпотентний, тож повторний запуск (зокрема після збою
+посеред міграції) не дублює записи.
+
+Використання:
+    python -m scripts.migrate_history [--dry-run] [--batch-size 500]
+"""
+import argparse
+import asyncio
+import sys
+
+from bson import ObjectId
+
+from backend.database import get_database
+from backend.models.user import ValidationHistory, HISTORY_RECENT_LIMIT, as_datetime
+
+
+async def migrate_user(db, history: ValidationHistory, user: dict, dry_run: bool) -> int:
+    """
+    Міграція історії одного користувача, повертає кількість перенесених записів
+
+    Кроки ідемпотентні: спершу записам у документі користувача
+    присвоюються _id з позначкою legacy (лише якщо масив не змінився),
+    потім у бакети копіюються ті з них, яких там ще немає, і лише
+    після цього позначені записи замінюються останніми без позначки.
+    """
+    items = user.get("history", [])
+    untagged = [item for item in items if "_id" not in item]
+    pending = [item for item in items if item.get("legacy")]
+    if not untagged and not pending:
+        return 0
+    
+    if dry_run:
+        return len(untagged) + len(pending)
+    
+    if untagged:
+        tagged_history = []
+        for item in items:
+            if "_id" not in item:
+                item = {**item, "_id": ObjectId(), "legacy": True, "timestamp": as_datetime(item.get("timestamp"))}
+                pending.append(item)
+            tagged_history.append(item)
+        result = await db.users.update_one(
+            {"_id": user["_id"], "history": items},
+            {"$set": {"history": tagged_history}}
+        )
+        if result.matched_count == 0:
+            # Історію змінили паралельно — користувач обробиться при наступному запуску
+            return 0
+    
+    entries = [(user["telegram_id"], item) for item in pending]
+    copied = await history.existing_item_ids(entries)
+    to_copy = [{k: v for k, v in item.items() if k != "legacy"} for item in pending if item["_id"] not in copied]
+    if to_copy:
+        await history.insert_buckets(user["telegram_id"], to_copy)
+    
+    # Збій між цими оновленнями лише вкоротить список останніх записів
+    recent = sorted(
+        ({k: v for k, v in item.items() if k != "legacy"} for item in pending),
+        key=lambda i: i["timestamp"]
+    )[-HISTORY_RECENT_LIMIT:]
+    await db.users.update_one(
+        {"_id": user["_id"]},
+        {"$pull": {"history": {"legacy": True}}}
+    )
+    await db.users.update_one(
+        {"_id": user["_id"], "history._id": {"$nin": [item["_id"] for item in recent]}},
+        {"$push": {"history": {
+            "$each": recent,
+            "$sort": {"timestamp": 1},
+            "$slice": -HISTORY_RECENT_LIMIT,
+        }}}
+    )
+    return len(pending)
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="лише порахувати записи")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    
+    db = await get_database()
+    history = ValidationHistory(db)
+    await history.ensure_indexes()
+    
+    users_seen = 0
+    items_moved = 0
+    cursor = db.users.find(
+        {"history": {"$elemMatch": {"$or": [{"_id": {"$exists": False}}, {"legacy": True}]}}},
+        {"telegram_id": 1, "history": 1},
+        batch_size=args.batch_size,
+    )
+    async for user in cursor:
+        moved = await migrate_user(db, history, user, args.dry_run)
+        users_seen += 1
+        items_moved += moved
+        if users_seen % 1000 == 0:
+            print(f"… оброблено користувачів: {users_seen}, записів: {items_moved}")
+    
+    action = "Знайдено" if args.dry_run else "Перенесено"
+    print(f"✅ {action} {items_moved} записів історії у {users_seen} користувачів")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,31 @@
+from backend.services.rule_classifier import RuleClassifier
+
+USER_CONTEXT = {
+    "goals": ["вивчити Python"],
+    "allowed_usecases": ["відповісти на повідомлення"],
+    "forbidden_usecases": ["instagram", "скрол стрічки"],
+}
+
+
+def test_forbidden_phrase_denies_locally():
+    result = RuleClassifier().classify(1, "хочу в instagram", USER_CONTEXT)
+
+    assert result is not None
+    assert result["decision"] == "deny"
+    assert result["source"] == "rules"
+
+
+def test_near_miss_token_does_not_deny():
+    # "install" має той самий стем "insta", що й "instagram"
+    classifier = RuleClassifier()
+    result = classifier.classify(1, "треба install оновлення для ноутбука, хвилин десять", USER_CONTEXT)
+
+    assert result is None
+    assert classifier.fast_deny == 0
+
+
+def test_allowed_phrase_allows_locally():
+    result = RuleClassifier().classify(1, "відповісти на повідомлення", USER_CONTEXT, duration_minutes=5)
+
+    assert result is not None
+    assert result["decision"] == "allow"